@@ -0,0 +1,258 @@
+import math
+import random
+from itertools import product
+from sequential_analysis import METRICS, RunningMean, session_values
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Estimands the allocator can target:
+#   best_arm            - Thompson sampling: sessions go to cells in proportion to P(cell is best)
+#   effect              - Treatment - Control averaged over (persona, model) strata
+#   interaction:<model> - the treatment effect on <model> minus the average effect on the other models
+# For the two contrasts, sessions go where they shrink the contrast's standard error the
+# most (Neyman allocation: share of cell i proportional to |c_i| * sd_i).
+DEFAULT_ALLOCATION = {
+    "estimand": "best_arm",
+    "metric": "success",   # a key of sequential_analysis.session_values
+    "batch_size": 16,      # sessions assigned per batch (one posterior update per batch)
+    "burn_in": 2,          # uniform sessions per cell before the first adaptive batch
+    "floor": 0.1,          # share of every batch spread uniformly, so every propensity stays > 0
+    "target_se": None,     # contrasts: stop once the standard error is below this
+    "target_prob": 0.95,   # best_arm: stop once the leading cell is best with this probability
+    "draws": 4000,         # Monte Carlo draws for P(best)
+}
+
+def factor_cells(factors):
+    return [tuple(cell) for cell in product(factors["variants"], factors["personas"], factors["models"])]
+
+def unit_cell(unit):
+    return (unit["variant"], unit["persona"], unit["model"])
+
+# ==========================================
+# POSTERIORS
+# ==========================================
+class CellPosterior:
+    """
+    Posterior of one cell's mean. Binary metrics: Beta(1 + s, 1 + f). Counts: normal
+    approximation with the cell's variance shrunk towards the pooled one (2 pseudo-sessions),
+    so a cell with few, identical outcomes does not look certain.
+    """
+    PSEUDO = 2
+
+    def __init__(self, binary):
+        self.binary = binary
+        self.stats = RunningMean()
+
+    def add(self, x):
+        self.stats.add(x)
+
+    @property
+    def n(self):
+        return self.stats.n
+
+    def mean(self, prior_mean):
+        n = self.stats.n
+        if self.binary:
+            return (1 + self.stats.mean * n) / (2 + n)
+        return (self.PSEUDO * prior_mean + self.stats.mean * n) / (self.PSEUDO + n)
+
+    def unit_sd(self, prior_var):
+        """
+        Per-session standard deviation (what Neyman allocation weighs by).
+        """
+        if self.binary:
+            p = self.mean(0.5)
+            return math.sqrt(p * (1 - p))
+        n = self.stats.n
+        var = (self.PSEUDO * prior_var + max(n - 1, 0) * self.stats.variance) / (self.PSEUDO + max(n - 1, 0))
+        return math.sqrt(var)
+
+    def sample(self, rng, prior_mean, prior_var):
+        if self.binary:
+            s = self.stats.mean * self.stats.n
+            return rng.betavariate(1 + s, 1 + self.stats.n - s)
+        return rng.gauss(self.mean(prior_mean), self.unit_sd(prior_var) / math.sqrt(self.PSEUDO + self.stats.n))
+
+class FactorPosteriors:
+    """
+    One CellPosterior per (variant, persona, model) cell, fed with finished sessions.
+    """
+    def __init__(self, cells, metric):
+        self.metric = metric
+        self.cells = {cell: CellPosterior(METRICS[metric]["binary"]) for cell in cells}
+        self.pooled = RunningMean()
+
+    def add(self, cell, values):
+        x = values[self.metric]
+        self.cells[cell].add(x)
+        self.pooled.add(x)
+
+    @property
+    def n(self):
+        return self.pooled.n
+
+    @property
+    def prior(self):
+        return self.pooled.mean, max(self.pooled.variance, 1e-6) if self.pooled.n > 1 else 1.0
+
+# ==========================================
+# ENGINES
+# ==========================================
+class ThompsonAllocation:
+    """
+    Batched Thompson sampling for the best cell. A cell's propensity is the share of
+    posterior draws in which it is best, so a batch assigns in proportion to P(best).
+    """
+    def __init__(self, config):
+        self.config = config
+        self.higher_is_better = METRICS[config["metric"]]["higher_is_better"]
+
+    def p_best(self, posteriors, rng):
+        prior_mean, prior_var = posteriors.prior
+        cells = list(posteriors.cells)
+        wins = dict.fromkeys(cells, 0)
+        sign = 1 if self.higher_is_better else -1
+        for _ in range(self.config["draws"]):
+            draws = [sign * posteriors.cells[c].sample(rng, prior_mean, prior_var) for c in cells]
+            wins[cells[draws.index(max(draws))]] += 1
+        return {c: w / self.config["draws"] for c, w in wins.items()}
+
+    def weights(self, posteriors, batch_size, rng):
+        return self.p_best(posteriors, rng)
+
+    def status(self, posteriors, rng):
+        probs = self.p_best(posteriors, rng)
+        leader = max(probs, key=probs.get)
+        return {"leader": list(leader), "p_best": round(probs[leader], 4),
+                "done": probs[leader] >= self.config["target_prob"]}
+
+class ContrastAllocation:
+    """
+    Neyman allocation for a linear contrast sum(c_i * mean_i) over cells: after the next
+    batch every cell should hold a share |c_i| sd_i / sum(|c| sd) of the sessions, so the
+    batch goes to the cells furthest below their share.
+    """
+    def __init__(self, config, cells):
+        self.config = config
+        self.contrast = contrast_weights(config["estimand"], cells)
+
+    def standard_error(self, posteriors):
+        _, prior_var = posteriors.prior
+        total = 0.0
+        for cell, c in self.contrast.items():
+            post = posteriors.cells[cell]
+            total += c ** 2 * post.unit_sd(prior_var) ** 2 / max(post.n, 1)
+        return math.sqrt(total)
+
+    def estimate(self, posteriors):
+        prior_mean, _ = posteriors.prior
+        return sum(c * posteriors.cells[cell].mean(prior_mean) for cell, c in self.contrast.items())
+
+    def weights(self, posteriors, batch_size, rng):
+        _, prior_var = posteriors.prior
+        share = {cell: abs(c) * posteriors.cells[cell].unit_sd(prior_var) for cell, c in self.contrast.items()}
+        norm = sum(share.values()) or 1.0
+        total = posteriors.n + batch_size
+        need = {cell: max(share[cell] / norm * total - posteriors.cells[cell].n, 0.0) for cell in share}
+        return need if sum(need.values()) > 0 else share
+
+    def status(self, posteriors, rng):
+        se = self.standard_error(posteriors)
+        target = self.config["target_se"]
+        return {"estimate": round(self.estimate(posteriors), 4), "se": round(se, 4),
+                "done": target is not None and se <= target}
+
+def contrast_weights(estimand, cells):
+    """
+    Cell weights of the `effect` / `interaction:<model>` contrasts.
+    """
+    variants = sorted({v for v, _, _ in cells})
+    control, treatment = ("Control", "Treatment") if {"Control", "Treatment"} <= set(variants) else variants[:2]
+    strata = sorted({(p, m) for _, p, m in cells})
+    sign = {control: -1.0, treatment: 1.0}
+    if estimand == "effect":
+        return {cell: sign.get(cell[0], 0.0) / len(strata) for cell in cells}
+    if estimand.startswith("interaction:"):
+        focus = estimand.split(":", 1)[1]
+        focus_strata = [s for s in strata if s[1] == focus]
+        other_strata = [s for s in strata if s[1] != focus]
+        if not focus_strata or not other_strata:
+            raise ValueError(f"Interaction estimand needs '{focus}' and at least one other model in the plan.")
+        weights = {}
+        for cell in cells:
+            w = 1.0 / len(focus_strata) if cell[2] == focus else -1.0 / len(other_strata)
+            weights[cell] = sign.get(cell[0], 0.0) * w
+        return weights
+    raise ValueError(f"Unknown estimand '{estimand}' (best_arm, effect, interaction:<model>)")
+
+def make_engine(config, cells):
+    if config["estimand"] == "best_arm":
+        return ThompsonAllocation(config)
+    return ContrastAllocation(config, cells)
+
+# ==========================================
+# ALLOCATOR
+# ==========================================
+class Allocator:
+    """
+    Turns finished sessions into the next batch of cell assignments. Every assigned unit
+    carries the probability its cell had in that batch (`propensity`), which is what the
+    analysis needs to reweight (ipw_mean_difference).
+    """
+    def __init__(self, factors, config):
+        self.config = {**DEFAULT_ALLOCATION, **config}
+        self.cells = factor_cells(factors)
+        self.engine = make_engine(self.config, self.cells)
+
+    def posteriors(self, units, results):
+        """
+        `results` maps session_uuid -> (outcome, steps, is_fixed) of the finished sessions.
+        """
+        posteriors = FactorPosteriors(self.cells, self.config["metric"])
+        for unit in units:
+            if unit["session_uuid"] in results:
+                posteriors.add(unit_cell(unit), session_values(*results[unit["session_uuid"]]))
+        return posteriors
+
+    def propensities(self, posteriors, batch_size, rng):
+        weights = self.engine.weights(posteriors, batch_size, rng)
+        norm = sum(weights.values())
+        floor = self.config["floor"]
+        k = len(self.cells)
+        if norm <= 0:
+            return {cell: 1.0 / k for cell in self.cells}
+        return {cell: (1 - floor) * weights.get(cell, 0.0) / norm + floor / k for cell in self.cells}
+
+    def next_batch(self, posteriors, batch_size, rng):
+        """
+        Returns [(cell, propensity)] for `batch_size` new sessions.
+        """
+        probs = self.propensities(posteriors, batch_size, rng)
+        cells = list(probs)
+        drawn = rng.choices(cells, weights=[probs[c] for c in cells], k=batch_size)
+        return [(cell, probs[cell]) for cell in drawn]
+
+    def status(self, posteriors, rng):
+        return {"sessions": posteriors.n, **self.engine.status(posteriors, rng)}
+
+# ==========================================
+# ANALYSIS
+# ==========================================
+def ipw_mean_difference(df, column, variant_col="Variant", propensity_col="Propensity",
+                        control="Control", treatment="Treatment"):
+    """
+    Hajek (self-normalized IPW) estimate of mean(Treatment) - mean(Control) over the
+    uniform factor design, from a metrics table of an adaptively allocated run.
+    """
+    weights = 1.0 / df[propensity_col].astype(float)
+    values = df[column].astype(float)
+    means = {}
+    for variant in (control, treatment):
+        mask = df[variant_col] == variant
+        means[variant] = (weights[mask] * values[mask]).sum() / weights[mask].sum()
+    return means[treatment] - means[control]
+
+def batch_rng(seed, batch):
+    # Deterministic per batch, so a resumed run draws the same batch it would have
+    return random.Random(f"{seed}:{batch}")
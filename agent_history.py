@@ -0,0 +1,181 @@
+import hashlib
+
+# ==========================================
+# PROMPT VIEW
+# ==========================================
+class PromptMessages(list):
+    """
+    The standardized message list sent to a provider ({'role': 'user'|'assistant', 'content': str}),
+    plus what a provider needs to make use of prompt caching:
+
+    * stable_prefix - number of leading messages that never change during the session
+    * native()      - provider-format messages, each converted once and reused on later calls
+
+    It is a plain list otherwise, so it goes anywhere a history is expected.
+    """
+    def __init__(self, messages=(), stable_prefix=0):
+        super().__init__(messages)
+        self.stable_prefix = stable_prefix
+        self._native = {}
+
+    def native(self, key, convert):
+        """
+        Returns the messages converted with `convert`, converting only those appended since the last call.
+        """
+        converted = self._native.setdefault(key, [])
+        for message in self[len(converted):]:
+            converted.append(convert(message))
+        return converted
+
+    def prefix_digest(self):
+        blob = "\x1e".join(f"{m['role']}\x1f{m['content']}" for m in self[:self.stable_prefix])
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def rewrite_from(self, index, messages):
+        """
+        Replaces everything from `index` on (used when old turns are compacted).
+        """
+        del self[index:]
+        for converted in self._native.values():
+            del converted[index:]
+        self.extend(messages)
+
+# ==========================================
+# POLICIES
+# ==========================================
+class HistoryPolicy:
+    """
+    Hooks called by ConversationHistory: `on_output` rewrites a tool output before it is
+    stored, `compact` may drop or summarize old turns after each append.
+    """
+    def on_output(self, text):
+        return text
+
+    def compact(self, history):
+        pass
+
+class TruncateToolOutput(HistoryPolicy):
+    """
+    Caps each tool output kept in context (the trace still logs it in full).
+    """
+    def __init__(self, max_chars=2000):
+        self.max_chars = max_chars
+
+    def on_output(self, text):
+        if len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}\n... [output truncated: showing {self.max_chars} of {len(text)} chars]"
+
+class SlidingWindow(HistoryPolicy):
+    """
+    Keeps the last `max_turns` turns. Turns are dropped in blocks of `slack`, so the
+    messages sent stay an append-only sequence (cacheable) between two drops.
+    """
+    def __init__(self, max_turns=8, slack=4):
+        self.max_turns = max_turns
+        self.slack = slack
+
+    def compact(self, history):
+        if len(history.turns) > self.max_turns + self.slack:
+            history.drop(len(history.turns) - self.max_turns)
+
+def summarize_turns(turns):
+    """
+    Default extractive summarizer: one line per step (thought, command, first line of the result).
+    """
+    lines = []
+    for turn in turns:
+        if turn["sql"] is None:
+            lines.append(f"- Step {turn['step']}: {turn['feedback']}")
+            continue
+        reasoning = " ".join(turn["reasoning"].split())[:160]
+        result = (turn["output"].strip().splitlines() or [""])[0][:160]
+        lines.append(f"- Step {turn['step']}: {reasoning} | SQL: {turn['sql']} | Result: {result}")
+    return lines
+
+class SummarizeOldTurns(HistoryPolicy):
+    """
+    Folds all but the last `keep_recent` turns into a summary message, `chunk` turns at a time.
+    `summarizer(turns) -> list[str]` can be swapped for e.g. an LLM call.
+    """
+    def __init__(self, keep_recent=6, chunk=4, summarizer=summarize_turns):
+        self.keep_recent = keep_recent
+        self.chunk = chunk
+        self.summarizer = summarizer
+
+    def compact(self, history):
+        if len(history.turns) >= self.keep_recent + self.chunk:
+            history.fold(len(history.turns) - self.keep_recent, self.summarizer)
+
+# Policies are stateless, so presets can be shared between agents
+HISTORY_POLICIES = {
+    "full": (),
+    "truncate": (TruncateToolOutput(),),
+    "window": (TruncateToolOutput(), SlidingWindow()),
+    "summary": (TruncateToolOutput(), SummarizeOldTurns()),
+}
+
+# ==========================================
+# CONVERSATION
+# ==========================================
+class ConversationHistory:
+    """
+    Owns an agent's context: the static prefix (system instructions, goal, schema), an
+    optional summary of compacted turns, and the recent turns. `messages` is updated in
+    place, so the prefix stays byte-identical for the whole session and provider-format
+    conversions are only done for new messages.
+    """
+    SUMMARY_HEADER = "SUMMARY OF EARLIER STEPS (older turns were compacted):"
+
+    def __init__(self, context, policies=()):
+        self.policies = policies
+        self.turns = []
+        self.summary = []
+        self.omitted = 0
+        self.messages = PromptMessages([{"role": "user", "content": context}], stable_prefix=1)
+
+    @staticmethod
+    def _turn_messages(turn):
+        if turn["sql"] is None:
+            return [{"role": "user", "content": turn["feedback"]}]
+        return [
+            {"role": "assistant", "content": f"Reasoning: {turn['reasoning']}\nSQL: {turn['sql']}"},
+            {"role": "user", "content": f"TERMINAL OUTPUT:\n{turn['output']}"},
+        ]
+
+    def _summary_messages(self):
+        lines = list(self.summary)
+        if self.omitted:
+            lines.append(f"- ({self.omitted} earlier steps omitted)")
+        return [{"role": "user", "content": "\n".join([self.SUMMARY_HEADER] + lines)}] if lines else []
+
+    def _append(self, turn):
+        self.turns.append(turn)
+        self.messages.extend(self._turn_messages(turn))
+        for policy in self.policies:
+            policy.compact(self)
+
+    def add_step(self, step, reasoning, sql, tool_output):
+        output = str(tool_output)
+        for policy in self.policies:
+            output = policy.on_output(output)
+        self._append({"step": step, "reasoning": reasoning, "sql": sql, "output": output})
+
+    def add_feedback(self, step, text):
+        self._append({"step": step, "reasoning": None, "sql": None, "feedback": text})
+
+    def _rebuild(self):
+        messages = self._summary_messages()
+        for turn in self.turns:
+            messages.extend(self._turn_messages(turn))
+        self.messages.rewrite_from(self.messages.stable_prefix, messages)
+
+    def drop(self, n):
+        self.omitted += n
+        del self.turns[:n]
+        self._rebuild()
+
+    def fold(self, n, summarizer):
+        self.summary.extend(summarizer(self.turns[:n]))
+        del self.turns[:n]
+        self._rebuild()
@@ -0,0 +1,244 @@
+import json
+import time
+import threading
+from collections import defaultdict
+
+# ==========================================
+# TOKEN USAGE
+# ==========================================
+def make_usage(prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+    """
+    Provider-neutral usage record. cached_tokens is the part of prompt_tokens served from a
+    provider-side prompt cache (billed at a discount), not our own response cache.
+    """
+    return {
+        "prompt_tokens": int(prompt_tokens or 0),
+        "completion_tokens": int(completion_tokens or 0),
+        "cached_tokens": int(cached_tokens or 0),
+    }
+
+def usage_total(usage):
+    return usage["prompt_tokens"] + usage["completion_tokens"]
+
+# ==========================================
+# SPANS / HOOKS
+# ==========================================
+# Hooks are plain callables receiving a finished Span. With no hook installed, emitting
+# a span is a single truthiness check.
+_hooks = []
+_hooks_lock = threading.Lock()
+# perf_counter() is only meaningful relative to itself; exporters get wall-clock starts
+_EPOCH = time.time() - time.perf_counter()
+
+class Span:
+    __slots__ = ("name", "start", "end", "attrs")
+
+    def __init__(self, name, start, end, attrs):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.attrs = attrs
+
+    @property
+    def duration_ms(self):
+        return (self.end - self.start) * 1000
+
+    @property
+    def wall_start(self):
+        return _EPOCH + self.start
+
+    def as_dict(self):
+        return {"name": self.name, "start": round(self.wall_start, 6), "duration_ms": round(self.duration_ms, 3), **self.attrs}
+
+def add_span_hook(hook):
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+def remove_span_hook(hook):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+def emit_span(name, start, end=None, **attrs):
+    """
+    Reports an interval measured with time.perf_counter() to every installed hook.
+    """
+    if not _hooks:
+        return
+    span = Span(name, start, time.perf_counter() if end is None else end, attrs)
+    for hook in list(_hooks):
+        try:
+            hook(span)
+        except Exception as e:
+            # An exporter must never take a session down with it
+            print(f"   ⚠️ Span hook {hook!r} failed: {e}")
+
+class span:
+    """
+    Context manager form: `with span("vm.setup", variant=v): ...`
+    """
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.attrs
+
+    def __exit__(self, *exc):
+        emit_span(self.name, self.start, **self.attrs)
+        return False
+
+class JsonlSpanExporter:
+    """
+    Hook that appends every span as one JSON line (e.g. for a trace viewer or a notebook).
+    """
+    def __init__(self, path):
+        self.path = path
+        self._f = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock:
+            self._f.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+class SpanProfile:
+    """
+    Hook that aggregates count / total / max duration per span name.
+    """
+    def __init__(self):
+        self.stats = defaultdict(lambda: [0, 0.0, 0.0])
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        ms = span.duration_ms
+        with self._lock:
+            entry = self.stats[span.name]
+            entry[0] += 1
+            entry[1] += ms
+            entry[2] = max(entry[2], ms)
+
+    def report(self):
+        print(f"   {'span':<16} {'count':>8} {'total ms':>12} {'mean ms':>10} {'max ms':>10}")
+        for name, (count, total, worst) in sorted(self.stats.items()):
+            print(f"   {name:<16} {count:>8} {total:>12.1f} {total / count:>10.2f} {worst:>10.2f}")
+
+# ==========================================
+# PER-STEP ACCOUNTING
+# ==========================================
+class CallStats:
+    """
+    What one model call of an agent step cost: tokens from the provider usage objects and
+    its wall time split into provider requests, scheduler queueing and retry backoff.
+    """
+    __slots__ = ("provider", "session", "model", "prompt_tokens", "completion_tokens", "cached_tokens",
+                 "request_ms", "queue_ms", "backoff_ms", "retries", "cache_hit", "history_messages", "history_chars",
+                 "failover", "error_classes", "breaker_state")
+
+    def __init__(self, provider, history, session=None):
+        self.provider = provider
+        self.session = session
+        # Model that produced the answer (None if every attempt failed)
+        self.model = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.request_ms = 0.0
+        self.queue_ms = 0.0
+        self.backoff_ms = 0.0
+        self.retries = 0
+        self.cache_hit = False
+        self.history_messages = len(history)
+        self.history_chars = sum(len(h["content"]) for h in history)
+        # Routing record of the call (model_health.Failover.trace_fields)
+        self.failover = None
+        self.error_classes = None
+        self.breaker_state = None
+
+    def add_usage(self, usage):
+        if usage:
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+            self.cached_tokens += usage["cached_tokens"]
+
+    def queued(self, start, model):
+        """
+        Records time spent waiting for a scheduler permit; returns the request start time.
+        """
+        now = time.perf_counter()
+        self.queue_ms += (now - start) * 1000
+        emit_span("llm.queue", start, now, session=self.session, provider=self.provider, model=model)
+        return now
+
+    def request_done(self, start, model, usage=None, status=None, error=None):
+        end = time.perf_counter()
+        self.request_ms += (end - start) * 1000
+        if error is None:
+            self.model = model
+            self.add_usage(usage)
+        else:
+            self.retries += 1
+        emit_span("llm.request", start, end, session=self.session, provider=self.provider, model=model,
+                  status=status, error=error, **(usage or {}))
+
+    def backed_off(self, start):
+        end = time.perf_counter()
+        self.backoff_ms += (end - start) * 1000
+        emit_span("llm.backoff", start, end, session=self.session, provider=self.provider)
+
+    def routed(self, route):
+        fields = route.trace_fields()
+        self.failover, self.error_classes, self.breaker_state = fields["failover"], fields["error_classes"], fields["breaker_state"]
+
+    def from_cache(self, model, usage):
+        self.cache_hit = True
+        self.model = model
+        self.add_usage(usage)
+
+    def trace_fields(self):
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "request_ms": int(round(self.request_ms)),
+            "queue_ms": int(round(self.queue_ms)),
+            "backoff_ms": int(round(self.backoff_ms)),
+            "retries": self.retries,
+            "answered_model": self.model,
+            "cache_hit": self.cache_hit,
+            "history_messages": self.history_messages,
+            "history_chars": self.history_chars,
+            "failover": self.failover,
+            "error_classes": self.error_classes,
+            "breaker_state": self.breaker_state,
+        }
+
+TOKEN_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+def session_totals(trace_log, assigned_model):
+    """
+    Sums the per-step accounting of a trace into the session-level metric columns. Token sums
+    are billed usage: steps answered from the LLM cache keep their recorded usage in the trace
+    (Cache_Hit) but add nothing here.
+    """
+    totals = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+              "request_ms": 0, "queue_ms": 0, "backoff_ms": 0, "retries": 0}
+    fallback_steps = circuit_steps = 0
+    for step in trace_log:
+        for field in totals:
+            if not (step.get("cache_hit") and field in TOKEN_FIELDS):
+                totals[field] += step.get(field, 0)
+        answered = step.get("answered_model")
+        if answered is not None and answered != assigned_model:
+            fallback_steps += 1
+        if step.get("breaker_state") not in (None, "closed"):
+            circuit_steps += 1
+    totals["fallback_steps"] = fallback_steps
+    totals["circuit_steps"] = circuit_steps
+    return totals
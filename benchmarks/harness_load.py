@@ -0,0 +1,221 @@
+"""
+End-to-end load benchmark of the experiment harness with the offline policy provider.
+
+Drives sessions through setup_virtual_machine -> OSAgent.repair_system -> execute_os_command
+-> logging and reports throughput, per-stage overhead and memory, so harness cost can be
+measured separately from model latency.
+
+    python -m benchmarks.harness_load --sessions 5000
+    python -m benchmarks.harness_load --sessions 2000 --latency-ms 50 --async --concurrency 128
+    python -m benchmarks.harness_load --sessions 2000 --error-429 0.05 --error-malformed 0.01
+    python -m benchmarks.harness_load --sessions 5000 --log-format csv
+    python -m benchmarks.harness_load --sessions 2000 --error-429 0.05 --profile-spans
+    python -m benchmarks.harness_load --sessions 500 --scenario datacenter
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import contextlib
+from collections import defaultdict
+
+import run_os_experiment as runner
+from os_agent import OSAgent
+from os_factory import setup_virtual_machine, execute_os_command, get_snapshot, RESULT_LIMITS, RESULT_FORMATS
+from scenarios import SCENARIOS, get_scenario
+from llm_providers import PolicyProvider, register_provider
+from experiment_plan import draw_unit
+from agent_telemetry import SpanProfile, add_span_hook
+from model_health import BREAKER_CONFIG, FAILOVER_POLICIES, DEFAULT_FAILOVER, health_stats
+
+STAGES = ["template", "vm_setup", "agent_loop", "provider", "kernel", "validate", "logging", "drain"]
+
+class TimedPolicyProvider(PolicyProvider):
+    """
+    PolicyProvider that accumulates wall time spent inside the provider call.
+    """
+    def __init__(self, timings, **kwargs):
+        super().__init__(**kwargs)
+        self.timings = timings
+
+    def complete(self, model, history, response_schema, temperature):
+        start = time.perf_counter()
+        try:
+            return super().complete(model, history, response_schema, temperature)
+        finally:
+            self.timings["provider"] += time.perf_counter() - start
+
+    async def acomplete(self, model, history, response_schema, temperature):
+        start = time.perf_counter()
+        try:
+            return await super().acomplete(model, history, response_schema, temperature)
+        finally:
+            self.timings["provider"] += time.perf_counter() - start
+
+def _prepare_session(timings, rng, scenario, limits):
+    unit = draw_unit(0, rng, runner.VARIANTS, runner.PERSONAS, runner.MODELS)
+    start = time.perf_counter()
+    task = get_scenario(scenario).task(unit["variant"], seed=unit["seed"])
+    conn = setup_virtual_machine(task.variant, scenario=scenario, params=task.params)
+    timings["vm_setup"] += time.perf_counter() - start
+
+    def vm_executor(sql):
+        t0 = time.perf_counter()
+        try:
+            return execute_os_command(conn, sql, task.variant, task.rules, limits)
+        finally:
+            timings["kernel"] += time.perf_counter() - t0
+
+    return unit, task, conn, vm_executor
+
+def _finish_session(timings, unit, task, model, conn, result):
+    outcome, steps, latency, trace_log = result
+    start = time.perf_counter()
+    is_fixed = task.check(conn)
+    conn.close()
+    timings["validate"] += time.perf_counter() - start
+
+    # Only the caller-side cost; the background writer's disk time shows up in "drain"
+    start = time.perf_counter()
+    runner.log_session({**unit, "model": model}, outcome, steps, is_fixed, latency, trace_log)
+    timings["logging"] += time.perf_counter() - start
+    return is_fixed, steps
+
+def run_sync(n_sessions, model, timings, rng, history="full", scenario="port_conflict", limits=None):
+    outcomes = []
+    for _ in range(n_sessions):
+        unit, task, conn, vm_executor = _prepare_session(timings, rng, scenario, limits)
+        agent = OSAgent(model, unit["persona"], history_policy=history, failover=runner.FAILOVER)
+
+        start = time.perf_counter()
+        result = agent.repair_system(task.goal, task.hint, vm_executor, max_steps=runner.MAX_STEPS)
+        timings["agent_loop"] += time.perf_counter() - start
+
+        outcomes.append(_finish_session(timings, unit, task, model, conn, result))
+    return outcomes
+
+async def _run_async(n_sessions, model, timings, concurrency, rng, history="full", scenario="port_conflict", limits=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = []
+
+    async def one():
+        async with semaphore:
+            unit, task, conn, vm_executor = _prepare_session(timings, rng, scenario, limits)
+            agent = OSAgent(model, unit["persona"], history_policy=history, failover=runner.FAILOVER)
+            start = time.perf_counter()
+            result = await agent.repair_system_async(task.goal, task.hint, vm_executor, max_steps=runner.MAX_STEPS)
+            # Includes time parked on the event loop behind other sessions
+            timings["agent_loop"] += time.perf_counter() - start
+            outcomes.append(_finish_session(timings, unit, task, model, conn, result))
+
+    await asyncio.gather(*[one() for _ in range(n_sessions)])
+    return outcomes
+
+def report(args, timings, outcomes, wall, peak_traced, profile=None):
+    n = len(outcomes)
+    steps = sum(s for _, s in outcomes)
+    fixed = sum(1 for f, _ in outcomes if f)
+    # Harness overhead inside the loop: everything that is neither the model nor the kernel
+    timings["agent_overhead"] = timings["agent_loop"] - timings["provider"] - timings["kernel"]
+
+    print(f"\n--- 📈 HARNESS LOAD BENCHMARK ({'async' if args.use_async else 'sync'}, model={args.model}, scenario={args.scenario}) ---")
+    print(f"Sessions:        {n}  (steps: {steps}, fixed: {fixed})")
+    print(f"Wall time:       {wall:.2f} s")
+    print(f"Throughput:      {n / wall:,.1f} sessions/s  |  {steps / wall:,.1f} steps/s")
+    print("Per-stage cost (mean per session):" + ("  [async: summed across concurrent sessions]" if args.use_async else ""))
+    for stage in STAGES + ["agent_overhead"]:
+        total = timings[stage]
+        print(f"   {stage:<15} {total / n * 1e6:>10.1f} µs   ({total:.3f} s total)")
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_mb = rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    print(f"Peak RSS:        {rss_mb:.1f} MB")
+    if peak_traced is not None:
+        print(f"Peak traced:     {peak_traced / (1024 * 1024):.1f} MB (tracemalloc)")
+    for health in health_stats():
+        print(f"Breaker {health['model']}: {health['state']}, error rate {health['error_rate']:.0%}, "
+              f"opened {health['trips']}x, {health['refused']} refused")
+    if profile is not None:
+        print("Telemetry spans:")
+        profile.report()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load benchmark of the harness.")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--model", default="policy-scripted", choices=["policy-scripted", "policy-random"])
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-429", type=float, default=0)
+    parser.add_argument("--error-503", type=float, default=0)
+    parser.add_argument("--error-malformed", type=float, default=0)
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--trace-memory", action="store_true", help="Track Python allocations (slower).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-format", choices=runner.LOG_FORMATS, default="parquet")
+    parser.add_argument("--history", choices=list(runner.HISTORY_POLICIES), default="full")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default="port_conflict")
+    parser.add_argument("--result-format", choices=RESULT_FORMATS, default=RESULT_LIMITS["format"])
+    parser.add_argument("--failover", choices=FAILOVER_POLICIES, default=DEFAULT_FAILOVER)
+    parser.add_argument("--profile-spans", action="store_true", help="Aggregate agent telemetry spans.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    rng = random.Random(args.seed)
+    timings = defaultdict(float)
+
+    error_rates = {"429": args.error_429, "503": args.error_503, "malformed": args.error_malformed}
+    register_provider(TimedPolicyProvider(
+        timings,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rates={k: v for k, v in error_rates.items() if v},
+        seed=args.seed,
+    ))
+    # Injected errors should exercise the retry path, not the wall clock
+    OSAgent.RETRY_DELAY = 0
+    OSAgent.ERROR_DELAY = 0
+    BREAKER_CONFIG["open_seconds"] = 0
+    runner.FAILOVER = args.failover
+    profile = add_span_hook(SpanProfile()) if args.profile_spans else None
+
+    limits = {**RESULT_LIMITS, "format": args.result_format}
+    with tempfile.TemporaryDirectory() as log_dir:
+        runner.configure_logging(log_dir, "bench", fmt=args.log_format)
+        runner.setup_logging()
+        # The template is built once per process; keep it apart from the per-session VM cost
+        start = time.perf_counter()
+        for variant in runner.VARIANTS:
+            get_snapshot(variant, args.scenario)
+        timings["template"] += time.perf_counter() - start
+        if args.trace_memory:
+            tracemalloc.start()
+
+        start = time.perf_counter()
+        # The agent prints per session; keep it out of the measurement
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            if args.use_async:
+                outcomes = asyncio.run(_run_async(args.sessions, args.model, timings, args.concurrency, rng, args.history,
+                                                  args.scenario, limits))
+            else:
+                outcomes = run_sync(args.sessions, args.model, timings, rng, args.history, args.scenario, limits)
+            drain_start = time.perf_counter()
+            runner.close_logging()
+            timings["drain"] += time.perf_counter() - drain_start
+        wall = time.perf_counter() - start
+
+        peak_traced = None
+        if args.trace_memory:
+            peak_traced = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+    report(args, timings, outcomes, wall, peak_traced, profile)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+"""
+Micro and end-to-end benchmark suite of the harness, with baseline regression tracking.
+
+Every benchmark times one entry point at several scales (rows per VM, steps per session,
+sessions per run, trace size). Results go to a JSON file and are compared against a
+saved baseline. A case whose best time is slower than the baseline by more than the
+threshold is a regression, and the exit code is 1.
+
+    python -m benchmarks.suite                          # every benchmark at its default scales
+    python -m benchmarks.suite --quick                  # smallest scale of each (a few seconds)
+    python -m benchmarks.suite --only kernel logging    # a subset
+    python -m benchmarks.suite --save-baseline          # run and record benchmarks/baseline.json
+    python -m benchmarks.suite --threshold 0.10         # flag cases more than 10% slower than the baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import itertools
+import tempfile
+import contextlib
+import statistics
+from datetime import datetime
+from collections import defaultdict
+
+import numpy as np
+from scipy import stats
+import run_os_experiment as runner
+from os_agent import OSAgent
+from os_factory import setup_virtual_machine, execute_os_command, get_snapshot, RESULT_LIMITS
+from scenarios import Datacenter, get_scenario, register_scenario
+from llm_providers import register_provider
+from exp_logging import read_log, log_paths
+from exp_analysis import prepare, srm_test, analyze
+from visualize_trace import generate_viewer
+from benchmarks.harness_load import TimedPolicyProvider, run_sync
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+RESULTS_DIR = os.path.join(runner.LOG_DIR, "benchmarks")
+
+DEFAULT_CONFIG = {
+    "repeats": 5,          # timed runs per case; the best one is compared (least disturbed by noise)
+    "warmup": 1,           # untimed runs first (imports, caches, the VM template)
+    "threshold": 0.25,     # relative slowdown of the best time that counts as a regression
+    "min_delta_s": 0.005,  # ...and only if it is also slower by this much (shared machines jitter by a few ms)
+}
+
+# ==========================================
+# REGISTRY
+# ==========================================
+# name -> {"fn": fn(**params) -> case, "scales": [params], "quick": [params], "repeats": int or None}
+BENCHMARKS = {}
+
+def benchmark(name, scales, quick=None, repeats=None):
+    """
+    Registers fn(**params) -> case, a dict:
+      run     - the timed callable
+      setup   - untimed callable before every run (optional)
+      units   - work items per run (VMs, statements, sessions, ...), for the per-unit time
+      unit    - their name
+      info    - extra facts recorded with the result (rows per VM, trace bytes, ...)
+      cleanup - called once after the last run (optional)
+    """
+    def register(fn):
+        BENCHMARKS[name] = {"fn": fn, "scales": scales, "quick": quick or scales[:1], "repeats": repeats}
+        return fn
+    return register
+
+def case_key(name, params):
+    return f"{name}[{','.join(f'{k}={v}' for k, v in params.items())}]"
+
+@contextlib.contextmanager
+def quiet():
+    # Sessions, writers and the viewer print progress; keep it out of the timings
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+# ==========================================
+# FIXTURES
+# ==========================================
+def bench_scenario(services):
+    """
+    A registered datacenter scenario of the given size (~3.5 rows per service across its tables).
+    """
+    name = f"bench_datacenter_{services}"
+    try:
+        return get_scenario(name)
+    except ValueError:
+        return register_scenario(Datacenter(n_services=services, n_background=services * 3 // 2,
+                                            n_listeners=services // 2, name=name))
+
+def vm_rows(conn):
+    tables = [t for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+    return sum(conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in tables)
+
+def synthetic_trace(rng, steps):
+    """
+    A session trace shaped like the agent's: reasoning, SQL and a table or status output per step.
+    """
+    trace = []
+    for step in range(1, steps + 1):
+        read = rng.random() < 0.6
+        output = ("service_name | status | port_required\n" + "\n".join(
+            f"svc_{rng.randrange(10000):04d} | {rng.choice(['RUNNING', 'STOPPED'])} | {rng.randrange(1024, 65536)}"
+            for _ in range(rng.randint(1, 12)))) if read else "SUCCESS. Rows affected: 1"
+        trace.append({
+            "step": step,
+            "reasoning": f"Step {step}: checking the service state and its dependencies before changing anything.",
+            "sql": "SELECT * FROM System_Services WHERE status='STOPPED'" if read
+                   else "UPDATE System_Services SET status='RUNNING' WHERE service_name='svc_0042'",
+            "tool_output": output,
+            "latency_ms": rng.uniform(200, 2000),
+            "request_ms": rng.uniform(200, 2000),
+            "tool_ms": rng.uniform(0.05, 2),
+            "prompt_tokens": rng.randint(400, 4000),
+            "completion_tokens": rng.randint(40, 200),
+            "answered_model": "policy-scripted",
+        })
+    return trace
+
+def synthetic_sessions(n, steps, seed=0):
+    """
+    n (unit, outcome, steps, is_fixed, latency, trace) tuples for runner.log_session.
+    """
+    rng = random.Random(seed)
+    sessions = []
+    for i in range(n):
+        unit = {"session_uuid": f"{i:08x}", "variant": rng.choice(runner.VARIANTS), "persona": rng.choice(runner.PERSONAS),
+                "model": rng.choice(runner.MODELS)}
+        n_steps = rng.randint(max(1, steps // 2), steps)
+        fixed = rng.random() < 0.7
+        outcome = "CLAIMED_FIX" if fixed or rng.random() < 0.3 else "MAX_STEPS_REACHED"
+        trace = synthetic_trace(rng, n_steps)
+        sessions.append((unit, outcome, n_steps, fixed, sum(s["latency_ms"] for s in trace), trace))
+    return sessions
+
+def write_run(log_dir, run_id, sessions, fmt):
+    """
+    Logs sessions as a run through the runner's writer; returns (metrics_path, trace_path).
+    """
+    with quiet():
+        runner.configure_logging(log_dir, run_id, fmt=fmt)
+        runner.setup_logging()
+        for session in sessions:
+            runner.log_session(*session)
+        runner.close_logging()
+    return log_paths(log_dir, run_id, fmt)
+
+def path_bytes(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+# ==========================================
+# MICROBENCHMARKS
+# ==========================================
+@benchmark("vm_setup", scales=[{"services": 500}, {"services": 2000}, {"services": 8000}])
+def bench_vm_setup(services, vms=20):
+    """
+    setup_virtual_machine: restore the template image and apply a session's draw.
+    """
+    scenario = bench_scenario(services)
+    for variant in runner.VARIANTS:
+        get_snapshot(variant, scenario.name)
+    tasks = [scenario.task(runner.VARIANTS[i % 2], seed=i) for i in range(vms)]
+    probe = setup_virtual_machine(tasks[0].variant, scenario=scenario.name, params=tasks[0].params)
+    rows = vm_rows(probe)
+    probe.close()
+
+    def run():
+        for task in tasks:
+            setup_virtual_machine(task.variant, scenario=scenario.name, params=task.params).close()
+    return {"run": run, "units": vms, "unit": "vm", "info": {"rows_per_vm": rows}}
+
+@benchmark("kernel", scales=[{"services": 500}, {"services": 2000}, {"services": 8000}])
+def bench_kernel(services):
+    """
+    execute_os_command: a scripted session plus the unfiltered scans of a careless agent, per variant,
+    through the result guard.
+    """
+    scenario = bench_scenario(services)
+    sessions = []
+    for i, variant in enumerate(runner.VARIANTS):
+        task = scenario.task(variant, seed=i)
+        steps, explore = scenario.script(variant, task.goal)
+        sessions.append((task, [sql for _, sql, _ in steps] + explore))
+    state = {}
+
+    def setup():
+        for conn in state.values():
+            conn.close()
+        state.update({task.variant: setup_virtual_machine(task.variant, scenario=scenario.name, params=task.params)
+                      for task, _ in sessions})
+
+    def run():
+        for task, statements in sessions:
+            conn = state[task.variant]
+            for sql in statements:
+                execute_os_command(conn, sql, task.variant, task.rules, RESULT_LIMITS)
+
+    def cleanup():
+        for conn in state.values():
+            conn.close()
+    return {"run": run, "setup": setup, "cleanup": cleanup, "units": sum(len(s) for _, s in sessions), "unit": "statement"}
+
+@benchmark("logging", scales=[{"format": fmt, "sessions": n, "steps": steps}
+                              for fmt in ("csv", "parquet") for n, steps in ((1000, 8), (1000, 24), (10000, 8))],
+           quick=[{"format": "csv", "sessions": 1000, "steps": 8}])
+def bench_logging(format, sessions, steps):
+    """
+    runner.log_session through the background writer, drain included.
+    """
+    data = synthetic_sessions(sessions, steps)
+    tmp = tempfile.TemporaryDirectory()
+    runs = itertools.count()
+
+    def run():
+        write_run(tmp.name, f"bench_{next(runs)}", data, format)
+
+    def cleanup():
+        tmp.cleanup()
+    return {"run": run, "cleanup": cleanup, "units": sessions, "unit": "session",
+            "info": {"trace_rows": sum(s[2] for s in data)}}
+
+@benchmark("viewer", scales=[{"sessions": 1000}, {"sessions": 10000}], repeats=3)
+def bench_viewer(sessions, steps=12):
+    """
+    visualize_trace.generate_viewer over a parquet trace.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    metrics_path, trace_path = write_run(tmp.name, "bench", synthetic_sessions(sessions, steps), "parquet")
+
+    def run():
+        with quiet():
+            generate_viewer(trace_path, metrics_path, out_dir=os.path.join(tmp.name, "viewer"))
+
+    def cleanup():
+        tmp.cleanup()
+    return {"run": run, "cleanup": cleanup, "units": sessions, "unit": "session",
+            "info": {"trace_bytes": path_bytes(trace_path)}}
+
+@benchmark("notebook", scales=[{"sessions": 1000}, {"sessions": 100000}])
+def bench_notebook(sessions):
+    """
+    The computations of the notebook's analysis cells (load, feature engineering, SRM check,
+    conditional efficiency test) on a CSV metrics file. Plotting is not measured.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    metrics_path, _ = write_run(tmp.name, "bench", synthetic_sessions(sessions, 2), "csv")
+
+    def run():
+        df = prepare(read_log(metrics_path))
+        srm_test(df["Variant"])
+        success_df = df[df["Is_Success"] == 1]
+        stats.mannwhitneyu(success_df[success_df["Variant"] == "Treatment"]["Steps_Taken"],
+                           success_df[success_df["Variant"] == "Control"]["Steps_Taken"], alternative="two-sided")
+        df.groupby("Variant")["Hallucination"].mean()
+
+    def cleanup():
+        tmp.cleanup()
+    return {"run": run, "cleanup": cleanup, "units": sessions, "unit": "session"}
+
+@benchmark("analysis", scales=[{"sessions": 10000, "n_boot": 0}, {"sessions": 10000, "n_boot": 2000},
+                               {"sessions": 100000, "n_boot": 0}],
+           quick=[{"sessions": 10000, "n_boot": 0}], repeats=3)
+def bench_analysis(sessions, n_boot):
+    """
+    exp_analysis.analyze: SRM, effects, HTE and heterogeneity in one pass.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    metrics_path, _ = write_run(tmp.name, "bench", synthetic_sessions(sessions, 2), "parquet")
+    df = read_log(metrics_path)
+    tmp.cleanup()
+    return {"run": lambda: analyze(df, n_boot=n_boot), "units": sessions, "unit": "session"}
+
+# ==========================================
+# END TO END
+# ==========================================
+@benchmark("e2e", scales=[{"scenario": "port_conflict", "sessions": 200}, {"scenario": "datacenter", "sessions": 50}],
+           quick=[{"scenario": "port_conflict", "sessions": 50}], repeats=3)
+def bench_e2e(scenario, sessions):
+    """
+    Whole sessions with the local scripted policy provider: VM, agent loop, kernel, check and logging.
+    """
+    tmp = tempfile.TemporaryDirectory()
+    timings = defaultdict(float)
+    register_provider(TimedPolicyProvider(timings, seed=0))
+    for variant in runner.VARIANTS:
+        get_snapshot(variant, scenario)
+    runs = itertools.count()
+
+    def run():
+        with quiet():
+            runner.configure_logging(tmp.name, f"bench_{next(runs)}", fmt="parquet")
+            runner.setup_logging()
+            run_sync(sessions, "policy-scripted", timings, random.Random(0), scenario=scenario, limits=RESULT_LIMITS)
+            runner.close_logging()
+
+    def cleanup():
+        tmp.cleanup()
+    return {"run": run, "cleanup": cleanup, "units": sessions, "unit": "session"}
+
+# ==========================================
+# RUNNER
+# ==========================================
+def measure(case, repeats, warmup):
+    times = []
+    for i in range(warmup + repeats):
+        if case.get("setup"):
+            case["setup"]()
+        start = time.perf_counter()
+        case["run"]()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    if case.get("cleanup"):
+        case["cleanup"]()
+    units = case.get("units", 1)
+    return {
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "runs_s": times,
+        "units": units,
+        "unit": case.get("unit", "call"),
+        "best_per_unit_us": min(times) / units * 1e6,
+        **({"info": case["info"]} if case.get("info") else {}),
+    }
+
+def run_suite(names=None, quick=False, repeats=None, warmup=DEFAULT_CONFIG["warmup"]):
+    """
+    Runs the selected benchmarks; returns the results document (machine, settings, per-case timings).
+    """
+    # Injected waits would measure the clock, not the harness
+    OSAgent.RETRY_DELAY = 0
+    OSAgent.ERROR_DELAY = 0
+    results = {}
+    for name in names or list(BENCHMARKS):
+        spec = BENCHMARKS[name]
+        for params in spec["quick"] if quick else spec["scales"]:
+            key = case_key(name, params)
+            n = repeats or spec["repeats"] or DEFAULT_CONFIG["repeats"]
+            with quiet():
+                case = spec["fn"](**params)
+            results[key] = {"benchmark": name, "params": params, **measure(case, n, warmup)}
+            r = results[key]
+            print(f"   ⏱️ {key:<52} best {r['best_s'] * 1e3:>9.1f} ms  "
+                  f"({r['best_per_unit_us']:,.1f} µs/{r['unit']})")
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": machine(),
+        "quick": quick,
+        "results": results,
+    }
+
+def machine():
+    return {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()}
+
+# ==========================================
+# BASELINE
+# ==========================================
+def compare(current, baseline, threshold=DEFAULT_CONFIG["threshold"], min_delta_s=DEFAULT_CONFIG["min_delta_s"]):
+    """
+    Per shared case: ratio of best times and a status (regression, improvement or ok).
+    """
+    rows = []
+    for key, result in current["results"].items():
+        if key not in baseline["results"]:
+            continue
+        before, now = baseline["results"][key]["best_s"], result["best_s"]
+        ratio = now / before if before > 0 else float("inf")
+        if ratio > 1 + threshold and now - before >= min_delta_s:
+            status = "regression"
+        elif ratio < 1 - threshold and before - now >= min_delta_s:
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append({"case": key, "baseline_s": before, "current_s": now, "ratio": ratio, "status": status})
+    return rows
+
+def print_comparison(rows, current, baseline, threshold):
+    print(f"\n--- 📊 VS BASELINE ({baseline['created']}, threshold +{threshold:.0%}) ---")
+    if current["machine"] != baseline["machine"]:
+        print("   ⚠️ The baseline was recorded on another machine or environment; ratios are indicative only.")
+    icons = {"regression": "🔴", "improvement": "🚀", "ok": "✅"}
+    for row in rows:
+        print(f"   {icons[row['status']]} {row['case']:<52} {row['baseline_s'] * 1e3:>9.1f} -> "
+              f"{row['current_s'] * 1e3:>9.1f} ms  (x{row['ratio']:.2f})")
+    regressions = [r for r in rows if r["status"] == "regression"]
+    print(f"   {len(regressions)} regression(s) in {len(rows)} compared case(s).")
+    return regressions
+
+def write_json(path, document):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, indent=1)
+
+# ==========================================
+# MAIN
+# ==========================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Harness benchmark suite with baseline regression tracking.")
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=None)
+    parser.add_argument("--quick", action="store_true", help="Smallest scale of each benchmark.")
+    parser.add_argument("--repeats", type=int, default=None, help="Timed runs per case (default: per benchmark).")
+    parser.add_argument("--out", default=None, help="Results file (default: os_logs/benchmarks/bench_<timestamp>.json).")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_CONFIG["threshold"])
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print(f"🏁 Benchmarks: {', '.join(args.only or BENCHMARKS)}{' (quick)' if args.quick else ''}")
+    current = run_suite(args.only, args.quick, args.repeats)
+
+    out = args.out or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare(current, baseline, args.threshold)
+        current["comparison"] = {"baseline": args.baseline, "threshold": args.threshold, "cases": rows}
+        regressions = print_comparison(rows, current, baseline, args.threshold)
+    elif not args.save_baseline:
+        print(f"\nℹ️ No baseline at {args.baseline}; record one with --save-baseline.")
+    write_json(out, current)
+    print(f"📄 Results: {out}")
+    if args.save_baseline:
+        write_json(args.baseline, current)
+        print(f"📌 Baseline saved: {args.baseline}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,295 @@
+import os
+import json
+import sqlite3
+import asyncio
+import argparse
+from datetime import datetime
+import pandas as pd
+import run_os_experiment as runner
+from os_agent import OSAgent, provider_for_model
+from os_factory import setup_virtual_machine, execute_os_command, LEGACY_RESULT_LIMITS
+from scenarios import get_scenario
+from model_health import DEFAULT_FAILOVER
+from experiment_plan import load_plan, plan_path
+from exp_logging import iter_log_batches, read_log, log_paths, log_columns
+from meta_memory import MetaMemory, MemoryHook
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LOG_DIR = runner.LOG_DIR
+TRACE_COLUMNS = ["Session_UUID", "Step_Num", "Reasoning", "SQL_Command", "Tool_Output", "Tool_Output_Kind"]
+
+# ==========================================
+# RECORDED SESSION
+# ==========================================
+def _tool_output(text, kind):
+    # Rows were logged as JSON; the agent saw (and the history holds) the Python objects
+    return json.loads(text) if kind == "rows" else text
+
+def load_session(run_id, session_uuid, log_dir=LOG_DIR):
+    """
+    Returns (unit, outcome, steps) of a recorded session: its plan unit (VM seed included),
+    its outcome and its trace as trace_log entries (step, reasoning, sql, tool_output).
+    """
+    plan = load_plan(plan_path(log_dir, run_id))
+    unit = next((u for u in plan["units"] if u["session_uuid"] == session_uuid), None)
+    if unit is None:
+        raise ValueError(f"Session {session_uuid} is not in the plan of run {run_id}.")
+    metrics_path, trace_path = log_paths(log_dir, run_id, plan.get("log_format", "csv"))
+
+    metrics = read_log(metrics_path, columns=[c for c in ["Session_UUID", "Outcome", "Memory_Recall"]
+                                              if c in log_columns(metrics_path)])
+    session = metrics[metrics["Session_UUID"] == session_uuid]
+    if session.empty:
+        raise ValueError(f"Session {session_uuid} has no logged result in run {run_id}.")
+    recalled = session["Memory_Recall"].iloc[0] if "Memory_Recall" in session else None
+
+    columns = [c for c in TRACE_COLUMNS if c in log_columns(trace_path)]
+    steps = []
+    for batch in iter_log_batches(trace_path, columns=columns):
+        rows = batch[batch["Session_UUID"] == session_uuid]
+        for row in rows.to_dict("records"):
+            steps.append({
+                "step": int(row["Step_Num"]),
+                "reasoning": row["Reasoning"],
+                "sql": row["SQL_Command"],
+                "tool_output": _tool_output(row["Tool_Output"], row.get("Tool_Output_Kind", "text")),
+            })
+    steps.sort(key=lambda s: s["step"])
+    context = {"max_steps": plan["max_steps"], "history_policy": plan.get("history_policy", "full"),
+               "scenario": plan.get("scenario", "port_conflict"),
+               "result_limits": plan.get("result_limits", LEGACY_RESULT_LIMITS),
+               "failover": plan.get("failover", DEFAULT_FAILOVER),
+               "memory": plan.get("memory"), "memory_recall": None if pd.isna(recalled) else recalled}
+    return {**unit, **context}, session["Outcome"].iloc[0], steps
+
+# ==========================================
+# SHARED PREFIX
+# ==========================================
+class BranchPoint:
+    """
+    The state of a recorded session after step k: the steps the agent had seen and a
+    serialized image of its VM. Every fork restores from it; nothing of the prefix is
+    recomputed or sent to a model again.
+    """
+    def __init__(self, unit, steps, k, image, divergences=0):
+        self.unit = unit
+        self.steps = steps[:k]
+        self.k = k
+        self.image = image
+        self.divergences = divergences
+
+    def restore_vm(self):
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.deserialize(self.image)
+        return conn
+
+    def save(self, path):
+        # A serialized image is a regular SQLite database file
+        with open(path, "wb") as f:
+            f.write(self.image)
+
+def session_task(unit):
+    # Same seed -> the recorded session's goal, kernel rules and checker
+    return get_scenario(unit["scenario"]).task(unit["variant"], seed=unit["seed"])
+
+def executed(step):
+    return step["reasoning"] != "API_FAILURE"
+
+def build_branch_point(unit, outcome, steps, k, snapshot=None):
+    """
+    Rebuilds the VM after step k by replaying the logged SQL through execute_os_command on a
+    fresh VM with the session's seed (or loads it from a saved `snapshot` file).
+    """
+    if not 0 <= k <= len(steps):
+        raise ValueError(f"Step {k} is outside the recorded session (0..{len(steps)}).")
+    if outcome == "CLAIMED_FIX" and k == len(steps):
+        raise ValueError("The last step is the fix claim; fork at an earlier step.")
+
+    if snapshot is not None:
+        with open(snapshot, "rb") as f:
+            return BranchPoint(unit, steps, k, f.read())
+
+    task = session_task(unit)
+    conn = setup_virtual_machine(unit["variant"], scenario=unit["scenario"], params=task.params)
+    divergences = 0
+    for step in steps[:k]:
+        if not executed(step):
+            continue
+        output = execute_os_command(conn, step["sql"], unit["variant"], task.rules, unit["result_limits"])
+        if output != step["tool_output"]:
+            # The kernel changed since the recording (or the VM is not the recorded one)
+            divergences += 1
+            print(f"   ⚠️ Step {step['step']} replays differently than recorded.")
+    image = conn.serialize()
+    conn.close()
+    return BranchPoint(unit, steps, k, image, divergences)
+
+# ==========================================
+# FORKS
+# ==========================================
+# A fork is a dict; every key is optional:
+#   name     - label in the manifest
+#   model    - continue with another model (default: the recorded one)
+#   persona  - continue with another persona
+#   feedback - replaces the tool output the agent saw at step k (e.g. another error message)
+#   chaos    - SQL statements run directly on the VM before the continuation
+#   repeats  - independent continuations of this fork
+def fork_units(branch, forks):
+    """
+    Expands forks into synthetic units (one per continuation) for the log writer.
+    """
+    units = []
+    for i, fork in enumerate(forks):
+        for r in range(fork.get("repeats", 1)):
+            units.append({
+                **branch.unit,
+                "index": len(units) + 1,
+                "session_uuid": f"{branch.unit['session_uuid']}-k{branch.k}-f{i}-r{r}",
+                "model": fork.get("model", branch.unit["model"]),
+                "persona": fork.get("persona", branch.unit["persona"]),
+                "fork": fork.get("name", f"fork{i}"),
+                "fork_spec": fork,
+                "parent": branch.unit["session_uuid"],
+                "branch_step": branch.k,
+                "propensity": None,
+                "batch": None,
+            })
+    return units
+
+def _prefix(branch, fork):
+    steps = [dict(step) for step in branch.steps]
+    if "feedback" in fork and steps:
+        steps[-1]["tool_output"] = fork["feedback"]
+    return steps
+
+def fork_memory(unit):
+    """
+    Memory hook of a fork: the recorded session's recall, verbatim, so the fork continues from
+    the same first prompt however much the index has grown since.
+    """
+    if unit["memory_recall"] is not None:
+        return lambda goal: unit["memory_recall"]
+    if unit["memory"]:
+        # Logged before schema v6: the best available is a recall from the index as it is now
+        print(f"   ⚠️ {unit['session_uuid']}: recall not logged, recalling again from {unit['memory']['path']}")
+        return MemoryHook(MetaMemory(unit["memory"]["path"]), unit["memory"]["k"], unit["scenario"], unit["variant"])
+    return None
+
+async def run_fork(branch, unit, semaphores, cache=None):
+    task = session_task(unit)
+    fork = unit["fork_spec"]
+    async with semaphores[provider_for_model(unit["model"])]:
+        conn = branch.restore_vm()
+        try:
+            for sql in fork.get("chaos", []):
+                conn.execute(sql)
+            conn.commit()
+            agent = OSAgent(unit["model"], unit["persona"], cache=cache, session_id=unit["session_uuid"],
+                            history_policy=unit["history_policy"], memory=fork_memory(unit), failover=unit["failover"])
+            agent.start(task.goal, task.hint, unit["max_steps"])
+            agent.replay(_prefix(branch, fork))
+            outcome, steps, latency, trace_log = await agent.resume_repair_async(
+                lambda sql: execute_os_command(conn, sql, task.variant, task.rules, unit["result_limits"]))
+            is_fixed = task.check(conn)
+        finally:
+            conn.close()
+    return outcome, steps, latency, trace_log, is_fixed
+
+async def _run_forks(branch, units, cache=None):
+    semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in runner.CONCURRENCY.items()}
+    return await asyncio.gather(*(run_fork(branch, unit, semaphores, cache) for unit in units), return_exceptions=True)
+
+def run_counterfactuals(run_id, session_uuid, k, forks, snapshot=None, save_snapshot=None, cache=None, log_dir=LOG_DIR):
+    """
+    Forks a recorded session after step k into parallel continuations and logs them as
+    sessions of a new run `cf_<session>_k<k>_<timestamp>`; returns the manifest.
+    """
+    unit, outcome, steps = load_session(run_id, session_uuid, log_dir)
+    branch = build_branch_point(unit, outcome, steps, k, snapshot)
+    if save_snapshot:
+        branch.save(save_snapshot)
+    cf_id = f"cf_{session_uuid}_k{k}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    units = fork_units(branch, forks)
+    print(f"🌿 {session_uuid} ({unit['model']}, {unit['variant']}, recorded {outcome} in {len(steps)} steps): "
+          f"{len(units)} continuations from step {k}")
+
+    runner.configure_logging(log_dir, cf_id, fmt=runner.LOG_FORMAT)
+    runner.setup_logging()
+    results = asyncio.run(_run_forks(branch, units, cache))
+    branches = []
+    try:
+        for fork_unit, result in zip(units, results):
+            entry = {key: fork_unit[key] for key in ("session_uuid", "fork", "model", "persona")}
+            entry["spec"] = fork_unit["fork_spec"]
+            if isinstance(result, Exception):
+                print(f"   ❌ {fork_unit['session_uuid']} crashed: {result}")
+                entry["error"] = str(result)
+            else:
+                outcome_, steps_, latency, trace_log, is_fixed = result
+                runner.log_session(fork_unit, outcome_, steps_, is_fixed, latency, trace_log)
+                entry.update(outcome=outcome_, steps=steps_, is_fixed=bool(is_fixed), new_steps=steps_ - k)
+                print(f"   {fork_unit['fork']:<12} {fork_unit['model']:<22} -> {outcome_} | Fixed? {is_fixed} | Steps: {steps_}")
+            branches.append(entry)
+    finally:
+        runner.close_logging()
+
+    manifest = {
+        "id": cf_id,
+        "parent_run": run_id,
+        "parent_session": session_uuid,
+        "parent_outcome": outcome,
+        "parent_steps": len(steps),
+        "branch_step": k,
+        "replay_divergences": branch.divergences,
+        "metrics": runner.METRICS_FILE,
+        "trace": runner.TRACE_FILE,
+        "branches": branches,
+    }
+    path = os.path.join(log_dir, f"os_counterfactual_{cf_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    print(f"📄 Manifest: {path}")
+    return manifest
+
+# ==========================================
+# MAIN
+# ==========================================
+def forks_from_args(args):
+    if args.forks:
+        with open(args.forks, encoding="utf-8") as f:
+            return json.load(f)
+    intervention = {}
+    if args.feedback is not None:
+        intervention["feedback"] = args.feedback
+    if args.chaos:
+        intervention["chaos"] = args.chaos
+    # The unchanged continuation is the within-trajectory control
+    forks = [{"name": "control", "repeats": args.repeats}]
+    for model in args.models or [None]:
+        fork = {"name": model or "intervention", **intervention, "repeats": args.repeats}
+        if model:
+            fork["model"] = model
+        if model or intervention:
+            forks.append(fork)
+    return forks
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fork a recorded session at step k into counterfactual continuations.")
+    parser.add_argument("run_id")
+    parser.add_argument("session_uuid")
+    parser.add_argument("--step", type=int, required=True, help="Keep steps 1..k, continue from k+1.")
+    parser.add_argument("--models", nargs="+", default=None, help="One fork per model.")
+    parser.add_argument("--feedback", default=None, help="Replace the tool output the agent saw at step k.")
+    parser.add_argument("--chaos", nargs="+", default=None, help="SQL run on the VM before continuing.")
+    parser.add_argument("--repeats", type=int, default=1, help="Continuations per fork.")
+    parser.add_argument("--forks", default=None, help="JSON file with a list of fork specs (overrides the flags).")
+    parser.add_argument("--snapshot", default=None, help="Restore the VM from this file instead of replaying SQL.")
+    parser.add_argument("--save-snapshot", default=None, help="Write the VM image at step k to this file.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    run_counterfactuals(args.run_id, args.session_uuid, args.step, forks_from_args(args),
+                        snapshot=args.snapshot, save_snapshot=args.save_snapshot)
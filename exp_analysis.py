@@ -0,0 +1,367 @@
+import os
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+from scipy import stats
+from exp_logging import read_log
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LOG_DIR = "os_logs"
+CONTROL, TREATMENT = "Control", "Treatment"
+
+# Metric -> column of prepare(df)
+METRICS = {
+    "steps": "Steps_Taken",
+    "success": "Is_Success",
+    "hallucination": "Hallucination",
+    "latency": "Total_Latency_ms",
+}
+# Model name prefix -> family (subgroup factor)
+MODEL_FAMILIES = {"gpt": "GPT", "gemini": "Gemini", "policy": "Policy"}
+
+DEFAULT_CONFIG = {
+    "alpha": 0.05,
+    "srm_alpha": 0.01,
+    "correction": "holm",     # holm | bonferroni | bh | none
+    "n_boot": 2000,           # bootstrap replicates; 0 = analytic CIs only
+    "max_atoms": 4096,        # metrics with at most this many distinct values are resampled as multinomial counts
+    "boot_cells": 1 << 22,    # resampled values held in memory at once otherwise
+    "seed": 0,
+}
+
+# ==========================================
+# FEATURES
+# ==========================================
+def prepare(df):
+    """
+    Adds Is_Success, Model_Family and Hallucination (vectorized; any log format or warehouse rows).
+    """
+    df = df.copy()
+    # String work runs on the distinct values only, then is broadcast back through the codes
+    codes, fixed = pd.factorize(df["Is_Actually_Fixed"], use_na_sentinel=False)
+    df["Is_Success"] = pd.Index(fixed).astype(str).isin(["True", "true", "1", "1.0"]).astype(int)[codes]
+    codes, models = pd.factorize(df["Model"].astype(str))
+    family = pd.Series(models).str.extract(f"(?i)({'|'.join(MODEL_FAMILIES)})", expand=False).str.lower()
+    df["Model_Family"] = family.map(MODEL_FAMILIES).fillna("Other").to_numpy()[codes]
+    df["Hallucination"] = (df["Outcome"] == "CLAIMED_FIX") & (df["Is_Success"] == 0)
+    return df
+
+# ==========================================
+# SAMPLE RATIO MISMATCH
+# ==========================================
+def srm_test(variants, expected=None, alpha=DEFAULT_CONFIG["srm_alpha"]):
+    """
+    Chi-square test of the variant counts against `expected` shares ({variant: share};
+    default: equal shares over Control, Treatment and any other observed variant).
+    """
+    counts = pd.Series(variants).value_counts()
+    if expected is None:
+        levels = [CONTROL, TREATMENT] + sorted(set(counts.index) - {CONTROL, TREATMENT})
+        expected = {level: 1.0 / len(levels) for level in levels}
+    levels = list(expected)
+    observed = np.array([counts.get(level, 0) for level in levels], dtype=float)
+    shares = np.array([expected[level] for level in levels], dtype=float)
+    _, p_value = stats.chisquare(observed, shares / shares.sum() * observed.sum())
+    return {"counts": dict(zip(levels, observed.astype(int).tolist())), "p_value": float(p_value),
+            "mismatch": bool(p_value < alpha)}
+
+# ==========================================
+# TWO-SAMPLE ESTIMATES
+# ==========================================
+# Every estimator works on sufficient statistics or on an (n units x m metrics) matrix, so all
+# metrics (and all subgroups) are computed at once.
+def welch(n0, s0, q0, n1, s1, q1, alpha=DEFAULT_CONFIG["alpha"]):
+    """
+    Treatment - Control difference in means from per-arm count, sum and sum of squares
+    (arrays of any shape): Welch SE, Satterthwaite df, t-test p-value and CI.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        m0, m1 = s0 / n0, s1 / n1
+        v0 = np.maximum(q0 - n0 * m0 ** 2, 0) / (n0 - 1) / n0
+        v1 = np.maximum(q1 - n1 * m1 ** 2, 0) / (n1 - 1) / n1
+        estimate = m1 - m0
+        se = np.sqrt(v0 + v1)
+        dof = (v0 + v1) ** 2 / (v0 ** 2 / (n0 - 1) + v1 ** 2 / (n1 - 1))
+        p_value = 2 * stats.t.sf(np.abs(estimate / se), dof)
+        half = stats.t.ppf(1 - alpha / 2, dof) * se
+    return {"control_mean": m0, "treatment_mean": m1, "estimate": estimate, "se": se,
+            "ci_low": estimate - half, "ci_high": estimate + half, "p_value": p_value}
+
+def cluster_robust(Y, treated, clusters, alpha=DEFAULT_CONFIG["alpha"]):
+    """
+    CR1 sandwich SE of the difference in means when units are correlated within clusters
+    (runs, parent sessions of counterfactual forks, ...); t test with G - 1 df.
+    """
+    codes, uniques = pd.factorize(clusters)
+    G = len(uniques)
+    n1, n0 = treated.sum(), (~treated).sum()
+    m1, m0 = Y[treated].mean(axis=0), Y[~treated].mean(axis=0)
+    # Influence of each unit on the estimate
+    psi = np.where(treated[:, None], (Y - m1) / n1, -(Y - m0) / n0)
+    sums = np.zeros((G, Y.shape[1]))
+    np.add.at(sums, codes, psi)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        se = np.sqrt(G / (G - 1) * (sums ** 2).sum(axis=0))
+        estimate = m1 - m0
+        p_value = 2 * stats.t.sf(np.abs(estimate / se), G - 1)
+        half = stats.t.ppf(1 - alpha / 2, G - 1) * se
+    return {"estimate": estimate, "se": se, "ci_low": estimate - half, "ci_high": estimate + half, "p_value": p_value}
+
+def covariate_matrix(df, covariates):
+    # Categorical covariates (model, persona, ...) enter as indicators
+    parts = [df[c].astype(float).to_numpy()[:, None] if pd.api.types.is_numeric_dtype(df[c])
+             else pd.get_dummies(df[c].astype(str), drop_first=True).to_numpy(dtype=float) for c in covariates]
+    return np.hstack(parts) if parts else np.empty((len(df), 0))
+
+def cuped(Y, X):
+    """
+    CUPED / regression adjustment: Y - (X - mean X) theta, with theta fitted on the pooled units.
+    Only valid for covariates the treatment cannot affect. Returns (adjusted Y, variance reduction).
+    """
+    if X.shape[1] == 0:
+        return Y, np.zeros(Y.shape[1])
+    Xc = X - X.mean(axis=0)
+    theta = np.linalg.lstsq(Xc, Y - Y.mean(axis=0), rcond=None)[0]
+    adjusted = Y - Xc @ theta
+    with np.errstate(divide="ignore", invalid="ignore"):
+        reduction = 1 - adjusted.var(axis=0) / Y.var(axis=0)
+    return adjusted, np.nan_to_num(reduction)
+
+def bootstrap_means(y, n_boot, rng, max_atoms=DEFAULT_CONFIG["max_atoms"], boot_cells=DEFAULT_CONFIG["boot_cells"]):
+    """
+    n_boot resampled means of y. A resample of a metric with few distinct values (steps, binary
+    metrics) is a multinomial draw over those values, so its cost does not grow with n.
+    """
+    n = len(y)
+    values, counts = np.unique(y, return_counts=True)
+    if len(values) <= max_atoms:
+        return rng.multinomial(n, counts / n, size=n_boot) @ values / n
+    means = np.empty(n_boot)
+    chunk = max(1, boot_cells // n)
+    for start in range(0, n_boot, chunk):
+        stop = min(start + chunk, n_boot)
+        means[start:stop] = y[rng.integers(0, n, size=(stop - start, n))].mean(axis=1)
+    return means
+
+def bootstrap_ci(Y, treated, n_boot, rng, clusters=None, alpha=DEFAULT_CONFIG["alpha"],
+                 max_atoms=DEFAULT_CONFIG["max_atoms"], boot_cells=DEFAULT_CONFIG["boot_cells"]):
+    """
+    Percentile bootstrap CI of the difference in means per column of Y: arms resampled
+    independently, or whole clusters resampled (as a B x G weight matrix) when given.
+    """
+    if clusters is not None:
+        codes, uniques = pd.factorize(clusters)
+        G = len(uniques)
+        sums = [np.zeros((G, Y.shape[1])) for _ in range(2)]
+        sizes = [np.bincount(codes[~treated], minlength=G), np.bincount(codes[treated], minlength=G)]
+        np.add.at(sums[0], codes[~treated], Y[~treated])
+        np.add.at(sums[1], codes[treated], Y[treated])
+        diffs = np.empty((n_boot, Y.shape[1]))
+        chunk = max(1, boot_cells // G)
+        for start in range(0, n_boot, chunk):
+            stop = min(start + chunk, n_boot)
+            W = rng.multinomial(G, np.full(G, 1.0 / G), size=stop - start).astype(float)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                diffs[start:stop] = (W @ sums[1]) / (W @ sizes[1])[:, None] - (W @ sums[0]) / (W @ sizes[0])[:, None]
+    else:
+        diffs = np.column_stack([
+            bootstrap_means(Y[treated, j], n_boot, rng, max_atoms, boot_cells)
+            - bootstrap_means(Y[~treated, j], n_boot, rng, max_atoms, boot_cells)
+            for j in range(Y.shape[1])])
+    low, high = np.nanpercentile(diffs, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return low, high
+
+# ==========================================
+# MULTIPLE TESTING
+# ==========================================
+def adjust_pvalues(p, method=DEFAULT_CONFIG["correction"]):
+    """
+    Family-wise (holm, bonferroni) or false-discovery-rate (bh) adjusted p-values; NaNs are ignored.
+    """
+    p = np.asarray(p, dtype=float)
+    adjusted = np.full(p.shape, np.nan)
+    mask = ~np.isnan(p)
+    q = p[mask]
+    m = len(q)
+    if m == 0 or method == "none":
+        adjusted[mask] = q
+        return adjusted
+    if method == "bonferroni":
+        adjusted[mask] = np.minimum(q * m, 1.0)
+        return adjusted
+    order = np.argsort(q)
+    ranked = q[order]
+    if method == "holm":
+        ranked = np.maximum.accumulate(ranked * (m - np.arange(m)))
+    elif method == "bh":
+        ranked = np.minimum.accumulate((ranked * m / np.arange(1, m + 1))[::-1])[::-1]
+    else:
+        raise ValueError(f"Unknown correction '{method}' (holm, bonferroni, bh, none).")
+    out = np.empty(m)
+    out[order] = np.minimum(ranked, 1.0)
+    adjusted[mask] = out
+    return adjusted
+
+# ==========================================
+# ONE-PASS ANALYSIS
+# ==========================================
+def cell_moments(df, Y, metrics, keys):
+    """
+    One groupby over the units: count, sum and sum of squares of every metric per
+    (keys..., Variant) cell. Global and subgroup effects are sums of these cells.
+    """
+    frame = pd.DataFrame(np.hstack([Y, Y ** 2]), columns=metrics + [f"{m}^2" for m in metrics], index=df.index)
+    frame["n"] = 1
+    for key in keys + ["Variant"]:
+        frame[key] = df[key].to_numpy()
+    return frame.groupby(keys + ["Variant"], observed=True, sort=True).sum()
+
+def contrasts(moments, metrics, keys=(), alpha=DEFAULT_CONFIG["alpha"]):
+    """
+    Welch contrasts per level of `keys` (all units when empty) from cell_moments(), for all
+    levels and metrics at once. One row per (level, metric).
+    """
+    keys = list(keys)
+    if keys:
+        wide = moments.groupby(level=keys + ["Variant"], observed=True).sum().unstack("Variant", fill_value=0)
+    else:
+        wide = moments.groupby(level="Variant", observed=True).sum().unstack().to_frame().T
+
+    def arm(variant):
+        # (levels x metrics) count, sum and sum of squares of one arm; zeros when the arm is empty
+        def stat(columns):
+            return np.column_stack([wide[(c, variant)].to_numpy(dtype=float) if (c, variant) in wide.columns
+                                    else np.zeros(len(wide)) for c in columns])
+        return stat(["n"] * len(metrics)), stat(metrics), stat([f"{m}^2" for m in metrics])
+
+    (n0, s0, q0), (n1, s1, q1) = arm(CONTROL), arm(TREATMENT)
+    result = welch(n0, s0, q0, n1, s1, q1, alpha)
+    table = pd.DataFrame({"metric": np.tile(metrics, len(wide)), "n_control": n0.ravel().astype(int),
+                          "n_treatment": n1.ravel().astype(int), **{k: v.ravel() for k, v in result.items()}})
+    if keys:
+        levels = [" / ".join(map(str, level)) if isinstance(level, tuple) else str(level) for level in wide.index]
+        table.insert(0, "factor", " x ".join(keys))
+        table.insert(1, "level", np.repeat(levels, len(metrics)))
+    return table
+
+def heterogeneity(hte):
+    """
+    Cochran's Q test per (factor, metric): do the subgroup effects differ beyond chance?
+    """
+    rows = []
+    for (factor, metric), group in hte.dropna(subset=["se"]).query("se > 0").groupby(["factor", "metric"], sort=False):
+        w = 1.0 / group["se"].to_numpy() ** 2
+        est = group["estimate"].to_numpy()
+        q = float((w * (est - (w * est).sum() / w.sum()) ** 2).sum())
+        dof = len(group) - 1
+        rows.append({"factor": factor, "metric": metric, "subgroups": len(group), "Q": q,
+                     "p_value": float(stats.chi2.sf(q, dof)) if dof > 0 else np.nan})
+    return pd.DataFrame(rows, columns=["factor", "metric", "subgroups", "Q", "p_value"])
+
+def analyze(df, metrics=None, by=("Model_Family", "Persona"), covariates=(), cluster=None, expected=None, **config):
+    """
+    Full Treatment vs Control readout of a metrics table in one vectorized pass:
+      srm           - sample ratio mismatch test
+      effects       - per metric: difference in means (CUPED-adjusted when `covariates` are given),
+                      Welch or cluster-robust (`cluster` column) CI, bootstrap CI, adjusted p-values
+      hte           - the same effect within every level of each `by` factor (and their combination)
+      heterogeneity - Cochran's Q per factor and metric
+    """
+    config = {**DEFAULT_CONFIG, **config}
+    alpha = config["alpha"]
+    df = prepare(df)
+    metrics = [m for m in (metrics or METRICS) if METRICS[m] in df.columns]
+    columns = [METRICS[m] for m in metrics]
+    by = [b for b in by if b in df.columns]
+    df = df.dropna(subset=columns + by + list(covariates) + ([cluster] if cluster else []))
+    srm = srm_test(df["Variant"], expected, config["srm_alpha"])
+    df = df[df["Variant"].isin([CONTROL, TREATMENT])]
+
+    raw = df[columns].to_numpy(dtype=float)
+    Y, reduction = cuped(raw, covariate_matrix(df, list(covariates)))
+    treated = (df["Variant"] == TREATMENT).to_numpy()
+
+    # Finest cells once; every table below aggregates them
+    moments = cell_moments(df, Y, metrics, by)
+    effects = contrasts(moments, metrics, alpha=alpha)
+    effects["control_mean"] = raw[~treated].mean(axis=0) if (~treated).any() else np.nan
+    effects["treatment_mean"] = raw[treated].mean(axis=0) if treated.any() else np.nan
+    effects["se_type"] = "welch"
+    if cluster:
+        cr = cluster_robust(Y, treated, df[cluster].to_numpy(), alpha)
+        for key in ("se", "ci_low", "ci_high", "p_value"):
+            effects[key] = cr[key]
+        effects["se_type"] = f"cluster:{cluster}"
+    effects["p_adjusted"] = adjust_pvalues(effects["p_value"], config["correction"])
+    if config["n_boot"] and treated.any() and (~treated).any():
+        rng = np.random.default_rng(config["seed"])
+        clusters = df[cluster].to_numpy() if cluster else None
+        effects["boot_ci_low"], effects["boot_ci_high"] = bootstrap_ci(
+            Y, treated, config["n_boot"], rng, clusters, alpha, config["max_atoms"], config["boot_cells"])
+    effects["variance_reduction"] = reduction
+
+    factors = [[b] for b in by] + ([by] if len(by) > 1 else [])
+    hte = pd.concat([contrasts(moments, metrics, keys, alpha) for keys in factors], ignore_index=True) if factors else pd.DataFrame()
+    if not hte.empty:
+        hte["p_adjusted"] = adjust_pvalues(hte["p_value"], config["correction"])
+
+    return {"srm": srm, "effects": effects, "hte": hte, "heterogeneity": heterogeneity(hte) if not hte.empty else pd.DataFrame()}
+
+# ==========================================
+# MAIN
+# ==========================================
+def latest_metrics(log_dir=LOG_DIR):
+    paths = [p for p in glob.glob(os.path.join(log_dir, "os_metrics_*")) if "_shard" not in os.path.basename(p)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def print_report(result, alpha=DEFAULT_CONFIG["alpha"]):
+    srm = result["srm"]
+    print(f"{'⚠️ SRM' if srm['mismatch'] else '✅ No SRM'}: {srm['counts']} (p={srm['p_value']:.4f})")
+    effects = result["effects"]
+    columns = [c for c in ["metric", "n_control", "n_treatment", "control_mean", "treatment_mean", "estimate", "ci_low",
+                           "ci_high", "boot_ci_low", "boot_ci_high", "p_value", "p_adjusted", "variance_reduction"]
+               if c in effects.columns]
+    print(f"\n📊 Treatment - Control ({effects['se_type'].iloc[0]} SE)")
+    print(effects[columns].to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+    if not result["hte"].empty:
+        print("\n🔬 Subgroup effects")
+        columns = ["factor", "level", "metric", "n_control", "n_treatment", "estimate", "ci_low", "ci_high", "p_value", "p_adjusted"]
+        print(result["hte"][columns].to_string(index=False, float_format=lambda x: f"{x:.4g}"))
+        het = result["heterogeneity"]
+        flagged = het[het["p_value"] < alpha]
+        print(f"\n🧬 Heterogeneous effects (Cochran's Q, p < {alpha}): "
+              + (", ".join(f"{r.metric} by {r.factor}" for r in flagged.itertuples()) or "none"))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Treatment vs Control analysis of a metrics log or of the warehouse.")
+    parser.add_argument("metrics", nargs="?", default=None, help="Metrics log (default: newest in os_logs/).")
+    parser.add_argument("--warehouse", action="store_true", help="Analyze sessions from the experiment warehouse.")
+    parser.add_argument("--run-id", nargs="+", default=None, help="With --warehouse: only these runs.")
+    parser.add_argument("--metrics-list", nargs="+", default=None, choices=list(METRICS))
+    parser.add_argument("--by", nargs="+", default=["Model_Family", "Persona"], help="Subgroup factors.")
+    parser.add_argument("--covariates", nargs="+", default=[], help="Pre-treatment columns for CUPED (e.g. Model Persona).")
+    parser.add_argument("--cluster", default=None, help="Cluster column for robust SEs (e.g. Run_ID).")
+    parser.add_argument("--n-boot", type=int, default=DEFAULT_CONFIG["n_boot"])
+    parser.add_argument("--correction", default=DEFAULT_CONFIG["correction"], choices=["holm", "bonferroni", "bh", "none"])
+    parser.add_argument("--seed", type=int, default=DEFAULT_CONFIG["seed"])
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.warehouse:
+        from exp_warehouse import Warehouse
+        with Warehouse() as wh:
+            df = wh.sessions(**({"run_id": args.run_id} if args.run_id else {}))
+        print(f"🏛️  {len(df)} sessions from the warehouse")
+    else:
+        path = args.metrics or latest_metrics()
+        if path is None:
+            raise SystemExit("❌ No metrics logs found. Run the experiment first.")
+        df = read_log(path)
+        print(f"📂 {path}: {len(df)} sessions")
+    result = analyze(df, metrics=args.metrics_list, by=args.by, covariates=args.covariates, cluster=args.cluster,
+                     n_boot=args.n_boot, correction=args.correction, seed=args.seed)
+    print_report(result)
@@ -0,0 +1,447 @@
+import os
+import csv
+import json
+import glob
+import queue
+import threading
+import time
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# ==========================================
+# SCHEMA
+# ==========================================
+# v1: the original CSV layout (newlines in Reasoning/Tool_Output flattened to " | ")
+# v2: verbatim text, Tool_Output_Kind, typed columnar files
+# v3: token usage and latency breakdown (agent_telemetry.CallStats) per step and per session
+# v4: assignment propensity and allocation batch per session (adaptive_allocation)
+# v5: failover reason, failed attempts' retry classes and circuit breaker state per step (model_health)
+# v6: the meta-memory recall appended to each session's first prompt
+SCHEMA_VERSION = 6
+LOG_FORMATS = ["parquet", "arrow", "csv"]
+
+METRIC_COLUMNS = [
+    ("Session_UUID", "string"),
+    ("Variant", "string"),
+    ("Persona", "string"),
+    ("Model", "string"),
+    ("Outcome", "string"),
+    ("Steps_Taken", "int32"),
+    ("Is_Actually_Fixed", "bool"),
+    ("Total_Latency_ms", "int64"),
+    # Sums over the session's steps (tokens: billed only, cache-hit steps excluded)
+    ("Prompt_Tokens", "int64"),
+    ("Completion_Tokens", "int64"),
+    ("Cached_Tokens", "int64"),
+    ("Request_ms", "int64"),
+    ("Queue_ms", "int64"),
+    ("Backoff_ms", "int64"),
+    ("Retries", "int32"),
+    ("Fallback_Steps", "int32"),
+    # Steps that started while the assigned model's circuit breaker was open or half-open
+    ("Circuit_Steps", "int32"),
+    # Probability of the session's (variant, persona, model) cell in its batch (IPW weight = 1 / it)
+    ("Propensity", "float64"),
+    ("Allocation_Batch", "int32"),
+    # Past fixes recalled into the first prompt ("" = none found, null = run without --memory)
+    ("Memory_Recall", "string"),
+]
+
+TRACE_COLUMNS = [
+    ("Session_UUID", "string"),
+    ("Step_Num", "int32"),
+    ("Reasoning", "string"),
+    ("SQL_Command", "string"),
+    # Verbatim text, or JSON when the kernel returned rows (see Tool_Output_Kind)
+    ("Tool_Output", "string"),
+    ("Tool_Output_Kind", "string"),
+    ("Latency_ms", "int64"),
+    # Latency_ms = Queue_ms + Request_ms + Backoff_ms (+ harness overhead)
+    ("Request_ms", "int64"),
+    ("Queue_ms", "int64"),
+    ("Backoff_ms", "int64"),
+    ("Tool_ms", "int64"),
+    ("Retries", "int32"),
+    ("Answered_Model", "string"),
+    ("Cache_Hit", "bool"),
+    ("Prompt_Tokens", "int64"),
+    ("Completion_Tokens", "int64"),
+    ("Cached_Tokens", "int64"),
+    ("History_Messages", "int32"),
+    ("History_Chars", "int64"),
+    # Why another model answered (circuit_open / errors), the failed attempts' retry classes and
+    # the assigned model's breaker state when the step started
+    ("Failover", "string"),
+    ("Error_Classes", "string"),
+    ("Breaker_State", "string"),
+]
+
+def _arrow_schema(columns, kind):
+    types = {"string": pa.string(), "int32": pa.int32(), "int64": pa.int64(), "bool": pa.bool_(), "float64": pa.float64()}
+    return pa.schema(
+        [(name, types[t]) for name, t in columns],
+        metadata={"schema_version": str(SCHEMA_VERSION), "table": kind},
+    )
+
+def trace_rows(session_id, trace_log):
+    """
+    Flattens an OSAgent trace into TRACE_COLUMNS rows without losing structure.
+    """
+    rows = []
+    for step in trace_log:
+        output_val = step.get('tool_output', step.get('output', 'N/A'))
+        if isinstance(output_val, (list, dict)):
+            output_text, kind = json.dumps(output_val, default=str), "rows"
+        else:
+            output_text, kind = str(output_val), "text"
+        rows.append({
+            "Session_UUID": session_id,
+            "Step_Num": step['step'],
+            "Reasoning": step['reasoning'],
+            "SQL_Command": step['sql'],
+            "Tool_Output": output_text,
+            "Tool_Output_Kind": kind,
+            "Latency_ms": step.get('latency_ms', step.get('latency', 0)),
+            "Request_ms": step.get('request_ms', 0),
+            "Queue_ms": step.get('queue_ms', 0),
+            "Backoff_ms": step.get('backoff_ms', 0),
+            "Tool_ms": step.get('tool_ms', 0),
+            "Retries": step.get('retries', 0),
+            "Answered_Model": step.get('answered_model'),
+            "Cache_Hit": step.get('cache_hit', False),
+            "Prompt_Tokens": step.get('prompt_tokens', 0),
+            "Completion_Tokens": step.get('completion_tokens', 0),
+            "Cached_Tokens": step.get('cached_tokens', 0),
+            "History_Messages": step.get('history_messages', 0),
+            "History_Chars": step.get('history_chars', 0),
+            "Failover": step.get('failover'),
+            "Error_Classes": step.get('error_classes'),
+            "Breaker_State": step.get('breaker_state'),
+        })
+    return rows
+
+def log_paths(log_dir, run_id, fmt, shard=None):
+    suffix = f"_shard{shard}" if shard is not None else ""
+    ext = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrows"}[fmt]
+    return (os.path.join(log_dir, f"os_metrics_{run_id}{suffix}{ext}"),
+            os.path.join(log_dir, f"os_trace_{run_id}{suffix}{ext}"))
+
+def _next_index(path, prefix):
+    """
+    Next free sequence number for `<prefix>-NNNNN.*` files in a dataset directory.
+    """
+    indices = [int(name.split("-")[1].split(".")[0]) for name in os.listdir(path) if name.startswith(prefix + "-")
+               and not name.endswith(".tmp")]
+    return max(indices, default=-1) + 1
+
+def format_of(path):
+    if path.endswith(".parquet"):
+        return "parquet"
+    if path.endswith(".arrows"):
+        return "arrow"
+    return "csv"
+
+# ==========================================
+# BACKENDS
+# ==========================================
+class CSVBackend:
+    """
+    Appends rows to one CSV per table; fsync once per batch.
+    """
+    def __init__(self, path, columns, kind):
+        self.path = path
+        self.names = [name for name, _ in columns]
+        if not os.path.exists(path):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerow(self.names)
+        self._f = open(path, "a", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._f)
+
+    def write(self, rows):
+        self._writer.writerows([[row.get(name) for name in self.names] for row in rows])
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def close(self):
+        self._f.close()
+
+class ParquetBackend:
+    """
+    A dataset directory: every flush becomes one immutable part file (one row group),
+    written to a temp name and renamed, so a crash never leaves a half-written file.
+    """
+    def __init__(self, path, columns, kind):
+        self.path = path
+        self.schema = _arrow_schema(columns, kind)
+        os.makedirs(path, exist_ok=True)
+        self._seq = _next_index(path, "part")
+
+    def write(self, rows):
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        final = os.path.join(self.path, f"part-{self._seq:05d}.parquet")
+        tmp = final + ".tmp"
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, final)
+        self._seq += 1
+
+    def close(self):
+        pass
+
+class ArrowStreamBackend:
+    """
+    Arrow IPC streaming: one open stream segment per writer, one record batch per flush.
+    A reader recovers every complete batch even if the process died mid-stream.
+    """
+    def __init__(self, path, columns, kind):
+        self.path = path
+        self.schema = _arrow_schema(columns, kind)
+        os.makedirs(path, exist_ok=True)
+        seq = _next_index(path, "segment")
+        self._sink = open(os.path.join(path, f"segment-{seq:05d}.arrows"), "wb")
+        self._writer = pa_ipc.new_stream(self._sink, self.schema)
+
+    def write(self, rows):
+        self._writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=self.schema))
+        self._sink.flush()
+        os.fsync(self._sink.fileno())
+
+    def close(self):
+        self._writer.close()
+        self._sink.close()
+
+BACKENDS = {"csv": CSVBackend, "parquet": ParquetBackend, "arrow": ArrowStreamBackend}
+
+# ==========================================
+# BACKGROUND WRITER
+# ==========================================
+class ExperimentLogWriter:
+    """
+    Buffers sessions and writes them from a background thread in batches.
+
+    log_session() never touches the disk. A batch is flushed when it reaches
+    `batch_sessions` sessions or is `flush_interval` seconds old; after both tables of a
+    batch are durable, each session's `on_durable` callback runs (the runner journals
+    there, so the journal never gets ahead of the data).
+    """
+    def __init__(self, metrics_path, trace_path, fmt="parquet", batch_sessions=64, flush_interval=1.0):
+        if fmt != "csv" and pa is None:
+            raise ImportError(f"Log format '{fmt}' requires pyarrow (pip install pyarrow).")
+        self.metrics_path = metrics_path
+        self.trace_path = trace_path
+        self.fmt = fmt
+        self.batch_sessions = batch_sessions
+        self.flush_interval = flush_interval
+        self._metrics = BACKENDS[fmt](metrics_path, METRIC_COLUMNS, "metrics")
+        self._trace = BACKENDS[fmt](trace_path, TRACE_COLUMNS, "trace")
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="exp-log-writer", daemon=True)
+        self._thread.start()
+
+    def _check(self):
+        if self._error is not None:
+            raise RuntimeError("Log writer failed") from self._error
+
+    def log_session(self, metric_row, trace_log_rows, on_durable=None):
+        self._check()
+        self._queue.put(("session", (metric_row, trace_log_rows, on_durable)))
+
+    def flush(self):
+        """
+        Blocks until everything logged so far is on disk.
+        """
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait()
+        self._check()
+
+    def close(self):
+        done = threading.Event()
+        self._queue.put(("close", done))
+        done.wait()
+        self._thread.join()
+        self._check()
+
+    def _write(self, batch):
+        if not batch:
+            return
+        metric_rows = [m for m, _, _ in batch]
+        trace_rows_ = [row for _, rows, _ in batch for row in rows]
+        self._metrics.write(metric_rows)
+        if trace_rows_:
+            self._trace.write(trace_rows_)
+        for _, _, on_durable in batch:
+            if on_durable is not None:
+                on_durable()
+
+    def _run(self):
+        batch = []
+        oldest = None
+        while True:
+            timeout = None if oldest is None else max(0.0, self.flush_interval - (time.monotonic() - oldest))
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = "tick", None
+
+            try:
+                if kind == "session":
+                    batch.append(payload)
+                    oldest = oldest or time.monotonic()
+                    if len(batch) < self.batch_sessions:
+                        continue
+                self._write(batch)
+            except Exception as e:
+                # Surface on the caller's next call; keep draining so flush/close never hang
+                self._error = self._error or e
+            batch, oldest = [], None
+
+            if kind == "close":
+                try:
+                    self._metrics.close()
+                    self._trace.close()
+                except Exception as e:
+                    self._error = self._error or e
+                payload.set()
+                return
+            if kind == "flush":
+                payload.set()
+
+# ==========================================
+# READING
+# ==========================================
+def _iter_stream(file):
+    """
+    Yields the record batches of one IPC stream segment. A crash can truncate the last
+    batch; everything before it is still returned.
+    """
+    with open(file, "rb") as f:
+        try:
+            reader = pa_ipc.open_stream(f)
+        except pa.ArrowInvalid:
+            return
+        while True:
+            try:
+                yield reader.read_next_batch()
+            except (StopIteration, pa.ArrowInvalid, OSError):
+                return
+
+def _read_stream(file):
+    batches = list(_iter_stream(file))
+    return pa.Table.from_batches(batches) if batches else None
+
+def _arrow_tables(path, columns=None):
+    tables = []
+    for file in sorted(glob.glob(os.path.join(path, "segment-*.arrows"))):
+        table = _read_stream(file)
+        if table is not None:
+            tables.append(table.select(columns) if columns else table)
+    return tables
+
+def read_log(path, columns=None):
+    """
+    Loads a metrics/trace log of any format as a DataFrame, reading only `columns`.
+    """
+    import pandas as pd
+    fmt = format_of(path.rstrip("/"))
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    tables = _arrow_tables(path, columns)
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables(tables).to_pandas()
+
+def iter_log_batches(path, columns=None, batch_rows=65536):
+    """
+    Yields DataFrames of at most ~batch_rows rows in file order (constant memory).
+    """
+    import pandas as pd
+    fmt = format_of(path.rstrip("/"))
+    if fmt == "csv":
+        yield from pd.read_csv(path, usecols=columns, chunksize=batch_rows)
+        return
+    if fmt == "parquet":
+        for file in sorted(glob.glob(os.path.join(path, "part-*.parquet"))):
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=batch_rows, columns=columns):
+                yield batch.to_pandas()
+        return
+    for file in sorted(glob.glob(os.path.join(path, "segment-*.arrows"))):
+        for batch in _iter_stream(file):
+            batch = batch.select(columns) if columns else batch
+            for offset in range(0, batch.num_rows, batch_rows):
+                yield batch.slice(offset, batch_rows).to_pandas()
+
+def log_columns(path):
+    """
+    Column names present in a log (v1 CSV logs lack the v2 columns).
+    """
+    fmt = format_of(path.rstrip("/"))
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            return next(csv.reader(f), [])
+    prefix, ext = ("part", ".parquet") if fmt == "parquet" else ("segment", ".arrows")
+    files = sorted(glob.glob(os.path.join(path, f"{prefix}-*{ext}")))
+    if not files:
+        return []
+    if fmt == "parquet":
+        return pq.read_schema(files[0]).names
+    with open(files[0], "rb") as f:
+        return pa_ipc.open_stream(f).schema.names
+
+# ==========================================
+# COMPACTION / MERGE (resume & shards)
+# ==========================================
+def _filter_table(table, keep_ids):
+    import pyarrow.compute as pc
+    return table.filter(pc.is_in(table["Session_UUID"], value_set=pa.array(sorted(keep_ids), pa.string())))
+
+def filter_log(src_paths, dest_path, keep_ids):
+    """
+    Keeps only rows of journaled sessions. CSV sources are streamed into one file; columnar
+    sources are rewritten part by part into the destination dataset directory. A session's
+    rows come from the first file that has it (the writer logs a session in one batch), so
+    copies left by a crash before the originals were removed are dropped on the next run.
+    """
+    from experiment_plan import filter_csv
+    fmt = format_of(dest_path)
+    if fmt == "csv":
+        filter_csv(src_paths, dest_path, keep_ids)
+        return
+
+    os.makedirs(dest_path, exist_ok=True)
+    prefix, ext = ("part", ".parquet") if fmt == "parquet" else ("segment", ".arrows")
+    # Snapshot the inputs first: the destination may also be one of the sources
+    inputs = [file for src in src_paths if os.path.isdir(src)
+              for file in sorted(glob.glob(os.path.join(src, f"{prefix}-*{ext}")))]
+    seq = _next_index(dest_path, prefix)
+    seen = set()
+    for file in inputs:
+        table = pq.read_table(file) if fmt == "parquet" else _read_stream(file)
+        if table is None:
+            continue
+        owned = (set(table["Session_UUID"].to_pylist()) & keep_ids) - seen
+        seen |= owned
+        table = _filter_table(table, owned)
+        final = os.path.join(dest_path, f"{prefix}-{seq:05d}{ext}")
+        tmp = final + ".tmp"
+        if fmt == "parquet":
+            pq.write_table(table, tmp, compression="zstd")
+        else:
+            with open(tmp, "wb") as sink, pa_ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, final)
+        seq += 1
+
+    # Filtered copies are in place (with higher sequence numbers), so the originals can go
+    for file in inputs:
+        os.remove(file)
+    for src in src_paths:
+        if src != dest_path and os.path.isdir(src) and not os.listdir(src):
+            os.rmdir(src)
@@ -0,0 +1,340 @@
+import os
+import re
+import json
+import glob
+import sqlite3
+import argparse
+from datetime import datetime
+import pandas as pd
+from exp_logging import METRIC_COLUMNS, TRACE_COLUMNS, iter_log_batches, log_columns, log_paths, format_of
+from experiment_plan import load_plan, plan_path
+from sequential_analysis import session_values
+from llm_providers import provider_for_model
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LOG_DIR = "os_logs"
+WAREHOUSE_PATH = os.path.join(LOG_DIR, "warehouse.sqlite")
+INGEST_BATCH_ROWS = 65536
+
+SQL_TYPES = {"string": "TEXT", "int32": "INTEGER", "int64": "INTEGER", "bool": "INTEGER", "float64": "REAL"}
+RUN_FILE_RE = re.compile(r"^os_metrics_(?P<run_id>.+?)(?P<shard>_shard\d+)?\.(csv|parquet|arrows)$")
+
+# ==========================================
+# SCHEMA
+# ==========================================
+# Columns keep their log names (Session_UUID, Steps_Taken, ...), so a query result looks like
+# read_log() output. Sessions and steps are keyed by (Run_ID, Session_UUID[, Step_Num]).
+def _columns_ddl(columns):
+    return ",\n    ".join(f"{name} {SQL_TYPES[kind]}" for name, kind in columns)
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS experiments (
+    Run_ID TEXT PRIMARY KEY,
+    Created TEXT,
+    Scenario TEXT,
+    Seed INTEGER,
+    Max_Steps INTEGER,
+    Planned_Sessions INTEGER,
+    Log_Format TEXT,
+    History_Policy TEXT,
+    Settings TEXT,
+    Metrics_Source TEXT,
+    Trace_Source TEXT,
+    Ingested TEXT
+);
+CREATE TABLE IF NOT EXISTS design (
+    Run_ID TEXT NOT NULL,
+    Factor TEXT NOT NULL,
+    Level TEXT NOT NULL,
+    PRIMARY KEY (Run_ID, Factor, Level)
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    Run_ID TEXT NOT NULL,
+    {_columns_ddl(METRIC_COLUMNS)},
+    Provider TEXT,
+    Hallucinated INTEGER,
+    Unit_Index INTEGER,
+    Seed INTEGER,
+    PRIMARY KEY (Run_ID, Session_UUID)
+);
+CREATE TABLE IF NOT EXISTS steps (
+    Run_ID TEXT NOT NULL,
+    {_columns_ddl(TRACE_COLUMNS)},
+    PRIMARY KEY (Run_ID, Session_UUID, Step_Num)
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_cell ON sessions (Variant, Model, Persona);
+CREATE INDEX IF NOT EXISTS idx_sessions_provider ON sessions (Provider, Variant, Hallucinated);
+CREATE INDEX IF NOT EXISTS idx_sessions_outcome ON sessions (Outcome, Is_Actually_Fixed);
+CREATE INDEX IF NOT EXISTS idx_sessions_uuid ON sessions (Session_UUID);
+CREATE INDEX IF NOT EXISTS idx_steps_uuid ON steps (Session_UUID);
+"""
+
+SESSION_COLUMNS = ["Run_ID"] + [name for name, _ in METRIC_COLUMNS] + ["Provider", "Hallucinated", "Unit_Index", "Seed"]
+STEP_COLUMNS = ["Run_ID"] + [name for name, _ in TRACE_COLUMNS]
+BOOL_COLUMNS = {name for name, kind in METRIC_COLUMNS + TRACE_COLUMNS if kind == "bool"}
+
+# Filter keyword -> column of `sessions s JOIN experiments e`
+SESSION_FILTERS = {
+    "run_id": "s.Run_ID", "session_uuid": "s.Session_UUID", "variant": "s.Variant", "persona": "s.Persona",
+    "model": "s.Model", "provider": "s.Provider", "outcome": "s.Outcome", "is_fixed": "s.Is_Actually_Fixed",
+    "hallucinated": "s.Hallucinated", "batch": "s.Allocation_Batch", "scenario": "e.Scenario",
+}
+
+# ==========================================
+# HELPERS
+# ==========================================
+def _value(name, value):
+    # Log readers hand over NaN for missing cells and "True"/"False" strings for CSV booleans
+    if value is None or (isinstance(value, float) and value != value):
+        return None
+    if name in BOOL_COLUMNS:
+        return 1 if str(value) in ("True", "true", "1", "1.0") else 0
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def _provider(model):
+    try:
+        return provider_for_model(model)
+    except (ValueError, TypeError):
+        return None
+
+def _created(run_id, plan, metrics_path):
+    if plan and plan.get("created"):
+        return plan["created"]
+    try:
+        return datetime.strptime(run_id[:15], "%Y%m%d_%H%M%S").isoformat()
+    except ValueError:
+        return datetime.fromtimestamp(os.path.getmtime(metrics_path)).isoformat(timespec="seconds")
+
+def discover_runs(log_dir=LOG_DIR):
+    """
+    (run_id, metrics_path, trace_path) of every merged run in `log_dir` (shard files are skipped).
+    """
+    runs = []
+    for path in sorted(glob.glob(os.path.join(log_dir, "os_metrics_*"))):
+        match = RUN_FILE_RE.match(os.path.basename(path.rstrip("/")))
+        if match is None or match.group("shard"):
+            continue
+        run_id = match.group("run_id")
+        trace_path = log_paths(log_dir, run_id, format_of(path))[1]
+        runs.append((run_id, path, trace_path if os.path.exists(trace_path) else None))
+    return runs
+
+# ==========================================
+# WAREHOUSE
+# ==========================================
+class Warehouse:
+    """
+    Append-only SQLite store of every run's design, sessions and steps. Ingesting a run twice
+    only adds what is new (e.g. sessions of a resumed run), so `ingest_dir` can run after every run.
+    """
+    def __init__(self, path=WAREHOUSE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """
+        Adds log columns introduced by later schema versions to a warehouse created before them.
+        """
+        for table, columns in (("sessions", METRIC_COLUMNS), ("steps", TRACE_COLUMNS)):
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            for name, kind in columns:
+                if name not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {SQL_TYPES[kind]}")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ------------------------------------------
+    # INGEST
+    # ------------------------------------------
+    def _insert(self, table, columns, rows):
+        placeholders = ", ".join("?" * len(columns))
+        self.conn.executemany(f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+
+    def _ingest_experiment(self, run_id, plan, metrics_path, trace_path, extra=None):
+        plan = plan or {}
+        settings = {k: v for k, v in plan.items() if k not in ("units", "factors")}
+        settings.update(extra or {})
+        self._insert("experiments", ["Run_ID", "Created", "Scenario", "Seed", "Max_Steps", "Planned_Sessions", "Log_Format",
+                                     "History_Policy", "Settings", "Metrics_Source", "Trace_Source", "Ingested"], [(
+            run_id, _created(run_id, plan, metrics_path), plan.get("scenario", "port_conflict"), plan.get("seed"),
+            plan.get("max_steps"), plan.get("budget", len(plan.get("units", []))) or None, format_of(metrics_path.rstrip("/")),
+            plan.get("history_policy", "full"), json.dumps(settings, default=str), metrics_path, trace_path,
+            datetime.now().isoformat(timespec="seconds"),
+        )])
+        factors = plan.get("factors", {})
+        self._insert("design", ["Run_ID", "Factor", "Level"],
+                     [(run_id, factor, str(level)) for factor, levels in factors.items() for level in levels])
+
+    def _ingest_sessions(self, run_id, metrics_path, units):
+        present = [name for name, _ in METRIC_COLUMNS if name in log_columns(metrics_path)]
+        factors = {"variants": set(), "personas": set(), "models": set()}
+        for batch in iter_log_batches(metrics_path, columns=present, batch_rows=INGEST_BATCH_ROWS):
+            rows = []
+            for record in batch.to_dict("records"):
+                row = {name: _value(name, record.get(name)) for name, _ in METRIC_COLUMNS}
+                unit = units.get(row["Session_UUID"], {})
+                values = session_values(row["Outcome"], row["Steps_Taken"] or 0, row["Is_Actually_Fixed"])
+                row.update(Run_ID=run_id, Provider=_provider(row["Model"]), Hallucinated=int(values["hallucination"]),
+                           Unit_Index=unit.get("index"), Seed=unit.get("seed"))
+                rows.append([row[name] for name in SESSION_COLUMNS])
+                for factor, column in (("variants", "Variant"), ("personas", "Persona"), ("models", "Model")):
+                    factors[factor].add(row[column])
+            self._insert("sessions", SESSION_COLUMNS, rows)
+        return factors
+
+    def _ingest_steps(self, run_id, trace_path):
+        present = [name for name, _ in TRACE_COLUMNS if name in log_columns(trace_path)]
+        for batch in iter_log_batches(trace_path, columns=present, batch_rows=INGEST_BATCH_ROWS):
+            rows = []
+            for record in batch.to_dict("records"):
+                row = {name: _value(name, record.get(name)) for name, _ in TRACE_COLUMNS}
+                # v1 logs predate Tool_Output_Kind; their outputs are flattened text
+                row["Tool_Output_Kind"] = row["Tool_Output_Kind"] or "text"
+                row["Run_ID"] = run_id
+                rows.append([row[name] for name in STEP_COLUMNS])
+            self._insert("steps", STEP_COLUMNS, rows)
+
+    def ingest_run(self, metrics_path, trace_path=None, run_id=None, log_dir=None):
+        """
+        Adds one run (any log format). Its plan and counterfactual manifest, when they sit next
+        to the logs, supply the design metadata. Returns (new sessions, new steps).
+        """
+        log_dir = log_dir or os.path.dirname(metrics_path.rstrip("/"))
+        if run_id is None:
+            match = RUN_FILE_RE.match(os.path.basename(metrics_path.rstrip("/")))
+            run_id = match.group("run_id") if match else os.path.splitext(os.path.basename(metrics_path))[0]
+        plan = load_plan(plan_path(log_dir, run_id)) if os.path.exists(plan_path(log_dir, run_id)) else None
+        extra = None
+        manifest = os.path.join(log_dir, f"os_counterfactual_{run_id}.json")
+        if os.path.exists(manifest):
+            with open(manifest, encoding="utf-8") as f:
+                extra = {k: v for k, v in json.load(f).items() if k not in ("branches", "metrics", "trace")}
+
+        before = self._counts(run_id)
+        with self.conn:
+            self._ingest_experiment(run_id, plan, metrics_path, trace_path, extra)
+            factors = self._ingest_sessions(run_id, metrics_path, {u["session_uuid"]: u for u in (plan or {}).get("units", [])})
+            if plan is None:
+                # Legacy runs have no plan: the design is what was observed
+                self._insert("design", ["Run_ID", "Factor", "Level"],
+                             [(run_id, factor, str(level)) for factor, levels in factors.items() for level in sorted(levels, key=str)])
+            if trace_path:
+                self._ingest_steps(run_id, trace_path)
+        after = self._counts(run_id)
+        return after[0] - before[0], after[1] - before[1]
+
+    def ingest_dir(self, log_dir=LOG_DIR):
+        """
+        Ingests every run in `log_dir`; returns {run_id: (new sessions, new steps)}.
+        """
+        return {run_id: self.ingest_run(metrics, trace, run_id, log_dir) for run_id, metrics, trace in discover_runs(log_dir)}
+
+    def _counts(self, run_id):
+        sessions = self.conn.execute("SELECT count(*) FROM sessions WHERE Run_ID=?", (run_id,)).fetchone()[0]
+        steps = self.conn.execute("SELECT count(*) FROM steps WHERE Run_ID=?", (run_id,)).fetchone()[0]
+        return sessions, steps
+
+    # ------------------------------------------
+    # QUERY
+    # ------------------------------------------
+    def sql(self, query, params=()):
+        """
+        Any read-only SQL over experiments / design / sessions / steps, as a DataFrame.
+        """
+        return pd.read_sql_query(query, self.conn, params=params)
+
+    @staticmethod
+    def _where(filters):
+        clauses, params = [], []
+        for key, value in filters.items():
+            if key not in SESSION_FILTERS:
+                raise ValueError(f"Unknown filter '{key}' ({', '.join(SESSION_FILTERS)}).")
+            column = SESSION_FILTERS[key]
+            if isinstance(value, (list, tuple, set)):
+                clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                params.extend(value)
+            elif isinstance(value, str) and "%" in value:
+                clauses.append(f"{column} LIKE ?")
+                params.append(value)
+            else:
+                clauses.append(f"{column} = ?")
+                params.append(int(value) if isinstance(value, bool) else value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def sessions(self, **filters):
+        """
+        Sessions across all runs, e.g. sessions(provider="google", variant="Treatment", hallucinated=True).
+        A list matches any of its values; a string with % is a LIKE pattern.
+        """
+        where, params = self._where(filters)
+        return self.sql("SELECT s.*, e.Scenario FROM sessions s JOIN experiments e ON e.Run_ID = s.Run_ID"
+                        f"{where} ORDER BY s.Run_ID, s.Unit_Index", params)
+
+    def steps(self, **filters):
+        """
+        Steps of the sessions matching the same filters as sessions(), in step order.
+        """
+        where, params = self._where(filters)
+        return self.sql("SELECT t.*, s.Variant, s.Persona, s.Model FROM steps t "
+                        "JOIN sessions s ON s.Run_ID = t.Run_ID AND s.Session_UUID = t.Session_UUID "
+                        f"JOIN experiments e ON e.Run_ID = s.Run_ID{where} "
+                        "ORDER BY t.Run_ID, t.Session_UUID, t.Step_Num", params)
+
+    def experiments(self):
+        return self.sql("SELECT e.*, (SELECT count(*) FROM sessions s WHERE s.Run_ID = e.Run_ID) AS Sessions "
+                        "FROM experiments e ORDER BY e.Created")
+
+# ==========================================
+# MAIN
+# ==========================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Experiment warehouse: ingest run logs, query across runs.")
+    parser.add_argument("--db", default=WAREHOUSE_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Add runs (default: every run in --log-dir); known sessions are skipped.")
+    ingest.add_argument("metrics", nargs="*", help="os_metrics_* files/datasets to ingest.")
+    ingest.add_argument("--log-dir", default=LOG_DIR)
+    query = sub.add_parser("query", help="Run SQL and print the result.")
+    query.add_argument("sql")
+    sub.add_parser("runs", help="List the ingested runs.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with Warehouse(args.db) as wh:
+        if args.command == "ingest":
+            if args.metrics:
+                added = {}
+                for path in args.metrics:
+                    run_id = RUN_FILE_RE.match(os.path.basename(path.rstrip("/"))).group("run_id")
+                    trace = log_paths(os.path.dirname(path.rstrip("/")), run_id, format_of(path.rstrip("/")))[1]
+                    added[run_id] = wh.ingest_run(path, trace if os.path.exists(trace) else None, run_id)
+            else:
+                added = wh.ingest_dir(args.log_dir)
+            for run_id, (n_sessions, n_steps) in added.items():
+                print(f"📥 {run_id}: +{n_sessions} sessions, +{n_steps} steps")
+            print(f"🏛️  Warehouse: {args.db}")
+        elif args.command == "query":
+            with pd.option_context("display.max_rows", 200, "display.width", 200):
+                print(wh.sql(args.sql).to_string(index=False))
+        else:
+            columns = ["Run_ID", "Created", "Scenario", "Planned_Sessions", "Sessions", "History_Policy", "Log_Format"]
+            print(wh.experiments()[columns].to_string(index=False))
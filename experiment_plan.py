@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import uuid
+import random
+from datetime import datetime
+
+# ==========================================
+# SESSION PLAN
+# ==========================================
+# The plan is the full list of experimental units (who runs what, with which VM seed),
+# written before the first session starts so a crashed run can be resumed or split
+# across workers without re-randomizing.
+PLAN_VERSION = 1
+
+def plan_path(log_dir, run_id):
+    return os.path.join(log_dir, f"os_plan_{run_id}.json")
+
+def journal_path(log_dir, run_id, shard=None):
+    suffix = f"_shard{shard}" if shard is not None else ""
+    return os.path.join(log_dir, f"os_journal_{run_id}{suffix}.jsonl")
+
+def draw_unit(index, rng, variants, personas, models):
+    return {
+        "index": index,
+        "session_uuid": uuid.UUID(int=rng.getrandbits(128)).hex[:8],
+        "variant": rng.choice(variants),
+        "persona": rng.choice(personas),
+        "model": rng.choice(models),
+        # Drawn with the assignment so the VM does not depend on execution order
+        "seed": rng.getrandbits(32),
+    }
+
+def assigned_unit(index, rng, cell, propensity, batch):
+    """
+    A unit whose cell was chosen by an allocator (adaptive_allocation), with the probability
+    that cell had in its batch.
+    """
+    variant, persona, model = cell
+    return {
+        "index": index,
+        "session_uuid": uuid.UUID(int=rng.getrandbits(128)).hex[:8],
+        "variant": variant,
+        "persona": persona,
+        "model": model,
+        "seed": rng.getrandbits(32),
+        "propensity": propensity,
+        "batch": batch,
+    }
+
+def build_plan(run_id, n_sessions, variants, personas, models, max_steps, seed=None):
+    rng = random.Random(seed)
+    units = [draw_unit(i, rng, variants, personas, models) for i in range(1, n_sessions + 1)]
+    # Uniform design: every cell has the same probability
+    propensity = 1.0 / (len(variants) * len(personas) * len(models))
+    for unit in units:
+        unit.update(propensity=propensity, batch=0)
+    return {
+        "version": PLAN_VERSION,
+        "run_id": run_id,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "seed": seed,
+        "max_steps": max_steps,
+        "factors": {"variants": variants, "personas": personas, "models": models},
+        "units": units,
+    }
+
+def build_adaptive_plan(run_id, n_sessions, variants, personas, models, max_steps, allocation, seed=None):
+    """
+    Plan of an adaptively allocated run: a uniform burn-in batch (`burn_in` sessions per cell);
+    later batches are appended by the runner as results come in. `n_sessions` is the budget.
+    """
+    if seed is None:
+        # Later batches draw from batch_rng(plan["seed"], batch): an unseeded run needs its own
+        # seed in the plan, or every unseeded run would repeat the same batches
+        seed = random.SystemRandom().getrandbits(63)
+    n_cells = len(variants) * len(personas) * len(models)
+    plan = build_plan(run_id, min(allocation["burn_in"] * n_cells, n_sessions), variants, personas, models,
+                      max_steps, seed=seed)
+    plan["allocation"] = allocation
+    plan["budget"] = n_sessions
+    return plan
+
+def append_batch(plan, assignments, rng):
+    """
+    Adds one allocator batch ([(cell, propensity)]) to the plan's units.
+    """
+    batch = max(u.get("batch", 0) for u in plan["units"]) + 1
+    start = len(plan["units"]) + 1
+    units = [assigned_unit(start + i, rng, cell, p, batch) for i, (cell, p) in enumerate(assignments)]
+    plan["units"].extend(units)
+    return units
+
+def _atomic_write(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def write_plan(path, plan):
+    _atomic_write(path, json.dumps(plan, indent=1))
+
+def load_plan(path):
+    with open(path, encoding="utf-8") as f:
+        plan = json.load(f)
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"Unsupported plan version {plan.get('version')} in {path}")
+    return plan
+
+def shard_units(units, shard, n_shards):
+    """
+    Deterministic round-robin split, so every worker agrees on ownership without talking.
+    """
+    return [u for u in units if (u["index"] - 1) % n_shards == shard]
+
+# ==========================================
+# COMPLETION JOURNAL
+# ==========================================
+class SessionJournal:
+    """
+    Append-only record of finished sessions. A line is written (and fsynced) only after the
+    session's metric and trace rows are durable, so the journal is the commit point:
+    anything in the log files that is not journaled is treated as never having happened.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        self.completed.add(json.loads(line)["session_uuid"])
+                    except (json.JSONDecodeError, KeyError):
+                        # Torn final line from a crash mid-write: that session is not committed
+                        continue
+        self._f = open(path, "a", encoding="utf-8")
+
+    def record(self, unit, outcome):
+        entry = {"session_uuid": unit["session_uuid"], "index": unit["index"], "outcome": outcome,
+                 "finished": datetime.now().isoformat(timespec="seconds")}
+        self._f.write(json.dumps(entry) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.completed.add(unit["session_uuid"])
+
+    def close(self):
+        self._f.close()
+
+def read_journal(path):
+    return SessionJournal(path).completed if os.path.exists(path) else set()
+
+# ==========================================
+# LOG COMPACTION / MERGE
+# ==========================================
+def filter_csv(src_paths, dest_path, keep_ids, id_column="Session_UUID"):
+    """
+    Streams rows of `src_paths` whose session is in `keep_ids` into `dest_path` (atomically).
+    Used to drop orphan rows on resume and to merge shard outputs. A session's rows come from
+    the first source that has it (the writer logs a session in one batch), so re-running a merge
+    that died after rewriting the destination does not fold the shard rows in twice.
+    """
+    tmp = f"{dest_path}.tmp"
+    header = None
+    owner = {}
+    with open(tmp, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        for i, src in enumerate(src_paths):
+            if not os.path.exists(src):
+                continue
+            with open(src, newline="", encoding="utf-8") as f:
+                reader = csv.reader(f)
+                src_header = next(reader, None)
+                if src_header is None:
+                    continue
+                if header is None:
+                    header = src_header
+                    writer.writerow(header)
+                col = header.index(id_column)
+                for row in reader:
+                    if row and row[col] in keep_ids and owner.setdefault(row[col], i) == i:
+                        writer.writerow(row)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmp, dest_path)
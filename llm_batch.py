@@ -0,0 +1,240 @@
+import os
+import io
+import json
+import time
+import uuid
+from llm_providers import (
+    get_provider, provider_for_model, GoogleProvider, OpenAIProvider, ProviderError, MalformedOutputError,
+    types,
+)
+from agent_telemetry import make_usage
+
+# ==========================================
+# BATCH ENDPOINTS
+# ==========================================
+# A batch backend takes many independent requests for one model and answers them later,
+# at batch prices and quotas instead of interactive RPM:
+#   submit(model, requests, response_schema, temperature) -> job_id
+#       requests: [(custom_id, history)]
+#   poll(job_id) -> "pending" | "done" | "failed"
+#   results(job_id) -> {custom_id: (parsed or None, usage or None, error or None)}
+# Requests missing from the results (expired or failed jobs) count as failed.
+BATCH_POLL_SECONDS = 30
+
+class BatchError(ProviderError):
+    """
+    One request of a batch job failed; `status` carries the HTTP-like code when known.
+    """
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+def response_format(response_schema):
+    # Structured output for raw /v1/chat/completions bodies (the SDK's .parse() does this for us)
+    schema = response_schema.model_json_schema()
+    schema["additionalProperties"] = False
+    return {"type": "json_schema", "json_schema": {"name": response_schema.__name__, "schema": schema, "strict": True}}
+
+def openai_batch_line(custom_id, model, history, response_schema, temperature):
+    """
+    One line of an OpenAI Batch API input file.
+    """
+    body = {"model": model, "messages": list(history), "temperature": temperature,
+            "response_format": response_format(response_schema)}
+    body.update(OpenAIProvider._cache_hint(history))
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": body}
+
+def parse_openai_result(line, response_schema):
+    """
+    One line of an OpenAI Batch API output/error file -> (custom_id, (parsed, usage, error)).
+    """
+    custom_id = line["custom_id"]
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code", 200) != 200:
+        error = line.get("error") or response.get("body", {}).get("error", {})
+        status = response.get("status_code")
+        return custom_id, (None, None, BatchError(f"{status or ''} {error.get('code')}: {error.get('message')}".strip(), status))
+    body = response["body"]
+    usage = body.get("usage")
+    if usage:
+        details = usage.get("prompt_tokens_details") or {}
+        usage = make_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), details.get("cached_tokens"))
+    try:
+        parsed = response_schema.model_validate_json(body["choices"][0]["message"]["content"])
+    except Exception as e:
+        return custom_id, (None, usage, MalformedOutputError(f"Batch output did not match the schema: {e}"))
+    return custom_id, (parsed, usage, None)
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for a provider batch endpoint, so the lockstep runner can be tested
+    offline. Jobs are OpenAI-format JSONL files in `root`; a job is answered `turnaround`
+    seconds after submission (when polled) by the registered provider of each request's model,
+    e.g. the local policy provider, and its output file uses the OpenAI output format too.
+    """
+    name = "local"
+
+    def __init__(self, root=os.path.join("os_logs", "batches"), turnaround=0.0, keep_files=False):
+        self.root = root
+        self.turnaround = turnaround
+        self.keep_files = keep_files
+        self._jobs = {}
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id, kind):
+        return os.path.join(self.root, f"{job_id}.{kind}.jsonl")
+
+    def submit(self, model, requests, response_schema, temperature):
+        job_id = f"batch_{uuid.uuid4().hex[:12]}"
+        with open(self._path(job_id, "input"), "w", encoding="utf-8") as f:
+            for custom_id, history in requests:
+                f.write(json.dumps(openai_batch_line(custom_id, model, history, response_schema, temperature)) + "\n")
+        self._jobs[job_id] = {"state": "pending", "submitted": time.monotonic(),
+                              "schema": response_schema, "temperature": temperature}
+        return job_id
+
+    def _process(self, job_id):
+        job = self._jobs[job_id]
+        with open(self._path(job_id, "input"), encoding="utf-8") as src, \
+                open(self._path(job_id, "output"), "w", encoding="utf-8") as out:
+            for raw in src:
+                line = json.loads(raw)
+                body = line["body"]
+                result = {"id": f"req_{uuid.uuid4().hex[:12]}", "custom_id": line["custom_id"], "response": None, "error": None}
+                try:
+                    provider = get_provider(provider_for_model(body["model"]))
+                    parsed, usage = provider.complete(body["model"], body["messages"], job["schema"], job["temperature"])
+                    usage = usage or make_usage()
+                    result["response"] = {"status_code": 200, "body": {
+                        "model": body["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": parsed.model_dump_json()}}],
+                        "usage": {"prompt_tokens": usage["prompt_tokens"], "completion_tokens": usage["completion_tokens"],
+                                  "prompt_tokens_details": {"cached_tokens": usage["cached_tokens"]}},
+                    }}
+                except Exception as e:
+                    status = getattr(e, "status", None)
+                    result["response"] = {"status_code": status or 500, "body": {}}
+                    result["error"] = {"code": type(e).__name__, "message": str(e)}
+                out.write(json.dumps(result) + "\n")
+        job["state"] = "done"
+
+    def poll(self, job_id):
+        job = self._jobs[job_id]
+        if job["state"] == "pending" and time.monotonic() - job["submitted"] >= self.turnaround:
+            self._process(job_id)
+        return job["state"]
+
+    def results(self, job_id):
+        schema = self._jobs.pop(job_id)["schema"]
+        with open(self._path(job_id, "output"), encoding="utf-8") as f:
+            out = dict(parse_openai_result(json.loads(line), schema) for line in f if line.strip())
+        if not self.keep_files:
+            for kind in ("input", "output"):
+                os.remove(self._path(job_id, kind))
+        return out
+
+class OpenAIBatchBackend:
+    """
+    OpenAI Batch API: the JSONL input is uploaded as a file, the job runs within the 24h
+    completion window, results come back as output/error files keyed by custom_id.
+    """
+    name = "openai"
+
+    def __init__(self, provider=None):
+        self.client = (provider or get_provider("openai")).client
+        self._schemas = {}
+
+    def submit(self, model, requests, response_schema, temperature):
+        lines = [json.dumps(openai_batch_line(cid, model, history, response_schema, temperature)) for cid, history in requests]
+        upload = self.client.files.create(file=("batch.jsonl", io.BytesIO("\n".join(lines).encode("utf-8"))), purpose="batch")
+        job = self.client.batches.create(input_file_id=upload.id, endpoint="/v1/chat/completions", completion_window="24h")
+        self._schemas[job.id] = response_schema
+        return job.id
+
+    def poll(self, job_id):
+        status = self.client.batches.retrieve(job_id).status
+        if status == "completed":
+            return "done"
+        if status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "pending"
+
+    def results(self, job_id):
+        schema = self._schemas.pop(job_id)
+        job = self.client.batches.retrieve(job_id)
+        out = {}
+        # An expired job still delivers what it finished
+        for file_id in (job.output_file_id, job.error_file_id):
+            if file_id:
+                for raw in self.client.files.content(file_id).text.splitlines():
+                    if raw.strip():
+                        custom_id, result = parse_openai_result(json.loads(raw), schema)
+                        out[custom_id] = result
+        return out
+
+class GeminiBatchBackend:
+    """
+    Gemini Batch Mode with inlined requests: answers come back in request order.
+    """
+    name = "google"
+    DONE = {"JOB_STATE_SUCCEEDED", "JOB_STATE_PARTIALLY_SUCCEEDED"}
+    FAILED = {"JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+
+    def __init__(self, provider=None):
+        self.client = (provider or get_provider("google")).client
+        self._jobs = {}
+
+    def submit(self, model, requests, response_schema, temperature):
+        inlined = [
+            types.InlinedRequest(
+                contents=GoogleProvider.to_contents(history),
+                metadata={"custom_id": custom_id},
+                config=GoogleProvider._config(response_schema, temperature),
+            )
+            for custom_id, history in requests
+        ]
+        job = self.client.batches.create(model=model, src=inlined, config={"display_name": f"os-agent-{model}"})
+        self._jobs[job.name] = ([custom_id for custom_id, _ in requests], response_schema)
+        return job.name
+
+    def poll(self, job_id):
+        state = self.client.batches.get(name=job_id).state.name
+        if state in self.DONE:
+            return "done"
+        if state in self.FAILED:
+            return "failed"
+        return "pending"
+
+    def results(self, job_id):
+        custom_ids, schema = self._jobs.pop(job_id)
+        job = self.client.batches.get(name=job_id)
+        responses = (job.dest.inlined_responses if job.dest else None) or []
+        out = {}
+        for custom_id, answer in zip(custom_ids, responses):
+            if answer.error is not None:
+                out[custom_id] = (None, None, BatchError(f"{answer.error.code}: {answer.error.message}", answer.error.code))
+                continue
+            usage = GoogleProvider.usage(answer.response)
+            try:
+                out[custom_id] = (schema.model_validate_json(answer.response.text), usage, None)
+            except Exception as e:
+                out[custom_id] = (None, usage, MalformedOutputError(f"Batch output did not match the schema: {e}"))
+        return out
+
+BATCH_BACKENDS = {"openai": OpenAIBatchBackend, "google": GeminiBatchBackend}
+_backends = {}
+
+def get_batch_backend(provider_name, mode="local", root=None):
+    """
+    mode "local": the file-based stand-in for every provider. mode "provider": the provider's
+    own batch API (providers without one, like the policy provider, use the stand-in).
+    """
+    if mode == "provider" and provider_name in BATCH_BACKENDS:
+        key = provider_name
+        factory = BATCH_BACKENDS[provider_name]
+    else:
+        key = "local"
+        factory = (lambda: LocalBatchBackend(root)) if root else LocalBatchBackend
+    if key not in _backends:
+        _backends[key] = factory()
+    return _backends[key]
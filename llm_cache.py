@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import textwrap
+import threading
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+CACHE_MODES = ["off", "record", "replay", "read_through"]
+DEFAULT_CACHE_PATH = os.path.join("os_logs", "llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+class CacheMiss(Exception):
+    """
+    Raised in replay mode when a request has no recorded response.
+    """
+
+def normalize_content(text):
+    # Prompts are built from indented triple-quoted strings; indentation and
+    # trailing whitespace are not meaningful to the model's answer.
+    text = text.replace("\r\n", "\n")
+    text = textwrap.dedent(text)
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+def cache_key(model, temperature, schema, history):
+    """
+    Content address of one request: sha256 over the canonical JSON of everything that
+    determines the response.
+    """
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "schema": schema,
+        "history": [{"role": h["role"], "content": normalize_content(h["content"])} for h in history],
+    }
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    On-disk LLM response store (SQLite) with size-based LRU eviction.
+
+    Modes:
+      * record       - always call the provider and (over)write the response
+      * replay       - never call the provider; a miss raises CacheMiss
+      * read_through - serve hits, call the provider and store on a miss
+    """
+    def __init__(self, path=DEFAULT_CACHE_PATH, mode="read_through", max_bytes=DEFAULT_MAX_BYTES):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode '{mode}'. Expected one of {CACHE_MODES}.")
+        self.path = path
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # WAL lets sharded worker processes share one cache file
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                used_model TEXT,
+                response TEXT,
+                size INTEGER,
+                created REAL,
+                last_access REAL,
+                usage TEXT
+            )
+        """)
+        # Caches recorded before token accounting lack the usage column
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(responses)")}
+        if "usage" not in columns:
+            self.conn.execute("ALTER TABLE responses ADD COLUMN usage TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_lru ON responses (last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def reads(self):
+        return self.mode in ("replay", "read_through")
+
+    @property
+    def writes(self):
+        return self.mode in ("record", "read_through")
+
+    def get(self, key):
+        """
+        Returns (response_json, used_model, usage) or None. In replay mode a miss raises CacheMiss.
+        `usage` is the token usage of the recorded request (None for old entries).
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT response, used_model, usage FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CacheMiss(f"No recorded response for request {key[:12]}")
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            return row[0], row[1], json.loads(row[2]) if row[2] else None
+
+    def put(self, key, model, used_model, response_json, usage=None):
+        size = len(response_json.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, used_model, response, size, created, last_access, usage) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, used_model, response_json, size, now, now, json.dumps(usage) if usage else None)
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        # Drop least-recently-used entries in chunks until we are back under budget
+        while self.total_bytes > self.max_bytes:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+            self.total_bytes -= sum(size for _, size in rows)
+
+    def stats(self):
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "bytes": self.total_bytes}
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,296 @@
+import os
+import time
+import random
+import asyncio
+from dotenv import load_dotenv
+from agent_telemetry import make_usage
+from agent_history import PromptMessages
+from scenarios import policy_script
+
+# Load Env
+load_dotenv()
+
+# The SDKs are only needed for the hosted providers; the local policy provider runs without them.
+try:
+    from google import genai
+    from google.genai import types
+except ImportError:
+    genai = None
+    types = None
+
+try:
+    from openai import OpenAI, AsyncOpenAI
+except ImportError:
+    OpenAI = None
+    AsyncOpenAI = None
+
+# ==========================================
+# ERRORS
+# ==========================================
+class ProviderError(Exception):
+    """
+    Base class for errors raised by providers. `status` mirrors the HTTP status when there is one.
+    """
+    status = None
+
+class RateLimitError(ProviderError):
+    status = 429
+
+class ServiceUnavailableError(ProviderError):
+    status = 503
+
+class MalformedOutputError(ProviderError):
+    pass
+
+# ==========================================
+# PROVIDER INTERFACE
+# ==========================================
+class LLMProvider:
+    """
+    A provider turns a standardized history ({'role': 'user'|'assistant', 'content': str})
+    into `(parsed, usage)`: one `response_schema` instance and an agent_telemetry.make_usage()
+    record (or None when the backend reports no usage).
+    """
+    name = "base"
+    fallback_model = None
+
+    def is_available(self):
+        return True
+
+    def complete(self, model, history, response_schema, temperature):
+        raise NotImplementedError
+
+    async def acomplete(self, model, history, response_schema, temperature):
+        raise NotImplementedError
+
+class GoogleProvider(LLMProvider):
+    """
+    Relies on Gemini's implicit caching (2.5 models), which matches any repeated prompt prefix,
+    earlier turns included. Explicit context caches are not used: the stable first message is
+    ~200 tokens, below their 1024-token minimum.
+    """
+    name = "google"
+    fallback_model = "gemini-2.5-flash"
+
+    def __init__(self, api_key=None):
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        self.client = genai.Client(api_key=api_key) if (api_key and genai) else None
+
+    def is_available(self):
+        return self.client is not None
+
+    @staticmethod
+    def to_content(h):
+        # Convert one message to Gemini format (user/model)
+        role = "model" if h["role"] == "assistant" else "user"
+        return types.Content(role=role, parts=[types.Part.from_text(text=h["content"])])
+
+    @classmethod
+    def to_contents(cls, history):
+        # A PromptMessages view keeps earlier conversions; only new messages are converted
+        if isinstance(history, PromptMessages):
+            return history.native(cls.name, cls.to_content)
+        return [cls.to_content(h) for h in history]
+
+    @staticmethod
+    def _config(response_schema, temperature):
+        return types.GenerateContentConfig(
+            temperature=temperature,
+            response_mime_type="application/json",
+            response_schema=response_schema
+        )
+
+    @staticmethod
+    def usage(response):
+        meta = response.usage_metadata
+        if meta is None:
+            return None
+        # Thinking tokens are billed as output on the 2.5 models
+        return make_usage(
+            meta.prompt_token_count,
+            (meta.candidates_token_count or 0) + (meta.thoughts_token_count or 0),
+            meta.cached_content_token_count,
+        )
+
+    def complete(self, model, history, response_schema, temperature):
+        response = self.client.models.generate_content(
+            model=model,
+            contents=self.to_contents(history),
+            config=self._config(response_schema, temperature)
+        )
+        if response.parsed is None: raise MalformedOutputError("Gemini Parsing Error")
+        return response.parsed, self.usage(response)
+
+    async def acomplete(self, model, history, response_schema, temperature):
+        response = await self.client.aio.models.generate_content(
+            model=model,
+            contents=self.to_contents(history),
+            config=self._config(response_schema, temperature)
+        )
+        if response.parsed is None: raise MalformedOutputError("Gemini Parsing Error")
+        return response.parsed, self.usage(response)
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+    fallback_model = "gpt-4o"
+
+    def __init__(self, api_key=None):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.client = OpenAI(api_key=api_key) if (api_key and OpenAI) else None
+        self.async_client = AsyncOpenAI(api_key=api_key) if (api_key and AsyncOpenAI) else None
+
+    def is_available(self):
+        return self.client is not None
+
+    @staticmethod
+    def _cache_hint(history):
+        # Automatic prompt caching matches on the prefix; a key derived from the stable prefix
+        # routes sessions that share it to the same cache
+        if getattr(history, "stable_prefix", 0):
+            return {"prompt_cache_key": history.prefix_digest()[:32]}
+        return {}
+
+    @staticmethod
+    def usage(completion):
+        usage = completion.usage
+        if usage is None:
+            return None
+        details = usage.prompt_tokens_details
+        return make_usage(usage.prompt_tokens, usage.completion_tokens, details.cached_tokens if details else 0)
+
+    def complete(self, model, history, response_schema, temperature):
+        # History is already in OpenAI format (system/user/assistant)
+        completion = self.client.beta.chat.completions.parse(
+            model=model,
+            messages=history,
+            temperature=temperature,
+            response_format=response_schema,
+            **self._cache_hint(history)
+        )
+        return completion.choices[0].message.parsed, self.usage(completion)
+
+    async def acomplete(self, model, history, response_schema, temperature):
+        completion = await self.async_client.beta.chat.completions.parse(
+            model=model,
+            messages=history,
+            temperature=temperature,
+            response_format=response_schema,
+            **self._cache_hint(history)
+        )
+        return completion.choices[0].message.parsed, self.usage(completion)
+
+# ==========================================
+# LOCAL POLICY PROVIDER (offline)
+# ==========================================
+# Scripted solutions come from the scenario registry (scenarios.policy_script).
+PLAN_MARKER = "(plan)"
+
+class PolicyProvider(LLMProvider):
+    """
+    Deterministic stand-in for an LLM. Model names select the strategy:
+      * policy-scripted - walks the scenario's scripted solution
+      * policy-random   - mixes in exploratory SELECTs and premature fix claims
+
+    Latency and error injection (429 / 503 / malformed output) are configurable so the
+    retry, throttling and logging paths of the harness can be load-tested offline.
+    """
+    name = "policy"
+    fallback_model = None
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rates=None, explore_rate=0.2, hallucinate_rate=0.05, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        # e.g. {"429": 0.05, "503": 0.01, "malformed": 0.01}
+        self.error_rates = error_rates or {}
+        self.explore_rate = explore_rate
+        self.hallucinate_rate = hallucinate_rate
+        self.rng = random.Random(seed)
+
+    def _latency(self):
+        jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        return max(0.0, (self.latency_ms + jitter) / 1000.0)
+
+    def _maybe_fail(self):
+        roll = self.rng.random()
+        for kind, rate in self.error_rates.items():
+            if roll < rate:
+                if kind == "429":
+                    raise RateLimitError("429 Rate limit exceeded (injected)")
+                if kind == "503":
+                    raise ServiceUnavailableError("503 Service Unavailable (injected)")
+                raise MalformedOutputError("Malformed JSON from policy provider (injected)")
+            roll -= rate
+
+    def _decide(self, model, history, response_schema):
+        context = history[0]["content"]
+        found = policy_script(context)
+        if found is None:
+            raise MalformedOutputError("Policy provider has no script for this scenario")
+        script, explore = found
+
+        # Stateless: progress is recovered from the history, so the same history always
+        # maps to the same kind of answer (plays well with the response cache)
+        # (compacted turns keep their reasoning in the summary message, marker included)
+        done = sum(h["content"].count(PLAN_MARKER) for h in history[1:])
+        position = min(done, len(script) - 1)
+
+        if model.startswith("policy-random"):
+            roll = self.rng.random()
+            if roll < self.hallucinate_rate:
+                return response_schema(reasoning="Looks fine to me.", sql_command="SELECT 1", is_fixed=True)
+            if roll < self.hallucinate_rate + self.explore_rate:
+                sql = self.rng.choice(explore)
+                return response_schema(reasoning="Double-check the current state.", sql_command=sql, is_fixed=False)
+
+        reasoning, sql, is_fixed = script[position]
+        return response_schema(reasoning=f"{PLAN_MARKER} {reasoning}", sql_command=sql, is_fixed=is_fixed)
+
+    @staticmethod
+    def usage(history, action):
+        # Same ~4 chars/token rule as rate_limiter.estimate_tokens, so offline runs have a cost profile
+        return make_usage(sum(len(h["content"]) for h in history) // 4, len(action.model_dump_json()) // 4)
+
+    def complete(self, model, history, response_schema, temperature):
+        time.sleep(self._latency())
+        self._maybe_fail()
+        action = self._decide(model, history, response_schema)
+        return action, self.usage(history, action)
+
+    async def acomplete(self, model, history, response_schema, temperature):
+        await asyncio.sleep(self._latency())
+        self._maybe_fail()
+        action = self._decide(model, history, response_schema)
+        return action, self.usage(history, action)
+
+# ==========================================
+# REGISTRY
+# ==========================================
+# Model-name prefix -> provider name. First match wins.
+MODEL_PREFIXES = [
+    ("policy", "policy"),
+    ("gpt", "openai"),
+    ("gemini", "google"),
+]
+
+_providers = {}
+
+def register_provider(provider):
+    """
+    Installs (or replaces) the provider instance used for its `name`.
+    """
+    _providers[provider.name] = provider
+    return provider
+
+def provider_for_model(model_name):
+    for prefix, name in MODEL_PREFIXES:
+        if model_name.startswith(prefix) or prefix in model_name:
+            return name
+    raise ValueError(f"No provider registered for model '{model_name}'.")
+
+def get_provider(name):
+    if name not in _providers:
+        factories = {"google": GoogleProvider, "openai": OpenAIProvider, "policy": PolicyProvider}
+        if name not in factories:
+            raise ValueError(f"Unknown provider '{name}'.")
+        _providers[name] = factories[name]()
+    return _providers[name]
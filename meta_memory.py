@@ -0,0 +1,574 @@
+import os
+import re
+import json
+import math
+import zlib
+import shutil
+import sqlite3
+import argparse
+import functools
+from collections import Counter
+import numpy as np
+from exp_logging import iter_log_batches, log_columns, read_log
+from experiment_plan import load_plan, plan_path
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+LOG_DIR = "os_logs"
+MEMORY_DIR = os.path.join(LOG_DIR, "meta_memory")
+
+DEFAULT_CONFIG = {
+    "embedder": "hashing",
+    "dim": 256,
+    "nprobe": 8,              # IVF lists scanned per query
+    "ivf_min_rows": 20000,    # below this an exact scan is already sub-millisecond
+    "retrain_growth": 2.0,    # re-run k-means once the index has grown this much since training
+    "kmeans_iters": 8,
+    "kmeans_sample": 32,      # training rows per list
+    "slack": 0.5,             # spare capacity per IVF list, so appends land in place
+    "chunk_rows": 65536,      # rows per matmul in exact scans and builds
+    "seed": 0,
+}
+# Flag bits per stored step (search filters)
+FIX_SESSION = 1   # the session was actually fixed
+WRITE_STEP = 2    # the step changed the VM (UPDATE / DELETE / INSERT)
+OK_STEP = 4       # the kernel did not answer with an error
+FIX_STEP = FIX_SESSION | WRITE_STEP | OK_STEP
+DISTINCT_FIX = 8  # first stored occurrence of this fix statement in its scenario (recall dedupes on it)
+
+MAX_FIELD_CHARS = 2000
+WRITE_RE = re.compile(r"^\s*(UPDATE|DELETE|INSERT|REPLACE)\b", re.IGNORECASE)
+ERROR_RE = re.compile(r"\bERR|ERROR|Error|aborted")
+TRACE_FIELDS = ["Session_UUID", "Step_Num", "Reasoning", "SQL_Command", "Tool_Output"]
+SESSION_FIELDS = ["Session_UUID", "Variant", "Persona", "Model", "Outcome", "Is_Actually_Fixed"]
+
+# ==========================================
+# EMBEDDERS
+# ==========================================
+TOKEN_RE = re.compile(r"[a-z_][a-z0-9_]*|\d+")
+
+@functools.lru_cache(maxsize=1 << 18)
+def _bucket(feature, dim):
+    h = zlib.crc32(feature.encode("utf-8"))
+    return h % dim, (1.0 if h & 0x80000000 else -1.0)
+
+class HashingEmbedder:
+    """
+    Offline embedder: tokens (identifiers also split at underscores, so 'apache_svc' shares
+    'apache' with 'Apache_Web_Server') hashed (signed crc32) into `dim` buckets with sublinear
+    term frequency, L2-normalized. Stateless, so stored vectors never go stale; the index adds
+    IDF weighting on the query side.
+    """
+    name = "hashing"
+
+    def __init__(self, dim=DEFAULT_CONFIG["dim"]):
+        self.dim = dim
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = TOKEN_RE.findall(text.lower())
+            features = Counter(tokens)
+            features.update(part for token in tokens if "_" in token for part in token.split("_") if part)
+            for feature, tf in features.items():
+                bucket, sign = _bucket(feature, self.dim)
+                out[i, bucket] += sign * (1.0 + math.log(tf))
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+
+# Name -> factory(dim=...) of objects with `name`, `dim` and `embed(texts) -> (n, dim) float32`
+EMBEDDERS = {"hashing": HashingEmbedder}
+
+def register_embedder(name, factory):
+    EMBEDDERS[name] = factory
+
+# ==========================================
+# VECTOR SEARCH
+# ==========================================
+def top_k(scores, ids, k):
+    """
+    Best k (score, id) per row of a (queries x candidates) score matrix, best first.
+    """
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores, ids = np.take_along_axis(scores, part, 1), np.take_along_axis(ids, part, 1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, 1), np.take_along_axis(ids, order, 1)
+
+def spherical_kmeans(X, k, iters, rng):
+    """
+    k unit-norm centroids of unit-norm rows (cosine k-means); empty clusters keep their centroid.
+    """
+    C = X[rng.choice(len(X), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = (X @ C.T).argmax(axis=1)
+        order = np.argsort(assign, kind="stable")
+        labels, starts = np.unique(assign[order], return_index=True)
+        sums = np.add.reduceat(X[order], starts, axis=0)
+        C[labels] = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return C
+
+# ==========================================
+# INDEX
+# ==========================================
+class MetaMemory:
+    """
+    Append-only index of embedded trace steps in one directory:
+      vectors.f32    rows x dim float32, memory-mapped
+      flags.u8       FIX_SESSION | WRITE_STEP | OK_STEP | DISTINCT_FIX per row
+      entries.sqlite the step's text and session metadata, keyed by row; distinct fix statements
+      ivf_<rows>/    IVF: centroids and one contiguous slot per list (vectors, row ids, flags)
+                     with spare capacity; appends are written into the slots, a full slot
+                     moves to the end of the file with twice the room
+      meta.json      row count, document frequencies and the IVF slot table; written last, so
+                     a crash mid-append leaves the previous state (trailing bytes are dropped on open)
+    """
+    def __init__(self, path=MEMORY_DIR, embedder=None, **config):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.config = {**DEFAULT_CONFIG, **config}
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"embedder": self.config["embedder"], "dim": self.config["dim"], "rows": 0,
+                         "df": [0] * self.config["dim"], "ivf": None}
+        self.embedder = embedder or EMBEDDERS[self.meta["embedder"]](dim=self.meta["dim"])
+        if (self.embedder.name, self.embedder.dim) != (self.meta["embedder"], self.meta["dim"]):
+            raise ValueError(f"Index {path} was built with {self.meta['embedder']}/{self.meta['dim']}, "
+                             f"not {self.embedder.name}/{self.embedder.dim}.")
+        self.dim = self.meta["dim"]
+        self.db = sqlite3.connect(os.path.join(path, "entries.sqlite"), check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            row INTEGER PRIMARY KEY, run_id TEXT, session_uuid TEXT, step INTEGER, scenario TEXT,
+            model TEXT, persona TEXT, variant TEXT, outcome TEXT, fixed INTEGER,
+            reasoning TEXT, sql TEXT, tool_output TEXT)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_entries_session ON entries (run_id, session_uuid, step)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fixes (scenario TEXT, sql TEXT, row INTEGER, PRIMARY KEY (scenario, sql))")
+        self._recover()
+        self._maps = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _recover(self):
+        # Drop whatever an interrupted append left past the committed row count
+        rows = self.meta["rows"]
+        for name, width in (("vectors.f32", self.dim * 4), ("flags.u8", 1)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > rows * width:
+                with open(self._file(name), "r+b") as f:
+                    f.truncate(rows * width)
+        with self.db:
+            self.db.execute("DELETE FROM entries WHERE row >= ?", (rows,))
+            self.db.execute("DELETE FROM fixes WHERE row >= ?", (rows,))
+
+    def _write_meta(self):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self._file("meta.json"))
+
+    def close(self):
+        self._maps = None
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def rows(self):
+        return self.meta["rows"]
+
+    def _mapped(self):
+        """
+        Read-only memory maps of the committed rows (and of the IVF slots), reopened after appends.
+        """
+        if self._maps is None:
+            rows, dim = self.rows, self.dim
+            maps = {"vectors": np.zeros((0, dim), np.float32), "flags": np.zeros(0, np.uint8)}
+            if rows:
+                maps["vectors"] = np.memmap(self._file("vectors.f32"), np.float32, "r", shape=(rows, dim))
+                maps["flags"] = np.memmap(self._file("flags.u8"), np.uint8, "r", shape=(rows,))
+            ivf = self.meta["ivf"]
+            if ivf:
+                folder = self._file(ivf["dir"])
+                maps["centroids"] = np.load(os.path.join(folder, "centroids.npy"))
+                maps["starts"], maps["sizes"] = np.asarray(ivf["starts"]), np.asarray(ivf["sizes"])
+                # Plain ndarray views: slicing a memmap subclass costs more than scoring a short list
+                maps["ivf_vectors"] = np.asarray(np.memmap(os.path.join(folder, "vectors.f32"), np.float32, "r", shape=(ivf["end"], dim)))
+                maps["ivf_rows"] = np.asarray(np.memmap(os.path.join(folder, "rows.i64"), np.int64, "r", shape=(ivf["end"],)))
+                maps["ivf_flags"] = np.asarray(np.memmap(os.path.join(folder, "flags.u8"), np.uint8, "r", shape=(ivf["end"],)))
+            df = np.asarray(self.meta["df"], dtype=np.float64)
+            maps["idf"] = (np.log((1.0 + rows) / (1.0 + df)) + 1.0).astype(np.float32)
+            self._maps = maps
+        return self._maps
+
+    # ------------------------------------------
+    # APPEND
+    # ------------------------------------------
+    def append(self, entries):
+        """
+        Embeds and stores entries (dicts: text, flags and the entries-table columns).
+        """
+        if not entries:
+            return 0
+        return self.add_vectors(self.embedder.embed([e["text"] for e in entries]), entries)
+
+    def add_vectors(self, vectors, entries):
+        """
+        Stores precomputed vectors (from this index's embedder) with their entries.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        start = self.rows
+        # The same fix recurs in many sessions; only its first occurrence is marked for recall
+        flags, fixes = [], {}
+        for i, e in enumerate(entries):
+            flag = e.get("flags", 0)
+            key = (e.get("scenario"), e.get("sql"))
+            if flag & FIX_STEP == FIX_STEP and key not in fixes and self.db.execute(
+                    "SELECT 1 FROM fixes WHERE scenario IS ? AND sql IS ?", key).fetchone() is None:
+                fixes[key] = start + i
+                flag |= DISTINCT_FIX
+            flags.append(flag)
+        flags = np.array(flags, dtype=np.uint8)
+        with open(self._file("vectors.f32"), "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self._file("flags.u8"), "ab") as f:
+            f.write(flags.tobytes())
+        columns = ["run_id", "session_uuid", "step", "scenario", "model", "persona", "variant", "outcome", "fixed",
+                   "reasoning", "sql", "tool_output"]
+        with self.db:
+            self.db.executemany(f"INSERT INTO entries (row, {', '.join(columns)}) VALUES ({', '.join('?' * (len(columns) + 1))})",
+                                [[start + i] + [e.get(c) for c in columns] for i, e in enumerate(entries)])
+            self.db.executemany("INSERT INTO fixes (scenario, sql, row) VALUES (?, ?, ?)",
+                                [(scenario, sql, row) for (scenario, sql), row in fixes.items()])
+        if self.meta["ivf"]:
+            self._ivf_add(vectors, flags, start)
+        self.meta["df"] = (np.asarray(self.meta["df"]) + (vectors != 0).sum(axis=0)).tolist()
+        self.meta["rows"] = start + len(entries)
+        self._write_meta()
+        self._maps = None
+        self.maintain()
+        return len(entries)
+
+    def known_steps(self, run_id):
+        return set(self.db.execute("SELECT session_uuid, step FROM entries WHERE run_id=?", (run_id,)).fetchall())
+
+    def ingest_run(self, metrics_path, trace_path, run_id, log_dir=LOG_DIR, batch_rows=8192):
+        """
+        Appends the steps of a logged run that are not in the index yet; returns how many.
+        """
+        plan = load_plan(plan_path(log_dir, run_id)) if os.path.exists(plan_path(log_dir, run_id)) else {}
+        scenario = plan.get("scenario", "port_conflict")
+        fields = [c for c in SESSION_FIELDS if c in log_columns(metrics_path)]
+        sessions = {row["Session_UUID"]: row for row in read_log(metrics_path, columns=fields).to_dict("records")}
+        known = self.known_steps(run_id)
+        added = 0
+        for batch in iter_log_batches(trace_path, columns=[c for c in TRACE_FIELDS if c in log_columns(trace_path)],
+                                      batch_rows=batch_rows):
+            entries = []
+            for row in batch.to_dict("records"):
+                session = sessions.get(row["Session_UUID"])
+                step = int(row["Step_Num"])
+                # Steps of sessions that never finished, API failures and what is indexed already are skipped
+                if session is None or row["Reasoning"] == "API_FAILURE" or (row["Session_UUID"], step) in known:
+                    continue
+                fixed = str(session.get("Is_Actually_Fixed")) in ("True", "true", "1")
+                sql, reasoning = str(row["SQL_Command"]), str(row["Reasoning"])[:MAX_FIELD_CHARS]
+                output = str(row["Tool_Output"])[:MAX_FIELD_CHARS]
+                entries.append({
+                    "text": f"{reasoning}\n{sql}\n{output}",
+                    "flags": ((FIX_SESSION if fixed else 0) | (WRITE_STEP if WRITE_RE.match(sql) else 0)
+                              | (0 if ERROR_RE.search(output) else OK_STEP)),
+                    "run_id": run_id, "session_uuid": row["Session_UUID"], "step": step, "scenario": scenario,
+                    "model": session.get("Model"), "persona": session.get("Persona"), "variant": session.get("Variant"),
+                    "outcome": session.get("Outcome"), "fixed": int(fixed),
+                    "reasoning": reasoning, "sql": sql, "tool_output": output,
+                })
+            added += self.append(entries)
+        return added
+
+    def ingest_dir(self, log_dir=LOG_DIR):
+        from exp_warehouse import discover_runs
+        return {run_id: self.ingest_run(metrics, trace, run_id, log_dir)
+                for run_id, metrics, trace in discover_runs(log_dir) if trace is not None}
+
+    # ------------------------------------------
+    # IVF
+    # ------------------------------------------
+    def maintain(self):
+        """
+        Trains the IVF once the index is large enough, and again after it has grown by `retrain_growth`
+        (which also compacts the slots). In between, appends go straight into the lists.
+        """
+        ivf, rows = self.meta["ivf"], self.rows
+        if rows >= self.config["ivf_min_rows"] and (ivf is None or rows >= ivf["trained_rows"] * self.config["retrain_growth"]):
+            self.build_ivf()
+
+    def _assign(self, X, centroids):
+        chunk = self.config["chunk_rows"]
+        return np.concatenate([(np.asarray(X[s:s + chunk]) @ centroids.T).argmax(axis=1)
+                               for s in range(0, len(X), chunk)] or [np.zeros(0, np.int64)])
+
+    def _capacity(self, size):
+        return size + max(16, int(size * self.config["slack"]))
+
+    def build_ivf(self):
+        """
+        Trains cosine k-means centroids (nlist ~ sqrt(nprobe * rows), which balances the centroid
+        scan against the list scan) and lays every list out in its own slot.
+        """
+        maps, rows = self._mapped(), self.rows
+        X = maps["vectors"]
+        rng = np.random.default_rng(self.config["seed"])
+        nlist = int(np.clip(math.sqrt(self.config["nprobe"] * rows), 16, 8192))
+        sample = np.sort(rng.choice(rows, min(rows, nlist * self.config["kmeans_sample"]), replace=False))
+        centroids = spherical_kmeans(np.asarray(X[sample]), nlist, self.config["kmeans_iters"], rng)
+        assign = self._assign(X, centroids)
+        sizes = np.bincount(assign, minlength=nlist)
+        caps = np.array([self._capacity(int(n)) for n in sizes])
+        starts = np.concatenate([[0], np.cumsum(caps)[:-1]])
+        end = int(caps.sum())
+
+        folder = f"ivf_{rows}"
+        target = self._file(folder)
+        os.makedirs(target, exist_ok=True)
+        np.save(os.path.join(target, "centroids.npy"), centroids)
+        vectors = np.memmap(os.path.join(target, "vectors.f32"), np.float32, "w+", shape=(end, self.dim))
+        ids = np.memmap(os.path.join(target, "rows.i64"), np.int64, "w+", shape=(end,))
+        flags = np.memmap(os.path.join(target, "flags.u8"), np.uint8, "w+", shape=(end,))
+        ids[:] = -1
+        # Slot of every row: its list's start + its rank within the list
+        order = np.argsort(assign, kind="stable")
+        lists = assign[order]
+        slots = starts[lists] + np.arange(rows) - np.searchsorted(lists, lists)
+        chunk = self.config["chunk_rows"]
+        for s in range(0, rows, chunk):
+            batch, dest = order[s:s + chunk], slots[s:s + chunk]
+            vectors[dest] = X[batch]
+            ids[dest] = batch
+            flags[dest] = maps["flags"][batch]
+        for array in (vectors, ids, flags):
+            array.flush()
+        del vectors, ids, flags
+
+        old = self.meta["ivf"]
+        self.meta["ivf"] = {"dir": folder, "rows": rows, "trained_rows": rows, "nlist": nlist, "end": end,
+                            "starts": starts.tolist(), "sizes": sizes.tolist(), "caps": caps.tolist()}
+        self._write_meta()
+        self._maps = None
+        if old and old["dir"] != folder:
+            shutil.rmtree(self._file(old["dir"]), ignore_errors=True)
+        print(f"   🧭 Meta-memory IVF: {rows} rows in {nlist} lists")
+
+    def _ivf_add(self, vectors, flags, start):
+        # Called before the meta commit: new rows only become visible with the updated slot table.
+        # Each list's new rows are contiguous, so they go in with one positioned write per list and file.
+        ivf = self.meta["ivf"]
+        folder = self._file(ivf["dir"])
+        assign = self._assign(vectors, self._mapped()["centroids"])
+        starts, sizes, caps = (np.asarray(ivf[key], dtype=np.int64) for key in ("starts", "sizes", "caps"))
+        counts = np.bincount(assign, minlength=len(starts))
+        order = np.argsort(assign, kind="stable")
+        columns = (vectors[order], (start + order).astype(np.int64), flags[order])
+        end = ivf["end"]
+        files = [(os.open(os.path.join(folder, name), os.O_RDWR), width)
+                 for name, width in (("vectors.f32", self.dim * 4), ("rows.i64", 8), ("flags.u8", 1))]
+        try:
+            offset = 0
+            for l in np.flatnonzero(counts):
+                n, size = counts[l], sizes[l]
+                if size + n > caps[l]:
+                    # A full list moves to the end of the file with room to grow
+                    cap = self._capacity(int(size + n) * 2)
+                    for fd, width in files:
+                        os.pwrite(fd, os.pread(fd, int(size * width), int(starts[l] * width)), end * width)
+                    starts[l], caps[l] = end, cap
+                    end += cap
+                for (fd, width), column in zip(files, columns):
+                    os.pwrite(fd, column[offset:offset + n].tobytes(), int((starts[l] + size) * width))
+                offset += n
+            for fd, width in files:
+                os.ftruncate(fd, end * width)
+        finally:
+            for fd, _ in files:
+                os.close(fd)
+        ivf.update(rows=start + len(vectors), end=end, starts=starts.tolist(), sizes=(sizes + counts).tolist(), caps=caps.tolist())
+
+    # ------------------------------------------
+    # SEARCH
+    # ------------------------------------------
+    def query_vectors(self, queries):
+        """
+        Embeds queries and weights them by IDF, so rare terms (service names, ports, error codes) dominate.
+        """
+        Q = self.embedder.embed(queries) * self._mapped()["idf"]
+        return Q / np.maximum(np.linalg.norm(Q, axis=1, keepdims=True), 1e-12)
+
+    def qualifying(self, require):
+        """
+        Sorted rows carrying every flag in `require`. DISTINCT_FIX rows come from the fixes table,
+        so recall does not read the flags of every step.
+        """
+        flags = self._mapped()["flags"]
+        if require & DISTINCT_FIX:
+            rows = np.array(sorted(row for (row,) in self.db.execute("SELECT row FROM fixes WHERE row < ?", (self.rows,))),
+                            dtype=np.int64)
+            return rows[(np.asarray(flags[rows]) & require) == require]
+        return np.flatnonzero((np.asarray(flags) & require) == require)
+
+    def _score_rows(self, Q, rows, k):
+        vectors, chunk = self._mapped()["vectors"], self.config["chunk_rows"]
+        best = (np.full((len(Q), 0), -np.inf, np.float32), np.full((len(Q), 0), -1, np.int64))
+        for s in range(0, len(rows), chunk):
+            ids = rows[s:s + chunk]
+            scores = Q @ np.asarray(vectors[ids]).T
+            best = top_k(np.hstack([best[0], scores]), np.hstack([best[1], np.broadcast_to(ids, scores.shape)]), k)
+        return best
+
+    def search_vectors(self, Q, k=5, require=0, exact=False):
+        """
+        (scores, rows) of the k best rows per query vector; rows are -1 where fewer than k qualify.
+        Exact: batched matmul over all rows. Otherwise the `nprobe` nearest IVF lists, each
+        scored in place from its slot. A filter that leaves at most `ivf_min_rows` rows (always
+        the case for DISTINCT_FIX) is scored exactly over those rows: rare flags are mostly absent
+        from the probed lists. Queries the IVF leaves short of k hits are rescanned exactly.
+        """
+        maps, rows = self._mapped(), self.rows
+        best = (np.full((len(Q), 0), -np.inf, np.float32), np.full((len(Q), 0), -1, np.int64))
+        qualifying = self.qualifying(require) if require and not exact and "centroids" in maps else None
+        if qualifying is not None and len(qualifying) <= self.config["ivf_min_rows"]:
+            best = self._score_rows(Q, qualifying, k)
+        elif exact or "centroids" not in maps:
+            chunk = self.config["chunk_rows"]
+            for s in range(0, rows, chunk):
+                scores = Q @ np.asarray(maps["vectors"][s:s + chunk]).T
+                if require:
+                    scores[:, (np.asarray(maps["flags"][s:s + chunk]) & require) != require] = -np.inf
+                ids = np.broadcast_to(np.arange(s, s + scores.shape[1]), scores.shape)
+                best = top_k(np.hstack([best[0], scores]), np.hstack([best[1], ids]), k)
+        else:
+            starts, sizes = maps["starts"], maps["sizes"]
+            nprobe = min(self.config["nprobe"], len(starts))
+            probes = np.argpartition(-(Q @ maps["centroids"].T), nprobe - 1, axis=1)[:, :nprobe]
+            found = []
+            for q, lists in zip(Q, probes):
+                spans = [(starts[l], starts[l] + sizes[l]) for l in lists if sizes[l]]
+                scores = np.concatenate([maps["ivf_vectors"][a:b] @ q for a, b in spans] or [np.zeros(0, np.float32)])
+                ids = np.concatenate([maps["ivf_rows"][a:b] for a, b in spans] or [np.zeros(0, np.int64)])
+                if require:
+                    flags = np.concatenate([maps["ivf_flags"][a:b] for a, b in spans] or [np.zeros(0, np.uint8)])
+                    scores[(flags & require) != require] = -np.inf
+                found.append(top_k(scores[None], ids[None], k))
+            best = (np.vstack([f[0] for f in found]), np.vstack([f[1] for f in found]))
+        scores, ids = best
+        ids = np.where(np.isfinite(scores), ids, -1)
+        if scores.shape[1] < k:
+            pad = k - scores.shape[1]
+            scores = np.hstack([scores, np.full((len(Q), pad), -np.inf, np.float32)])
+            ids = np.hstack([ids, np.full((len(Q), pad), -1, np.int64)])
+        short = (ids < 0).any(axis=1)
+        if qualifying is not None and len(qualifying) > self.config["ivf_min_rows"] and short.any():
+            scores[short], ids[short] = self.search_vectors(Q[short], k, require, exact=True)
+        return scores, ids
+
+    def entries(self, rows):
+        rows = [int(r) for r in rows if r >= 0]
+        if not rows:
+            return {}
+        cursor = self.db.execute(f"SELECT * FROM entries WHERE row IN ({', '.join('?' * len(rows))})", rows)
+        columns = [d[0] for d in cursor.description]
+        return {record[0]: dict(zip(columns, record)) for record in cursor.fetchall()}
+
+    def search(self, query, k=5, fixes_only=False, distinct=False, exact=False):
+        """
+        The k steps most similar to `query` (one text -> list of hits, a list of texts -> list
+        of lists), each hit an entries-table dict plus its cosine `score`. `fixes_only` keeps
+        successful writes of actually fixed sessions, `distinct` one step per fix statement.
+        """
+        single = isinstance(query, str)
+        require = (FIX_STEP if fixes_only else 0) | (DISTINCT_FIX if distinct else 0)
+        scores, rows = self.search_vectors(self.query_vectors([query] if single else list(query)), k, require, exact)
+        found = self.entries(rows.ravel())
+        hits = [[{**found[r], "score": float(s)} for s, r in zip(qs, qr) if r >= 0] for qs, qr in zip(scores, rows)]
+        return hits[0] if single else hits
+
+    def recall(self, goal, k=3, scenario=None, variant=None, exact=False):
+        """
+        Text block of the k distinct past fixes most relevant to `goal` (of `scenario` and `variant`, if given).
+        """
+        hits = [hit for hit in self.search(goal, k=k * 4, fixes_only=True, distinct=True, exact=exact)
+                if scenario in (None, hit["scenario"]) and variant in (None, hit["variant"])][:k]
+        if not hits:
+            return ""
+        lines = [f"- {hit['sql']} -> {hit['tool_output'][:120]}" for hit in hits]
+        return "PAST FIXES (statements that worked in similar earlier sessions; verify before reusing):\n" + "\n".join(lines)
+
+    def check_recall(self, goals=None, k=3, sample=50):
+        """
+        Goals whose recall differs from the exact scan's (an empty list means they agree). Without
+        `goals`, the reasoning of up to `sample` stored fixes stands in for them.
+        """
+        if goals is None:
+            goals = [reasoning for (reasoning,) in self.db.execute(
+                "SELECT e.reasoning FROM fixes f JOIN entries e ON e.row = f.row ORDER BY f.row LIMIT ?", (sample,))]
+        return [goal for goal in goals if self.recall(goal, k) != self.recall(goal, k, exact=True)]
+
+class MemoryHook:
+    """
+    OSAgent `memory` hook: goal -> past fixes appended to the first prompt.
+    """
+    def __init__(self, index, k=3, scenario=None, variant=None):
+        self.index = index
+        self.k = k
+        self.scenario = scenario
+        self.variant = variant
+
+    def __call__(self, goal):
+        return self.index.recall(goal, self.k, self.scenario, self.variant)
+
+# ==========================================
+# MAIN
+# ==========================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Meta-memory: retrieval index over past trace steps.")
+    parser.add_argument("--path", default=MEMORY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Append the steps of every run in --log-dir not indexed yet.")
+    ingest.add_argument("--log-dir", default=LOG_DIR)
+    search = sub.add_parser("search", help="Print the steps most similar to a query.")
+    search.add_argument("query")
+    search.add_argument("--k", type=int, default=5)
+    search.add_argument("--fixes-only", action="store_true", help="Only successful writes of actually fixed sessions.")
+    search.add_argument("--distinct", action="store_true", help="One step per fix statement (with --fixes-only).")
+    search.add_argument("--exact", action="store_true", help="Exact scan instead of the IVF lists.")
+    check = sub.add_parser("check", help="Verify that recall through the IVF matches the exact scan.")
+    check.add_argument("goals", nargs="*", help="Goals to recall for (default: the reasoning of stored fixes).")
+    check.add_argument("--k", type=int, default=3)
+    sub.add_parser("build-ivf", help="Retrain the IVF lists now (also compacts them).")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with MetaMemory(args.path) as memory:
+        if args.command == "ingest":
+            for run_id, added in memory.ingest_dir(args.log_dir).items():
+                print(f"📥 {run_id}: +{added} steps")
+            print(f"🧠 Meta-memory: {memory.rows} steps in {args.path}")
+        elif args.command == "search":
+            for hit in memory.search(args.query, args.k, args.fixes_only, args.distinct, args.exact):
+                print(f"{hit['score']:.3f}  {hit['run_id']}/{hit['session_uuid']} step {hit['step']} "
+                      f"({hit['model']}, fixed={bool(hit['fixed'])})\n       {hit['sql']}\n       -> {hit['tool_output'][:160]}")
+        elif args.command == "check":
+            mismatches = memory.check_recall(args.goals or None, args.k)
+            if mismatches:
+                for goal in mismatches:
+                    print(f"❌ IVF recall differs from the exact scan: {goal[:120]}")
+                raise SystemExit(1)
+            print(f"✅ IVF recall matches the exact scan ({memory.rows} steps, IVF: {bool(memory.meta['ivf'])})")
+        else:
+            memory.build_ivf()
@@ -0,0 +1,321 @@
+import time
+import threading
+from collections import deque, Counter
+from llm_providers import RateLimitError, ServiceUnavailableError, MalformedOutputError, provider_for_model, get_provider
+from rate_limiter import status_from_error
+
+# ==========================================
+# RETRY CLASSIFICATION
+# ==========================================
+# Retry class -> policy. `health`: counts as a failure of the model in its circuit breaker
+# (and may trigger failover); `backoff`: exponential (throttling, outages) or the flat error delay.
+RETRY_CLASSES = {
+    "throttle":    {"retry": True,  "health": True,  "backoff": "exponential"},
+    "unavailable": {"retry": True,  "health": True,  "backoff": "exponential"},
+    "timeout":     {"retry": True,  "health": True,  "backoff": "exponential"},
+    "malformed":   {"retry": True,  "health": False, "backoff": "flat"},
+    "unknown":     {"retry": True,  "health": False, "backoff": "flat"},
+    # Auth, bad request, ...: the same request would fail again
+    "fatal":       {"retry": False, "health": False, "backoff": "flat"},
+}
+# Status fed to the AIMD scheduler (rate_limiter.THROTTLE_STATUSES: all three shrink its limit)
+THROTTLE_STATUS = {"throttle": 429, "unavailable": 503, "timeout": 408}
+
+def error_status(error):
+    """
+    HTTP status of a provider or SDK exception (ProviderError.status, OpenAI status_code, google-genai code).
+    """
+    for attr in ("status", "status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+    return None
+
+def classify_error(error):
+    """
+    Retry class of an exception: by type and HTTP status first; the legacy message matching
+    only for untyped errors (e.g. batch results that carry a message).
+    """
+    if isinstance(error, RateLimitError):
+        return "throttle"
+    if isinstance(error, ServiceUnavailableError):
+        return "unavailable"
+    if isinstance(error, MalformedOutputError):
+        return "malformed"
+    status = error_status(error)
+    if status is not None:
+        if status == 429:
+            return "throttle"
+        if status == 408:
+            return "timeout"
+        if status >= 500:
+            return "unavailable"
+        if status >= 400:
+            return "fatal"
+    name = type(error).__name__
+    if isinstance(error, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    if isinstance(error, ConnectionError) or "Connection" in name:
+        return "unavailable"
+    if name == "ValidationError":
+        return "malformed"
+    message = str(error)
+    status = status_from_error(message)
+    if status == 429:
+        return "throttle"
+    if status == 503:
+        return "unavailable"
+    if "timed out" in message:
+        return "timeout"
+    return "unknown"
+
+# ==========================================
+# CIRCUIT BREAKERS
+# ==========================================
+BREAKER_CONFIG = {
+    "window": 50,          # rolling requests per model behind the error rate and the p95 latency
+    "min_calls": 10,       # requests in the window before either can open the breaker
+    "error_rate": 0.5,     # open at this share of health failures
+    "p95_ms": None,        # open when the p95 latency of successful requests exceeds this (None = off)
+    "open_seconds": 30.0,  # cool-down before half-open probes are let through
+    "probes": 1,           # concurrent probe requests while half-open
+}
+# Longest a call waits for a probe slot when every candidate's breaker is open (then the step fails)
+MAX_BREAKER_WAIT = 120.0
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+class CircuitBreaker:
+    """
+    Health of one model, shared by every session in the process. Closed: requests flow and
+    their outcomes fill the rolling window. Open (error rate or p95 over the limit): requests
+    are refused for `open_seconds`. Half-open: `probes` requests go through; a healthy probe
+    closes the breaker, a failed one opens it again.
+    """
+    def __init__(self, model, window, min_calls, error_rate, p95_ms, open_seconds, probes):
+        self.model = model
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.p95_ms = p95_ms
+        self.open_seconds = open_seconds
+        self.probes = probes
+        # (healthy, latency_ms or None)
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = 0
+        self.trips = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+
+    def _current(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probing = 0
+        return self.state
+
+    def current(self):
+        with self._lock:
+            return self._current(time.monotonic())
+
+    def allow(self):
+        """
+        The state a request was let through in (CLOSED, or HALF_OPEN for a probe), None if refused.
+        A probe claims a slot, so the caller must record() its outcome or release() it.
+        """
+        with self._lock:
+            state = self._current(time.monotonic())
+            if state == CLOSED:
+                return CLOSED
+            if state == HALF_OPEN and self.probing < self.probes:
+                self.probing += 1
+                return HALF_OPEN
+            self.refused += 1
+            return None
+
+    def release(self):
+        """
+        Frees a probe slot whose request ended without an outcome (cancelled or interrupted).
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probing = max(0, self.probing - 1)
+
+    def retry_in(self):
+        """
+        Seconds until the breaker lets a probe through (0 unless open).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._current(now) != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.open_seconds - now)
+
+    def _p95(self):
+        latencies = sorted(ms for healthy, ms in self.outcomes if healthy and ms is not None)
+        return latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0
+
+    def _unhealthy(self):
+        if len(self.outcomes) < self.min_calls:
+            return False
+        failures = sum(1 for healthy, _ in self.outcomes if not healthy)
+        if failures / len(self.outcomes) >= self.error_rate:
+            return True
+        return self.p95_ms is not None and self._p95() > self.p95_ms
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        print(f"   🔌 [{self.model}] Circuit open for {self.open_seconds:.0f}s")
+
+    def record(self, healthy, latency_ms=None, probe=False):
+        """
+        Books one outcome. Only a probe's (`probe`: the request held a half-open slot) decides
+        the half-open state; a slower request admitted while closed is just added to the window.
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current(now)
+            if state == HALF_OPEN and probe:
+                self.probing = max(0, self.probing - 1)
+                if healthy and (self.p95_ms is None or latency_ms is None or latency_ms <= self.p95_ms):
+                    # A fresh window, so the failures that opened it do not trip it again
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self.outcomes.append((healthy, latency_ms))
+            if state == CLOSED and self._unhealthy():
+                self._open(now)
+
+    def snapshot(self):
+        with self._lock:
+            n = len(self.outcomes)
+            return {
+                "model": self.model,
+                "state": self._current(time.monotonic()),
+                "error_rate": round(sum(1 for healthy, _ in self.outcomes if not healthy) / n, 3) if n else 0.0,
+                "p95_ms": round(self._p95(), 1),
+                "trips": self.trips,
+                "refused": self.refused,
+            }
+
+# ==========================================
+# FAILOVER POLICIES
+# ==========================================
+# none          - every attempt goes to the assigned model (its breaker only paces it)
+# same_provider - the provider's fallback_model after FAILOVER_AFTER failures or while the
+#                 model's breaker is open (the original behaviour, now remembered across steps)
+# chain         - FAILOVER_CHAINS, across providers (those without credentials are skipped)
+FAILOVER_POLICIES = ["none", "same_provider", "chain"]
+DEFAULT_FAILOVER = "same_provider"
+FAILOVER_CHAINS = {
+    "gemini-2.5-flash-lite": ["gemini-2.5-flash", "gpt-4o-mini"],
+    "gemini-2.5-flash":      ["gemini-2.5-flash-lite", "gpt-4o"],
+    "gpt-4o-mini":           ["gpt-4o", "gemini-2.5-flash-lite"],
+    "gpt-4o":                ["gpt-4o-mini", "gemini-2.5-flash"],
+}
+# Health failures on one model within a call before the call moves down the candidate list
+FAILOVER_AFTER = 2
+
+def failover_candidates(model, policy=DEFAULT_FAILOVER):
+    """
+    Models a call of `model` may be answered by, in order of preference.
+    """
+    if policy not in FAILOVER_POLICIES:
+        raise ValueError(f"Unknown failover policy '{policy}' ({', '.join(FAILOVER_POLICIES)}).")
+    if policy == "none":
+        return [model]
+    if policy == "same_provider":
+        fallback = get_provider(provider_for_model(model)).fallback_model
+        same = fallback and provider_for_model(fallback) == provider_for_model(model)
+        return [model] + ([fallback] if same and fallback != model else [])
+    return [model] + [m for m in FAILOVER_CHAINS.get(model, [])
+                      if m != model and get_provider(provider_for_model(m)).is_available()]
+
+class Failover:
+    """
+    Routing of one model call: which candidate each attempt goes to, and the record of why
+    (logged per step: the reason a later candidate answered, the failed attempts' retry classes
+    and the assigned model's breaker state when the call started).
+    """
+    def __init__(self, model, policy=DEFAULT_FAILOVER):
+        self.model = model
+        self.candidates = failover_candidates(model, policy)
+        self.failures = Counter()
+        self.errors = []
+        self.reason = None
+        self.state = get_breaker(model).current()
+        # Model whose half-open probe slot this call holds until its outcome is recorded
+        self.probe = None
+
+    def next_model(self):
+        """
+        (model, 0) for the next attempt, or (None, seconds until a probe) when every candidate is open.
+        """
+        skipped_by_errors = False
+        for i, model in enumerate(self.candidates):
+            last = i == len(self.candidates) - 1
+            if self.failures[model] >= FAILOVER_AFTER and not last:
+                skipped_by_errors = True
+                continue
+            admitted = get_breaker(model).allow()
+            if admitted:
+                self.probe = model if admitted == HALF_OPEN else None
+                if i > 0:
+                    self.reason = "errors" if skipped_by_errors else "circuit_open"
+                return model, 0.0
+        return None, min(get_breaker(m).retry_in() for m in self.candidates)
+
+    def succeeded(self, model, latency_ms=None):
+        probe, self.probe = self.probe == model, None
+        get_breaker(model).record(True, latency_ms, probe)
+
+    def failed(self, model, kind, latency_ms=None):
+        probe, self.probe = self.probe == model, None
+        self.errors.append(kind)
+        healthy = not RETRY_CLASSES[kind]["health"]
+        if not healthy:
+            self.failures[model] += 1
+        get_breaker(model).record(healthy, latency_ms if healthy else None, probe)
+
+    def refused(self):
+        self.errors.append("circuit_open")
+
+    def abandon(self):
+        """
+        Releases a probe slot still held when the call ends without an outcome (e.g. CancelledError,
+        KeyboardInterrupt); otherwise the breaker would stay half-open with no free slot.
+        """
+        if self.probe is not None:
+            get_breaker(self.probe).release()
+            self.probe = None
+
+    def trace_fields(self):
+        return {"failover": self.reason, "error_classes": ",".join(self.errors) or None, "breaker_state": self.state}
+
+# ==========================================
+# PROCESS-WIDE REGISTRY
+# ==========================================
+_breakers = {}
+_registry_lock = threading.Lock()
+
+def get_breaker(model):
+    """
+    Returns the shared circuit breaker of `model`, creating it on first use.
+    """
+    with _registry_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model, **BREAKER_CONFIG)
+        return _breakers[model]
+
+def health_stats():
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return [b.snapshot() for b in breakers]
+
+def reset_health():
+    with _registry_lock:
+        _breakers.clear()
@@ -1,25 +1,12 @@
-import os
 import time
-from dotenv import load_dotenv
+import asyncio
 from pydantic import BaseModel, Field
-
-# Load Env
-load_dotenv()
-
-# --- GOOGLE SETUP ---
-from google import genai
-from google.genai import types
-gemini_key = os.getenv("GEMINI_API_KEY")
-client_google = None
-if gemini_key:
-    client_google = genai.Client(api_key=gemini_key)
-
-# --- OPENAI SETUP ---
-from openai import OpenAI
-openai_key = os.getenv("OPENAI_API_KEY")
-client_openai = None
-if openai_key:
-    client_openai = OpenAI(api_key=openai_key)
+from rate_limiter import get_scheduler, estimate_tokens
+from llm_cache import cache_key
+from llm_providers import get_provider, provider_for_model
+from model_health import Failover, classify_error, RETRY_CLASSES, THROTTLE_STATUS, DEFAULT_FAILOVER, MAX_BREAKER_WAIT
+from agent_telemetry import CallStats, usage_total, emit_span
+from agent_history import ConversationHistory, HISTORY_POLICIES
 
 # 1. Output Schema (Universal)
 class OSAction(BaseModel):
@@ -27,16 +14,36 @@ class OSAction(BaseModel):
     sql_command: str = Field(description="The SQL command to run (SELECT/UPDATE/DELETE).")
     is_fixed: bool = Field(description="Set to True ONLY if you have verified the Service is RUNNING.")
 
+TEMPERATURE = 0.1
+OSACTION_SCHEMA = OSAction.model_json_schema()
+
 class OSAgent:
-    def __init__(self, model_name, persona):
+    # Backoff (seconds) for throttling errors, doubled per attempt, and the flat wait for other errors
+    RETRY_DELAY = 2
+    ERROR_DELAY = 1
+    API_FAILURE_FEEDBACK = "SYSTEM ERROR: Invalid Output Format or API Failure. Please retry."
+
+    def __init__(self, model_name, persona, cache=None, session_id=None, history_policy="full", memory=None,
+                 failover=DEFAULT_FAILOVER):
         self.model_name = model_name
-        self.provider = "openai" if "gpt" in model_name else "google"
+        self.provider = provider_for_model(model_name)
+        # Optional llm_cache.ResponseCache placed in front of the provider
+        self.cache = cache
+        # Only used to label telemetry spans
+        self.session_id = session_id
+        # Context management preset (agent_history.HISTORY_POLICIES) or a sequence of policies
+        self.history_policies = HISTORY_POLICIES[history_policy] if isinstance(history_policy, str) else history_policy
+        # Optional goal -> text hook (meta_memory.MemoryHook); its text is appended to the first prompt
+        self.memory = memory
+        # Failover policy (model_health.FAILOVER_POLICIES) over the shared circuit breakers
+        self.failover = failover
         
-        # Validation
-        if self.provider == "google" and not client_google:
-            raise ValueError("Model requires GEMINI_API_KEY.")
-        if self.provider == "openai" and not client_openai:
-            raise ValueError("Model requires OPENAI_API_KEY.")
+        self.llm = get_provider(self.provider)
+        
+        # Validation (a replay-only cache never reaches the provider)
+        offline = cache is not None and cache.mode == "replay"
+        if not self.llm.is_available() and not offline:
+            raise ValueError(f"Model '{model_name}' requires credentials for the {self.provider} provider (GEMINI_API_KEY / OPENAI_API_KEY).")
 
         # Persona Configuration
         if persona == "Junior":
@@ -44,81 +51,192 @@ class OSAgent:
         else:
             self.sys_prompt = "You are a Senior Kernel Engineer. You understand service dependencies, deadlocks, and buffer overflows. You fix root causes."
 
-        # Provider-Specific Fallbacks
-        if self.provider == "google":
-            self.fallback_model = "gemini-2.5-flash"
-        else:
-            self.fallback_model = "gpt-4o" 
+    def _dispatch(self, current_model, history):
+        # A failover target may belong to another provider
+        return get_provider(provider_for_model(current_model)).complete(current_model, history, OSAction, TEMPERATURE)
+
+    async def _dispatch_async(self, current_model, history):
+        return await get_provider(provider_for_model(current_model)).acomplete(current_model, history, OSAction, TEMPERATURE)
+
+    def _cache_get(self, history):
+        """
+        Returns (key, cached_result). cached_result is (OSAction, used_model, usage) on a hit.
+        """
+        if self.cache is None or self.cache.mode == "off":
+            return None, None
+        key = cache_key(self.model_name, TEMPERATURE, OSACTION_SCHEMA, history)
+        if not self.cache.reads:
+            return key, None
+        hit = self.cache.get(key)
+        if hit is None:
+            return key, None
+        response_json, used_model, usage = hit
+        return key, (OSAction.model_validate_json(response_json), used_model, usage)
+
+    def lookup(self, history):
+        """
+        Starts the accounting of one model call and consults the response cache.
+        Returns (cache_key, CallStats, OSAction or None on a miss).
+        """
+        call = CallStats(self.provider, history, self.session_id)
+        key, cached = self._cache_get(history)
+        if cached is None:
+            return key, call, None
+        action, used_model, usage = cached
+        call.from_cache(used_model, usage)
+        return key, call, action
+
+    def store(self, key, action, used_model, usage):
+        if key is not None and action is not None and self.cache.writes:
+            self.cache.put(key, self.model_name, used_model, action.model_dump_json(), usage)
+
+    def route(self):
+        """
+        Failover routing state for one model call (model_health.Failover).
+        """
+        return Failover(self.model_name, self.failover)
+
+    def _on_api_error(self, e, kind, current_model, delay):
+        """
+        Shared retry policy by retry class. Returns (sleep_seconds, next_delay).
+        """
+        print(f"   ⚠️ [{current_model}] {kind} error: {e}")
+        if RETRY_CLASSES[kind]["backoff"] == "exponential":
+            return delay, delay * 2
+        return self.ERROR_DELAY, delay
+
+    def _failed_attempt(self, e, route, call, start, current_model, scheduler, permit):
+        """
+        Books a failed request everywhere (call stats, AIMD scheduler, breaker). Returns its retry class.
+        """
+        kind = classify_error(e)
+        status = THROTTLE_STATUS.get(kind)
+        call.request_done(start, current_model, status=status, error=type(e).__name__)
+        scheduler.release(permit, status=status)
+        route.failed(current_model, kind, (time.perf_counter() - start) * 1000)
+        return kind
 
     def _call_api_robust(self, history, retries=3):
         """
         Dispatches to the correct provider with retry logic.
+        Each attempt goes to the first healthy failover candidate (shared circuit breakers).
+        Returns (OSAction or None, CallStats).
         """
-        delay = 2
-        current_model = self.model_name
+        key, call, action = self.lookup(history)
+        if action is not None:
+            return action, call
+
+        delay = self.RETRY_DELAY
+        route = self.route()
+        tokens = estimate_tokens(history)
+        # Held between scheduler.acquire and its release; returned in `finally` if the call is cancelled
+        scheduler, permit = None, None
         
-        for attempt in range(retries):
-            try:
-                # ==========================
-                # PATH A: GOOGLE GEMINI
-                # ==========================
-                if "gemini" in current_model:
-                    # Convert history to Gemini format (user/model)
-                    gemini_hist = []
-                    for h in history:
-                        role = "model" if h["role"] == "assistant" else "user"
-                        gemini_hist.append(types.Content(role=role, parts=[types.Part.from_text(text=h["content"])]))
-
-                    response = client_google.models.generate_content(
-                        model=current_model,
-                        contents=gemini_hist,
-                        config=types.GenerateContentConfig(
-                            temperature=0.1,
-                            response_mime_type="application/json",
-                            response_schema=OSAction
-                        )
-                    )
-                    if response.parsed is None: raise ValueError("Gemini Parsing Error")
-                    return response.parsed, current_model
-
-                # ==========================
-                # PATH B: OPENAI GPT
-                # ==========================
-                else:
-                    # History is already in OpenAI format (system/user/assistant)
-                    completion = client_openai.beta.chat.completions.parse(
-                        model=current_model,
-                        messages=history,
-                        temperature=0.1,
-                        response_format=OSAction
-                    )
-                    return completion.choices[0].message.parsed, current_model
-
-            except Exception as e:
-                error_msg = str(e)
-                print(f"   ⚠️ [{current_model}] Error (Attempt {attempt+1}): {error_msg}")
-                
-                # Retry logic for network/rate limits
-                if any(x in error_msg for x in ["503", "429", "timed out", "Rate limit"]):
-                    time.sleep(delay)
-                    delay *= 2
-                    
-                    # Switch to fallback if primary fails repeatedly
-                    if attempt >= 1 and current_model != self.fallback_model:
-                        # Ensure we switch to the correct provider's fallback
-                        if "gemini" in current_model and "gemini" in self.fallback_model:
-                            current_model = self.fallback_model
-                        elif "gpt" in current_model and "gpt" in self.fallback_model:
-                            current_model = self.fallback_model
-                else:
-                    time.sleep(1)
-                    
-        return None, current_model
+        try:
+            for _ in range(retries):
+                current_model, wait = route.next_model()
+                waited = 0.0
+                while current_model is None and waited < MAX_BREAKER_WAIT:
+                    # Every candidate is open: wait for a probe slot instead of hammering the provider
+                    start = time.perf_counter()
+                    time.sleep(max(wait, 0.05))
+                    call.backed_off(start)
+                    waited += time.perf_counter() - start
+                    current_model, wait = route.next_model()
+                if current_model is None:
+                    route.refused()
+                    return None, call
 
-    def repair_system(self, goal, schema_hint, execute_callback, max_steps=12):
-        # Initialize History with System Prompt
-        self.history = []
+                # Shared per-model budget: blocks until RPM/TPM and the adaptive concurrency limit allow it
+                scheduler = get_scheduler(provider_for_model(current_model), current_model)
+                start = time.perf_counter()
+                permit = scheduler.acquire(tokens)
+                start = call.queued(start, current_model)
+                try:
+                    result, usage = self._dispatch(current_model, history)
+                except Exception as e:
+                    kind = self._failed_attempt(e, route, call, start, current_model, scheduler, permit)
+                    permit = None
+                    if not RETRY_CLASSES[kind]["retry"]:
+                        break
+                    wait, delay = self._on_api_error(e, kind, current_model, delay)
+                    start = time.perf_counter()
+                    time.sleep(wait)
+                    call.backed_off(start)
+                    continue
+                route.succeeded(current_model, (time.perf_counter() - start) * 1000)
+                call.request_done(start, current_model, usage)
+                scheduler.release(permit, tokens_used=usage_total(usage) if usage else None, success=True)
+                permit = None
+                self.store(key, result, current_model, usage)
+                return result, call
+                        
+            return None, call
+        finally:
+            if permit is not None:
+                scheduler.release(permit)
+            route.abandon()
+            call.routed(route)
+
+    async def _call_api_robust_async(self, history, retries=3):
+        """
+        Async twin of _call_api_robust: backoff yields to the event loop instead of blocking it.
+        """
+        key, call, action = self.lookup(history)
+        if action is not None:
+            return action, call
+
+        delay = self.RETRY_DELAY
+        route = self.route()
+        tokens = estimate_tokens(history)
+        # Held between scheduler.acquire and its release; returned in `finally` if the call is cancelled
+        scheduler, permit = None, None
         
+        try:
+            for _ in range(retries):
+                current_model, wait = route.next_model()
+                waited = 0.0
+                while current_model is None and waited < MAX_BREAKER_WAIT:
+                    start = time.perf_counter()
+                    await asyncio.sleep(max(wait, 0.05))
+                    call.backed_off(start)
+                    waited += time.perf_counter() - start
+                    current_model, wait = route.next_model()
+                if current_model is None:
+                    route.refused()
+                    return None, call
+
+                scheduler = get_scheduler(provider_for_model(current_model), current_model)
+                start = time.perf_counter()
+                permit = await scheduler.acquire_async(tokens)
+                start = call.queued(start, current_model)
+                try:
+                    result, usage = await self._dispatch_async(current_model, history)
+                except Exception as e:
+                    kind = self._failed_attempt(e, route, call, start, current_model, scheduler, permit)
+                    permit = None
+                    if not RETRY_CLASSES[kind]["retry"]:
+                        break
+                    wait, delay = self._on_api_error(e, kind, current_model, delay)
+                    start = time.perf_counter()
+                    await asyncio.sleep(wait)
+                    call.backed_off(start)
+                    continue
+                route.succeeded(current_model, (time.perf_counter() - start) * 1000)
+                call.request_done(start, current_model, usage)
+                scheduler.release(permit, tokens_used=usage_total(usage) if usage else None, success=True)
+                permit = None
+                self.store(key, result, current_model, usage)
+                return result, call
+                        
+            return None, call
+        finally:
+            if permit is not None:
+                scheduler.release(permit)
+            route.abandon()
+            call.routed(route)
+
+    def _begin_repair(self, goal, schema_hint, max_steps):
         # We define a "Universal Context" that works for both providers.
         # OpenAI prefers a dedicated "system" message.
         # Gemini usually takes it in config, but accepts it as first user message too.
@@ -135,68 +253,152 @@ class OSAgent:
         2. Fix issues (UPDATE/DELETE).
         3. If you get an error, read it and fix the root cause (e.g., dependencies).
         """
+        recalled = self.memory(goal) if self.memory is not None else ""
+        if recalled:
+            context += f"\n{recalled}\n"
         
-        # Standardized History Format: list of dicts {'role': 'user'|'assistant', 'content': str}
-        self.history.append({"role": "user", "content": context})
+        # Standardized History Format: list of dicts {'role': 'user'|'assistant', 'content': str}.
+        # The context is the byte-stable prefix; self.history is the (compacted) view sent each step.
+        self.conversation = ConversationHistory(context, self.history_policies)
+        self.history = self.conversation.messages
         
-        trace_log = [] 
-        steps = 0
-        total_latency = 0
+        self.trace_log = [] 
+        self.steps = 0
+        self.total_latency = 0
         
         print(f"   🤖 {self.provider.upper()} Agent starting repair loop (Max {max_steps})...")
 
-        while steps < max_steps:
-            steps += 1
-            start = time.time()
+    def _apply_step(self, action_data, latency, call, execute_callback):
+        """
+        Records one model response and feeds the tool output back into history.
+        Returns True when the agent claims the fix.
+        """
+        self.total_latency += latency
+        # Latency_ms stays the wall time of the whole call; the breakdown sits next to it
+        stats = call.trace_fields()
+
+        # 2. HANDLE FAILURES
+        if action_data is None:
+            self.conversation.add_feedback(self.steps, self.API_FAILURE_FEEDBACK)
             
+            self.trace_log.append({
+                "step": self.steps,
+                "reasoning": "API_FAILURE",
+                "sql": "N/A",
+                "tool_output": "API Error",
+                "latency_ms": latency,
+                "tool_ms": 0,
+                **stats
+            })
+            return False
+
+        # 3. EXECUTE
+        tool_output = "N/A"
+        tool_start = time.perf_counter()
+        if not action_data.is_fixed:
+            tool_output = execute_callback(action_data.sql_command)
+            emit_span("tool.execute", tool_start, session=self.session_id, step=self.steps)
+        tool_ms = int(round((time.perf_counter() - tool_start) * 1000))
+        
+        # 4. TRACE
+        trace_entry = {
+            "step": self.steps,
+            "reasoning": action_data.reasoning,
+            "sql": action_data.sql_command,
+            "tool_output": tool_output,
+            "is_fixed_claim": action_data.is_fixed,
+            "latency_ms": latency,
+            "tool_ms": tool_ms,
+            **stats
+        }
+        self.trace_log.append(trace_entry)
+
+        if action_data.is_fixed:
+            return True
+
+        # 5. UPDATE HISTORY (Standardized)
+        # Model response ("Reasoning: ...\nSQL: ...") followed by the tool output ("TERMINAL OUTPUT:\n...").
+        # Note: For strict OpenAI history, we should theoretically store the tool call structure,
+        # but storing it as a text response works fine for this simulation and keeps compatibility with Gemini.
+        self.conversation.add_step(self.steps, action_data.reasoning, action_data.sql_command, tool_output)
+        return False
+
+    # ==========================================
+    # STEPPING API
+    # ==========================================
+    # The repair loop as a state machine, so a runner can own the model calls (e.g. submit
+    # step k of many sessions as one provider batch): start(), then next_request() /
+    # apply_response() until next_request() returns None, then result().
+    def start(self, goal, schema_hint, max_steps=12):
+        self._begin_repair(goal, schema_hint, max_steps)
+        self.max_steps = max_steps
+        self.outcome = None
+
+    def next_request(self):
+        """
+        Opens the next step and returns the history to send, or None once the session is over.
+        """
+        if self.outcome is None and self.steps >= self.max_steps:
+            self.outcome = "TIMEOUT"
+        if self.outcome is not None:
+            return None
+        self.steps += 1
+        self._step_start = time.perf_counter()
+        return self.history
+
+    def apply_response(self, action_data, call, execute_callback):
+        """
+        Closes the open step with the model's answer (None if every attempt failed).
+        """
+        latency = int((time.perf_counter() - self._step_start) * 1000)
+        claimed = self._apply_step(action_data, latency, call, execute_callback)
+        emit_span("agent.step", self._step_start, session=self.session_id, step=self.steps, model=call.model, claimed=claimed)
+        if claimed:
+            self.outcome = "CLAIMED_FIX"
+        return claimed
+
+    def result(self):
+        return self.outcome, self.steps, self.total_latency, self.trace_log
+
+    def replay(self, steps):
+        """
+        Fast-forwards a started session through recorded steps (trace_log entries, e.g. rebuilt
+        from a trace log) without calling the model or the VM: the conversation ends up as it
+        was after the last of them. Replayed entries carry no cost of their own.
+        """
+        for entry in steps:
+            self.steps = entry["step"]
+            if entry["reasoning"] == "API_FAILURE":
+                self.conversation.add_feedback(self.steps, self.API_FAILURE_FEEDBACK)
+            else:
+                self.conversation.add_step(self.steps, entry["reasoning"], entry["sql"], entry["tool_output"])
+            self.trace_log.append({**entry, "latency_ms": 0, "replayed": True})
+
+    def resume_repair(self, execute_callback):
+        """
+        Runs the loop from the current step (after start(), and optionally replay()) to the end.
+        """
+        while (history := self.next_request()) is not None:
             # 1. CALL API (Polymorphic)
-            action_data, used_model = self._call_api_robust(self.history)
-            
-            latency = int((time.time() - start) * 1000)
-            total_latency += latency
-
-            # 2. HANDLE FAILURES
-            if action_data is None:
-                error_feedback = "SYSTEM ERROR: Invalid Output Format or API Failure. Please retry."
-                self.history.append({"role": "user", "content": error_feedback})
-                
-                trace_log.append({
-                    "step": steps,
-                    "reasoning": "API_FAILURE",
-                    "sql": "N/A",
-                    "tool_output": "API Error",
-                    "latency_ms": latency
-                })
-                continue 
-
-            # 3. EXECUTE
-            tool_output = "N/A"
-            if not action_data.is_fixed:
-                tool_output = execute_callback(action_data.sql_command)
-            
-            # 4. TRACE
-            trace_entry = {
-                "step": steps,
-                "reasoning": action_data.reasoning,
-                "sql": action_data.sql_command,
-                "tool_output": tool_output,
-                "is_fixed_claim": action_data.is_fixed,
-                "latency_ms": latency
-            }
-            trace_log.append(trace_entry)
-
-            if action_data.is_fixed:
-                return "CLAIMED_FIX", steps, total_latency, trace_log
-
-            # 5. UPDATE HISTORY (Standardized)
-            # Store Model response
-            # Note: For strict OpenAI history, we should theoretically store the tool call structure,
-            # but storing it as a text response works fine for this simulation and keeps compatibility with Gemini.
-            model_response_text = f"Reasoning: {action_data.reasoning}\nSQL: {action_data.sql_command}"
-            self.history.append({"role": "assistant", "content": model_response_text})
-            
-            # Store Tool output
-            user_feedback = f"TERMINAL OUTPUT:\n{tool_output}"
-            self.history.append({"role": "user", "content": user_feedback})
-            
-        return "TIMEOUT", steps, total_latency, trace_log
\ No newline at end of file
+            action_data, call = self._call_api_robust(history)
+            self.apply_response(action_data, call, execute_callback)
+
+        return self.result()
+
+    async def resume_repair_async(self, execute_callback):
+        while (history := self.next_request()) is not None:
+            action_data, call = await self._call_api_robust_async(history)
+            self.apply_response(action_data, call, execute_callback)
+
+        return self.result()
+
+    def repair_system(self, goal, schema_hint, execute_callback, max_steps=12):
+        self.start(goal, schema_hint, max_steps)
+        return self.resume_repair(execute_callback)
+
+    async def repair_system_async(self, goal, schema_hint, execute_callback, max_steps=12):
+        """
+        Same loop as repair_system, but awaits the provider call so many sessions can share one event loop.
+        """
+        self.start(goal, schema_hint, max_steps)
+        return await self.resume_repair_async(execute_callback)
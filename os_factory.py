@@ -1,99 +1,263 @@
+import time
 import sqlite3
 import random
-from faker import Faker
+import threading
+from collections import deque
+from os_kernel import parse_sql
+from scenarios import get_scenario
 
-fake = Faker()
+DEFAULT_SCENARIO = "port_conflict"
 
-def setup_virtual_machine(variant="Treatment"):
+def _build_template(variant, scenario=DEFAULT_SCENARIO):
+    """
+    Builds the static part of a scenario once (scenarios.py). Randomized fields hold placeholders.
+    """
     conn = sqlite3.connect(":memory:")
-    cursor = conn.cursor()
-    
-    rogue_pid = random.randint(1000, 9999)
-    rogue_name = random.choice(['skype.exe', 'game.exe', 'backup.exe'])
-    
-    # ----------------------------------------------------
-    # SCENARIO B: TREATMENT (Friendly / Denormalized)
-    # ----------------------------------------------------
-    if variant == "Treatment":
-        # Table 1: Services (The Goal)
-        cursor.execute("CREATE TABLE System_Services (service_name TEXT, status TEXT, port_required INTEGER)")
-        cursor.execute("INSERT INTO System_Services VALUES ('Apache_Web_Server', 'STOPPED', 80)")
-        cursor.execute("INSERT INTO System_Services VALUES ('SQL_Database', 'RUNNING', 3306)")
-
-        # Table 2: Network (The Telemetry) - HAS NAMES
-        cursor.execute("CREATE TABLE Network_Ports (port INTEGER, protocol TEXT, process_name TEXT, status TEXT)")
-        cursor.execute(f"INSERT INTO Network_Ports VALUES (80, 'TCP', '{rogue_name}', 'LISTENING')")
-        cursor.execute("INSERT INTO Network_Ports VALUES (3306, 'TCP', 'mysqld.exe', 'LISTENING')")
-        
-    # ----------------------------------------------------
-    # SCENARIO A: CONTROL (Technical / Normalized)
-    # ----------------------------------------------------
-    else:
-        # Table 1: Services (The Goal)
-        cursor.execute("CREATE TABLE sys_config (svc_name TEXT, state INT, port INT)")
-        cursor.execute("INSERT INTO sys_config VALUES ('apache_svc', 0, 80)") # 0=Stop
-        
-        # Table 2: Netstat (The Conflict - PIDs only)
-        cursor.execute("CREATE TABLE net_active (local_port INT, pid INT, status TEXT)")
-        cursor.execute(f"INSERT INTO net_active VALUES (80, {rogue_pid}, 'LISTEN')")
-        
-        # Table 3: Process Table (The Name resolution)
-        cursor.execute("CREATE TABLE proc_list (pid INT, image TEXT)")
-        cursor.execute(f"INSERT INTO proc_list VALUES ({rogue_pid}, '{rogue_name}')")
+    get_scenario(scenario).build(conn, variant)
+    conn.commit()
+    return conn
 
+def _patch_randomized(conn, variant, scenario, params):
+    get_scenario(scenario).apply(conn, variant, params)
     conn.commit()
+
+def _draw(scenario, seed):
+    # A per-session seed makes the VM reproducible (needed for record/replay runs)
+    rng = random.Random(seed) if seed is not None else random
+    return get_scenario(scenario).draw(rng)
+
+# ==========================================
+# TEMPLATE SNAPSHOTS
+# ==========================================
+# (variant, scenario) -> serialized database image
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+
+def get_snapshot(variant, scenario=DEFAULT_SCENARIO):
+    key = (variant, scenario)
+    with _snapshot_lock:
+        if key not in _snapshots:
+            template = _build_template(variant, scenario)
+            _snapshots[key] = template.serialize()
+            template.close()
+        return _snapshots[key]
+
+def clone_vm(variant, scenario=DEFAULT_SCENARIO):
+    """
+    Fresh, writable in-memory VM restored from the template image (no DDL/INSERT replay).
+    """
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    conn.deserialize(get_snapshot(variant, scenario))
+    return conn
+
+def setup_virtual_machine(variant="Treatment", seed=None, scenario=DEFAULT_SCENARIO, params=None):
+    """
+    `params` from the session's Task (scenarios.py); otherwise drawn from `seed`.
+    """
+    params = params if params is not None else _draw(scenario, seed)
+    conn = clone_vm(variant, scenario)
+    _patch_randomized(conn, variant, scenario, params)
     return conn
 
-def execute_os_command(conn, query, variant):
-    cursor = conn.cursor()
-    
+# ==========================================
+# WARM VM POOL
+# ==========================================
+class VMPool:
+    """
+    Keeps `size` pre-cloned VMs per variant so acquire() only patches the randomized fields.
+    Released VMs are closed (their state is dirty) and the pool is topped back up.
+    """
+    def __init__(self, scenario=DEFAULT_SCENARIO, size=4):
+        self.scenario = scenario
+        self.size = size
+        self._ready = {}
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def warm(self, variant, n=None):
+        n = self.size if n is None else n
+        clones = [clone_vm(variant, self.scenario) for _ in range(n)]
+        with self._lock:
+            self._ready.setdefault(variant, deque()).extend(clones)
+
+    def acquire_vm(self, variant, seed=None, params=None):
+        params = params if params is not None else _draw(self.scenario, seed)
+
+        with self._lock:
+            ready = self._ready.get(variant)
+            conn = ready.popleft() if ready else None
+        if conn is None:
+            conn = clone_vm(variant, self.scenario)
+        _patch_randomized(conn, variant, self.scenario, params)
+        with self._lock:
+            self._owners[id(conn)] = variant
+        return conn
+
+    def owns(self, conn):
+        with self._lock:
+            return id(conn) in self._owners
+
+    def release(self, conn):
+        with self._lock:
+            variant = self._owners.pop(id(conn), None)
+            missing = self.size - len(self._ready.get(variant, ())) if variant else 0
+        conn.close()
+        if missing > 0:
+            self.warm(variant, 1)
+
+    def close(self):
+        with self._lock:
+            ready, self._ready = self._ready, {}
+        for queue in ready.values():
+            for conn in queue:
+                conn.close()
+
+# One pool per scenario, created on first use
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(scenario=DEFAULT_SCENARIO):
+    with _pools_lock:
+        if scenario not in _pools:
+            _pools[scenario] = VMPool(scenario)
+        return _pools[scenario]
+
+def acquire_vm(variant, seed=None, scenario=DEFAULT_SCENARIO, params=None):
+    return get_pool(scenario).acquire_vm(variant, seed, params)
+
+def release(conn):
+    pool = next((p for p in list(_pools.values()) if p.owns(conn)), None)
+    if pool is None:
+        conn.close()
+    else:
+        pool.release(conn)
+
+# ==========================================
+# RESULT GUARD
+# ==========================================
+# Budgets of one read; a result is never materialized beyond them:
+#   format        - "table": compact text with a truncation notice | "rows": the legacy list of dicts (unbounded)
+#   max_rows      - rows rendered into the output
+#   max_bytes     - size of the rendered output (wide rows hit this before max_rows)
+#   max_cell      - characters kept of a single value
+#   time_limit_ms - wall time before SQLite aborts a statement (cartesian joins, recursive CTEs); None = no limit
+RESULT_LIMITS = {"format": "table", "max_rows": 100, "max_bytes": 8192, "max_cell": 200, "time_limit_ms": 2000}
+# What runs recorded before the guard saw (plans without "result_limits")
+LEGACY_RESULT_LIMITS = {**RESULT_LIMITS, "format": "rows"}
+RESULT_FORMATS = ["table", "rows"]
+
+FETCH_BATCH = 64
+PROGRESS_STEPS = 10000  # SQLite VM instructions between two time-limit checks
+
+def _cell(value, max_cell):
+    if value is None:
+        return "NULL"
+    text = str(value).replace("\n", "\\n")
+    return text if len(text) <= max_cell else text[:max_cell] + "…"
+
+def count_rows(conn, sql):
+    """
+    Total rows of a SELECT without fetching them (SQLite flattens the subquery, so a plain
+    table scan becomes a b-tree count). None when the statement cannot be wrapped.
+    """
+    try:
+        return conn.execute(f"SELECT count(*) FROM (\n{sql}\n)").fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+def render_result(conn, cursor, stmt, limits):
+    """
+    Renders an executed read as header + one line per row, fetching with fetchmany only as
+    many rows as the row and byte budgets allow.
+    """
+    cols = [d[0] for d in cursor.description]
+    if limits["format"] == "rows":
+        return [dict(zip(cols, row)) for row in cursor.fetchall()]
+
+    max_rows, max_bytes, max_cell = limits["max_rows"], limits["max_bytes"], limits["max_cell"]
+    lines = [" | ".join(cols)]
+    size = len(lines[0])
+    shown, truncated = 0, False
+    while not truncated:
+        # One row past the budget tells whether anything was left out
+        batch = cursor.fetchmany(min(FETCH_BATCH, max_rows - shown + 1))
+        if not batch:
+            break
+        for row in batch:
+            line = " | ".join(_cell(v, max_cell) for v in row)
+            if shown >= max_rows or size + len(line) + 1 > max_bytes:
+                truncated = True
+                break
+            lines.append(line)
+            size += len(line) + 1
+            shown += 1
+    cursor.close()
+
+    if not truncated:
+        lines.append(f"({shown} row{'' if shown == 1 else 's'})")
+        return "\n".join(lines)
+    total = count_rows(conn, stmt.sql) if stmt.op == "SELECT" else None
+    of = f"{shown} of {total}" if total is not None else f"the first {shown}"
+    lines.append(f"[output truncated: showing {of} rows; narrow it with WHERE, LIMIT or fewer columns]")
+    return "\n".join(lines)
+
+def _set_time_limit(conn, time_limit_ms):
+    if not time_limit_ms:
+        conn.set_progress_handler(None, 0)
+        return
+    deadline = time.perf_counter() + time_limit_ms / 1000.0
+    # A truthy return makes SQLite abort the statement with "interrupted"
+    conn.set_progress_handler(lambda: time.perf_counter() > deadline, PROGRESS_STEPS)
+
+def _aborted(e, limits):
+    if isinstance(e, sqlite3.OperationalError) and str(e) == "interrupted":
+        return f"KERNEL ERROR: Command aborted after {limits['time_limit_ms']} ms (time limit). Narrow the query."
+    return None
+
+def _execute_statement(conn, stmt, rulebook, limits):
+    """
+    Returns (output, ok). `ok` is False when the statement failed, ran out of time or the kernel refused it.
+    """
     # 1. READ OPERATIONS
-    if query.strip().upper().startswith("SELECT") or "PRAGMA" in query.upper():
+    if stmt.is_read:
         try:
-            cursor.execute(query)
+            cursor = conn.cursor()
+            cursor.execute(stmt.sql)
             if cursor.description:
-                cols = [d[0] for d in cursor.description]
-                return [dict(zip(cols, row)) for row in cursor.fetchall()]
-            return "Command executed."
+                return render_result(conn, cursor, stmt, limits), True
+            return "Command executed.", True
         except Exception as e:
-            return f"SQL Error: {e}"
+            return _aborted(e, limits) or f"SQL Error: {e}", False
 
-    # 2. WRITE OPERATIONS
+    # 2. WRITE OPERATIONS (kernel rules decide; anything unmatched just runs)
     try:
-        # --- TREATMENT LOGIC ---
-        if variant == "Treatment":
-            # Attempt to Start Service
-            if "UPDATE System_Services" in query and "RUNNING" in query and "Apache_Web_Server" in query:
-                # Check if Port 80 is clear
-                cursor.execute("SELECT count(*) FROM Network_Ports WHERE port=80")
-                if cursor.fetchone()[0] > 0:
-                    return "ERROR 0x800: Port 80 is already in use by another process. Bind failed."
-            
-            # Attempt to Kill Process
-            if "DELETE FROM Network_Ports" in query:
-                cursor.execute(query)
-                conn.commit()
-                return f"Process Terminated. Rows affected: {cursor.rowcount}"
-
-        # --- CONTROL LOGIC ---
-        else:
-            # Attempt to Start Service
-            if "UPDATE sys_config" in query and "state=1" in query.replace(" ", "") and "apache_svc" in query:
-                # Check Port 80
-                cursor.execute("SELECT count(*) FROM net_active WHERE local_port=80")
-                if cursor.fetchone()[0] > 0:
-                    return "ERR_SERVICE_START_FAIL: Port 80 is currently in use by another process." 
-        
-            # Attempt to Kill Process
-            if "DELETE FROM" in query:
-                cursor.execute(query)
-                conn.commit()
-                return f"Process Terminated. Rows affected: {cursor.rowcount}"
-
-        # Execute if logic passed
-        cursor.execute(query)
-        conn.commit()
-        return f"SUCCESS. Rows affected: {cursor.rowcount}"
-        
+        return rulebook.execute(conn, stmt)
     except Exception as e:
-        return f"KERNEL ERROR: {e}"
\ No newline at end of file
+        return _aborted(e, limits) or f"KERNEL ERROR: {e}", False
+
+def execute_os_command(conn, query, variant, rules=None, limits=None):
+    """
+    Runs agent SQL under `rules` (the session Task's KernelRuleSet; default: the port conflict's)
+    and renders reads within `limits` (default: RESULT_LIMITS).
+    """
+    limits = {**RESULT_LIMITS, **(limits or {})}
+    rulebook = rules if rules is not None else get_scenario(DEFAULT_SCENARIO).rules(variant, None)
+    statements = parse_sql(query)
+    if not statements:
+        return "KERNEL ERROR: Empty command."
+
+    outputs = []
+    for stmt in statements:
+        _set_time_limit(conn, limits["time_limit_ms"])
+        try:
+            output, ok = _execute_statement(conn, stmt, rulebook, limits)
+        finally:
+            _set_time_limit(conn, None)
+        outputs.append(output)
+        # Like `cmd1 && cmd2`: stop at the first failure
+        if not ok:
+            break
+
+    if len(statements) == 1:
+        return outputs[0]
+    return "\n".join(f"[{i}] {out}" for i, out in enumerate(outputs, start=1))
@@ -0,0 +1,299 @@
+import re
+from functools import lru_cache
+
+# ==========================================
+# SQL TOKENIZER
+# ==========================================
+# Just enough SQL lexing to classify agent statements: operation, target table,
+# SET assignments and the WHERE clause, independent of spacing, case and quoting.
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^']|'')*'?)
+  | (?P<qident>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op><=|>=|<>|!=|==|\|\||[=<>(),;.*+\-/%])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+READ_OPS = {"SELECT", "PRAGMA", "EXPLAIN", "VALUES"}
+WRITE_OPS = {"UPDATE", "DELETE", "INSERT", "REPLACE"}
+
+class Token:
+    __slots__ = ("kind", "text", "value", "start", "end")
+
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+        if kind == "string":
+            self.value = text[1:-1].replace("''", "'") if len(text) > 1 and text.endswith("'") else text[1:]
+        elif kind == "qident":
+            self.value = text[1:-1] if len(text) > 1 else text[1:]
+        elif kind == "number":
+            self.value = float(text) if any(c in text for c in ".eE") else int(text)
+        else:
+            self.value = text
+
+    @property
+    def keyword(self):
+        return self.text.upper() if self.kind == "ident" else None
+
+def tokenize(sql):
+    return [
+        Token(m.lastgroup, m.group(), m.start(), m.end())
+        for m in _TOKEN_RE.finditer(sql)
+        if m.lastgroup not in ("ws", "comment")
+    ]
+
+def split_statements(sql):
+    """
+    Splits on top-level semicolons (ignoring those inside strings/comments).
+    Returns a list of (statement_sql, tokens), skipping empty statements.
+    """
+    statements = []
+    current = []
+    for tok in tokenize(sql):
+        if tok.kind == "op" and tok.text == ";":
+            if current:
+                statements.append(current)
+            current = []
+        else:
+            current.append(tok)
+    if current:
+        statements.append(current)
+    return [(sql[toks[0].start:toks[-1].end], toks) for toks in statements]
+
+# ==========================================
+# STATEMENT MODEL
+# ==========================================
+class Statement:
+    """
+    One parsed statement: op (SELECT/UPDATE/...), target table, SET assignments and WHERE text.
+    """
+    __slots__ = ("sql", "op", "table", "assignments", "where")
+
+    def __init__(self, sql, op, table=None, assignments=None, where=None):
+        self.sql = sql
+        self.op = op
+        self.table = table
+        self.assignments = assignments or {}
+        self.where = where
+
+    @property
+    def is_read(self):
+        return self.op in READ_OPS
+
+def _ident_value(tok):
+    return tok.value if tok.kind in ("ident", "qident") else None
+
+def _table_at(toks, i):
+    """
+    Reads a possibly schema-qualified table name starting at toks[i].
+    """
+    if i >= len(toks):
+        return None
+    name = _ident_value(toks[i])
+    while name is not None and i + 2 < len(toks) and toks[i + 1].text == "." and _ident_value(toks[i + 2]):
+        i += 2
+        name = _ident_value(toks[i])
+    return name.lower() if name else None
+
+def _main_op(toks):
+    # WITH ... AS (...) <op>: skip the CTE bodies and take the first top-level verb
+    depth = 0
+    for i, tok in enumerate(toks):
+        if tok.kind == "op" and tok.text == "(":
+            depth += 1
+        elif tok.kind == "op" and tok.text == ")":
+            depth -= 1
+        elif depth == 0 and tok.keyword in READ_OPS | WRITE_OPS:
+            return i, tok.keyword
+    return None, "WITH"
+
+def _literal(tok):
+    if tok.kind in ("string", "number"):
+        return tok.value
+    if tok.keyword in ("TRUE", "FALSE"):
+        return 1 if tok.keyword == "TRUE" else 0
+    if tok.keyword == "NULL":
+        return None
+    return tok.text
+
+def _parse_assignments(sql, toks, i):
+    """
+    SET a = expr, b = expr ... until WHERE/FROM/RETURNING or the end. Single-literal
+    expressions are normalized; anything else is kept as raw SQL text.
+    """
+    assignments = {}
+    n = len(toks)
+    while i < n and toks[i].keyword not in ("WHERE", "FROM", "RETURNING", "ORDER", "LIMIT"):
+        col = _ident_value(toks[i])
+        if col is None or i + 1 >= n or toks[i + 1].text not in ("=", "=="):
+            i += 1
+            continue
+        j = i + 2
+        depth = 0
+        while j < n:
+            t = toks[j]
+            if t.text == "(":
+                depth += 1
+            elif t.text == ")":
+                depth -= 1
+            elif depth == 0 and (t.text == "," or t.keyword in ("WHERE", "FROM", "RETURNING", "ORDER", "LIMIT")):
+                break
+            j += 1
+        expr = toks[i + 2:j]
+        if len(expr) == 1:
+            assignments[col.lower()] = _literal(expr[0])
+        elif len(expr) == 2 and expr[0].text == "-" and expr[1].kind == "number":
+            assignments[col.lower()] = -expr[1].value
+        elif expr:
+            assignments[col.lower()] = sql[expr[0].start:expr[-1].end]
+        i = j + 1 if j < n and toks[j].text == "," else j
+    return assignments, i
+
+def _where_text(sql, toks, i):
+    n = len(toks)
+    while i < n and toks[i].keyword != "WHERE":
+        i += 1
+    if i + 1 >= n:
+        return None
+    end = n
+    for j in range(i + 1, n):
+        if toks[j].keyword in ("RETURNING", "ORDER", "LIMIT"):
+            end = j
+            break
+    return sql[toks[i + 1].start:toks[end - 1].end] if end > i + 1 else None
+
+def parse_statement(sql, toks):
+    if not toks:
+        return Statement(sql, None)
+    start, op = (0, toks[0].keyword) if toks[0].keyword != "WITH" else _main_op(toks)
+    if op is None:
+        return Statement(sql, toks[0].text.upper())
+
+    if op == "UPDATE":
+        i = start + 1
+        # UPDATE OR REPLACE/IGNORE/... <table>
+        if i < len(toks) and toks[i].keyword == "OR":
+            i += 2
+        table = _table_at(toks, i)
+        while i < len(toks) and toks[i].keyword != "SET":
+            i += 1
+        assignments, i = _parse_assignments(sql, toks, i + 1)
+        return Statement(sql, op, table, assignments, _where_text(sql, toks, i))
+
+    if op == "DELETE":
+        i = start + 1
+        if i < len(toks) and toks[i].keyword == "FROM":
+            i += 1
+        return Statement(sql, op, _table_at(toks, i), where=_where_text(sql, toks, i))
+
+    if op in ("INSERT", "REPLACE"):
+        i = start + 1
+        while i < len(toks) and toks[i].keyword != "INTO":
+            i += 1
+        return Statement(sql, "INSERT", _table_at(toks, i + 1))
+
+    if op == "SELECT":
+        for i in range(start + 1, len(toks)):
+            if toks[i].keyword == "FROM":
+                return Statement(sql, op, _table_at(toks, i + 1))
+    return Statement(sql, op)
+
+@lru_cache(maxsize=4096)
+def parse_sql(query):
+    """
+    Parses agent input into a tuple of Statements (multi-statement input is supported).
+    Agents repeat themselves a lot, so parses are memoized; Statements are never mutated.
+    """
+    return tuple(parse_statement(sql, toks) for sql, toks in split_statements(query))
+
+# ==========================================
+# RULES
+# ==========================================
+def values_equal(actual, expected):
+    """
+    Compares the way an agent means it: case-insensitive text, '1' == 1 == 1.0.
+    """
+    if isinstance(actual, str) and isinstance(expected, str):
+        return actual.strip().casefold() == expected.casefold()
+    try:
+        return float(actual) == float(expected)
+    except (TypeError, ValueError):
+        return False
+
+class KernelRule:
+    """
+    A kernel behaviour bound to (op, table). table="*" matches any table.
+
+    * `sets`      - only applies when the statement assigns these column values
+    * `targets`   - (column, value): only applies when the statement's WHERE selects that row
+    * `blocked_if`- SQL returning a count; a non-zero count refuses the statement with `error`
+    * `response`  - message template for an accepted statement ({rowcount} is available)
+    """
+    def __init__(self, name, op, table, sets=None, targets=None, blocked_if=None, error=None, response=None):
+        self.name = name
+        self.op = op.upper()
+        self.table = table.lower()
+        self.sets = {k.lower(): v for k, v in (sets or {}).items()}
+        self.targets = targets
+        self.blocked_if = blocked_if
+        self.error = error
+        self.response = response
+
+    def applies(self, stmt, cursor):
+        for col, expected in self.sets.items():
+            if col not in stmt.assignments or not values_equal(stmt.assignments[col], expected):
+                return False
+        if self.targets is not None:
+            col, value = self.targets
+            where = f"({stmt.where}) AND {col} = ?" if stmt.where else f"{col} = ?"
+            # Let SQLite evaluate the agent's own WHERE clause against the target row
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM "{stmt.table}" WHERE {where})', (value,))
+            if not cursor.fetchone()[0]:
+                return False
+        return True
+
+    def is_blocked(self, cursor):
+        if self.blocked_if is None:
+            return False
+        cursor.execute(self.blocked_if)
+        return cursor.fetchone()[0] > 0
+
+class KernelRuleSet:
+    """
+    Rules indexed by (op, table) so each statement is classified with a dict lookup.
+    """
+    def __init__(self, rules):
+        self.index = {}
+        for rule in rules:
+            self.index.setdefault((rule.op, rule.table), []).append(rule)
+
+    def candidates(self, stmt):
+        return self.index.get((stmt.op, stmt.table), []) + self.index.get((stmt.op, "*"), [])
+
+    def execute(self, conn, stmt):
+        cursor = conn.cursor()
+        response = None
+        for rule in self.candidates(stmt):
+            if not rule.applies(stmt, cursor):
+                continue
+            if rule.is_blocked(cursor):
+                return rule.error, False
+            if rule.response and response is None:
+                response = rule.response
+
+        cursor.execute(stmt.sql)
+        conn.commit()
+        template = response or "SUCCESS. Rows affected: {rowcount}"
+        return template.format(rowcount=cursor.rowcount), True
+
+# ==========================================
+# RESPONSES
+# ==========================================
+# Shared by the scenarios' rulebooks (scenarios.py)
+KILL_RESPONSE = "Process Terminated. Rows affected: {rowcount}"
@@ -0,0 +1,180 @@
+import time
+import asyncio
+import threading
+
+# ==========================================
+# QUOTA CONFIGURATION
+# ==========================================
+# Budgets per model. rpm/tpm mirror the provider quota tier; max_concurrency is the
+# ceiling the AIMD controller may grow back to after a 429/503 storm.
+RATE_LIMITS = {
+    "gemini-2.5-flash-lite": {"rpm": 4000, "tpm": 4_000_000, "max_concurrency": 32},
+    "gemini-2.5-flash":      {"rpm": 1000, "tpm": 1_000_000, "max_concurrency": 16},
+    "gpt-4o-mini":           {"rpm": 5000, "tpm": 2_000_000, "max_concurrency": 32},
+    "gpt-4o":                {"rpm": 5000, "tpm": 800_000,   "max_concurrency": 16},
+    # Local policy provider: no real quota, but still routed through the scheduler so
+    # load benchmarks include its overhead
+    "policy-scripted":       {"rpm": 10**9, "tpm": 10**12,    "max_concurrency": 10**6},
+    "policy-random":         {"rpm": 10**9, "tpm": 10**12,    "max_concurrency": 10**6},
+}
+DEFAULT_LIMITS = {"rpm": 500, "tpm": 200_000, "max_concurrency": 8}
+
+# Statuses that mean "you are going too fast" and trigger the multiplicative decrease
+# Decrease signals of the AIMD controller; 408 stands for a timed-out request (overload that shows up as latency)
+THROTTLE_STATUSES = (429, 503, 408)
+
+# Rough completion budget reserved per request on top of the prompt estimate
+COMPLETION_TOKEN_RESERVE = 256
+
+def estimate_tokens(history):
+    """
+    Cheap prompt size estimate (~4 chars per token) used to reserve TPM before dispatch.
+    """
+    chars = sum(len(h["content"]) for h in history)
+    return chars // 4 + COMPLETION_TOKEN_RESERVE
+
+def status_from_error(error_msg):
+    if "429" in error_msg or "Rate limit" in error_msg:
+        return 429
+    if "503" in error_msg:
+        return 503
+    return None
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `per_minute / 60` tokens per second.
+    Not thread-safe on its own; ModelScheduler guards it with its lock.
+    """
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        self._refill(now)
+        # A single request larger than the whole bucket is let through once the bucket is full
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount):
+        self.tokens -= amount
+
+    def refund(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class Permit:
+    def __init__(self, scheduler, tokens):
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.issued = time.monotonic()
+
+class ModelScheduler:
+    """
+    Enforces RPM/TPM budgets for one (provider, model) pair and adapts the number of
+    in-flight requests AIMD-style: halve on 429/503/timeouts, grow by ~1 per window of successes.
+    """
+    POLL_INTERVAL = 0.05
+    # Consecutive throttles within this window count as one congestion event
+    DECREASE_COOLDOWN = 2.0
+
+    def __init__(self, provider, model, rpm, tpm, max_concurrency, min_concurrency=1):
+        self.provider = provider
+        self.model = model
+        self.requests = TokenBucket(rpm)
+        self.token_budget = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _try_acquire(self, tokens):
+        """
+        Returns a Permit, or the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.in_flight >= int(self.limit):
+                return self.POLL_INTERVAL
+            wait = max(self.requests.wait_time(1, now), self.token_budget.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self.requests.consume(1)
+            self.token_budget.consume(tokens)
+            self.in_flight += 1
+            return Permit(self, tokens)
+
+    def acquire(self, tokens):
+        while True:
+            result = self._try_acquire(tokens)
+            if isinstance(result, Permit):
+                return result
+            time.sleep(result)
+
+    async def acquire_async(self, tokens):
+        while True:
+            result = self._try_acquire(tokens)
+            if isinstance(result, Permit):
+                return result
+            await asyncio.sleep(result)
+
+    def release(self, permit, status=None, tokens_used=None, success=False):
+        """
+        Returns the concurrency slot and feeds the outcome into the AIMD controller: a throttle
+        status shrinks the limit, only `success` grows it (other failures and abandoned requests
+        leave it alone). `tokens_used` (from provider usage, when known) reconciles the TPM reservation.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            if tokens_used is not None:
+                self.token_budget.refund(permit.tokens - tokens_used)
+
+            now = time.monotonic()
+            if status in THROTTLE_STATUSES:
+                self.throttled += 1
+                if now - self.last_decrease > self.DECREASE_COOLDOWN:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.last_decrease = now
+            elif success:
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "provider": self.provider,
+                "model": self.model,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "throttled": self.throttled,
+            }
+
+# ==========================================
+# PROCESS-WIDE REGISTRY
+# ==========================================
+_schedulers = {}
+_registry_lock = threading.Lock()
+
+def get_scheduler(provider, model):
+    """
+    Returns the shared scheduler for (provider, model), creating it on first use.
+    """
+    key = (provider, model)
+    with _registry_lock:
+        if key not in _schedulers:
+            limits = RATE_LIMITS.get(model, DEFAULT_LIMITS)
+            _schedulers[key] = ModelScheduler(provider, model, **limits)
+        return _schedulers[key]
+
+def scheduler_stats():
+    with _registry_lock:
+        schedulers = list(_schedulers.values())
+    return [s.snapshot() for s in schedulers]
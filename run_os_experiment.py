@@ -1,12 +1,29 @@
 import pandas as pd
-import csv
+import argparse
+import asyncio
 import os
-import uuid
+import shutil
 import time
-import random
+import multiprocessing
+from collections import defaultdict
 from datetime import datetime
-from os_factory import setup_virtual_machine, execute_os_command
-from os_agent import OSAgent
+from os_factory import acquire_vm, release, execute_os_command, RESULT_LIMITS, LEGACY_RESULT_LIMITS, RESULT_FORMATS
+from scenarios import SCENARIOS, get_scenario
+from os_agent import OSAgent, OSAction, TEMPERATURE, provider_for_model
+from rate_limiter import scheduler_stats
+from model_health import classify_error, health_stats, RETRY_CLASSES, THROTTLE_STATUS, FAILOVER_POLICIES, DEFAULT_FAILOVER
+from llm_batch import get_batch_backend, BatchError, BATCH_POLL_SECONDS
+from llm_cache import ResponseCache, CACHE_MODES, DEFAULT_CACHE_PATH
+from experiment_plan import (
+    build_plan, build_adaptive_plan, append_batch, write_plan, load_plan, plan_path, journal_path, shard_units,
+    SessionJournal, read_journal
+)
+from exp_logging import ExperimentLogWriter, LOG_FORMATS, log_paths, trace_rows, filter_log, read_log
+from agent_history import HISTORY_POLICIES
+from agent_telemetry import session_totals, add_span_hook, remove_span_hook, JsonlSpanExporter, emit_span
+from sequential_analysis import SequentialMonitor, DEFAULT_CONFIG as SEQUENTIAL_DEFAULTS, session_values
+from adaptive_allocation import Allocator, DEFAULT_ALLOCATION, batch_rng
+from meta_memory import MetaMemory, MemoryHook, MEMORY_DIR
 
 # ==========================================
 # CONFIGURATION
@@ -25,123 +42,754 @@ MODELS = [
 VARIANTS = ["Control", "Treatment"]
 PERSONAS = ["Junior", "Senior"]
 
+# Task family the sessions run (scenarios.SCENARIOS); part of the plan, like the factors
+SCENARIO = "port_conflict"
+
+# Budgets of read results (os_factory.RESULT_LIMITS); part of the plan, since they change what the agent sees
+RESULTS = dict(RESULT_LIMITS)
+
+# Context management preset (agent_history.HISTORY_POLICIES); part of the plan, like the factors
+HISTORY_POLICY = "full"
+
+# Which model may answer a step when the assigned one is unhealthy (model_health.FAILOVER_POLICIES).
+# Part of the plan, since failover changes who answers; every step logs its failover reason.
+FAILOVER = DEFAULT_FAILOVER
+
+# Meta-memory recall ({"k": fixes per prompt, "path": index}), None = off. Part of the plan,
+# since it changes the first prompt; the run's own steps are indexed only once it has finished.
+MEMORY = None
+
+# Early-stopping rule (sequential_analysis.DEFAULT_CONFIG keys), None = run the whole plan.
+# Fixed in the plan at creation, since the stopping rule is part of the design.
+SEQUENTIAL = None
+
+# Adaptive assignment (adaptive_allocation.DEFAULT_ALLOCATION keys), None = uniform plan.
+# The plan then starts with a uniform burn-in and grows batch by batch up to N_SESSIONS.
+ALLOCATION = None
+
+# Sessions kept in flight per provider when running with --async
+CONCURRENCY = {
+    "google": 8,
+    "openai": 8,
+    "policy": 64
+}
+
+# Sessions kept open at once with --batch (each holds its VM between rounds)
+BATCH_WINDOW = 256
+
 # ==========================================
 # LOGGING SETUP
 # ==========================================
 LOG_DIR = "os_logs"
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
+# parquet: row groups per batch | arrow: IPC stream (tail-able) | csv: the legacy layout
+LOG_FORMAT = "parquet"
 os.makedirs(LOG_DIR, exist_ok=True)
 
-METRICS_FILE = os.path.join(LOG_DIR, f"os_metrics_{TIMESTAMP}.csv")
-TRACE_FILE = os.path.join(LOG_DIR, f"os_trace_{TIMESTAMP}.csv")
+METRICS_FILE, TRACE_FILE = log_paths(LOG_DIR, TIMESTAMP, LOG_FORMAT)
+LOG_WRITER = None
+
+def configure_logging(log_dir=LOG_DIR, timestamp=TIMESTAMP, shard=None, fmt=None):
+    """
+    Points the log writer at another directory/run id/format (benchmarks, resumed runs, shard workers).
+    """
+    global METRICS_FILE, TRACE_FILE, LOG_FORMAT
+    os.makedirs(log_dir, exist_ok=True)
+    LOG_FORMAT = fmt or LOG_FORMAT
+    METRICS_FILE, TRACE_FILE = log_paths(log_dir, timestamp, LOG_FORMAT, shard)
 
 def setup_logging():
-    if not os.path.exists(METRICS_FILE):
-        with open(METRICS_FILE, 'w', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerow([
-                "Session_UUID", "Variant", "Persona", "Model", 
-                "Outcome", "Steps_Taken", "Is_Actually_Fixed", "Total_Latency_ms"
-            ])
-        
-    if not os.path.exists(TRACE_FILE):
-        with open(TRACE_FILE, 'w', newline='', encoding='utf-8') as f:
-            csv.writer(f).writerow([
-                "Session_UUID", "Step_Num", "Reasoning", "SQL_Command", 
-                "Tool_Output", "Latency_ms"
-            ])
-    print(f"📂 Experiment Logs initialized in: {LOG_DIR}/")
-
-def log_metric(row):
-    with open(METRICS_FILE, 'a', newline='', encoding='utf-8') as f:
-        csv.writer(f).writerow(row)
-
-def log_trace_batch(session_id, trace_data):
-    with open(TRACE_FILE, 'a', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        for step in trace_data:
-            output_val = step.get('tool_output', step.get('output', 'N/A'))
-            lat_val = step.get('latency_ms', step.get('latency', 0))
-            
-            writer.writerow([
-                session_id,
-                step['step'],
-                step['reasoning'].replace("\n", " "), 
-                step['sql'],
-                str(output_val).replace("\n", " | "), 
-                lat_val
-            ])
+    global LOG_WRITER
+    LOG_WRITER = ExperimentLogWriter(METRICS_FILE, TRACE_FILE, fmt=LOG_FORMAT)
+    print(f"📂 Experiment Logs initialized in: {os.path.dirname(METRICS_FILE)}/ ({LOG_FORMAT})")
+
+def close_logging():
+    global LOG_WRITER
+    if LOG_WRITER is not None:
+        LOG_WRITER.close()
+        LOG_WRITER = None
+
+def log_session(unit, outcome, steps, is_fixed, latency, trace_data, on_durable=None):
+    """
+    Queues one session's metric and trace rows; `on_durable` runs once both are on disk.
+    """
+    s_id = unit["session_uuid"]
+    totals = session_totals(trace_data, unit["model"])
+    LOG_WRITER.log_session(
+        {
+            "Session_UUID": s_id,
+            "Variant": unit["variant"],
+            "Persona": unit["persona"],
+            "Model": unit["model"],
+            "Outcome": outcome,
+            "Steps_Taken": steps,
+            "Is_Actually_Fixed": bool(is_fixed),
+            "Total_Latency_ms": latency,
+            "Prompt_Tokens": totals["prompt_tokens"],
+            "Completion_Tokens": totals["completion_tokens"],
+            "Cached_Tokens": totals["cached_tokens"],
+            "Request_ms": totals["request_ms"],
+            "Queue_ms": totals["queue_ms"],
+            "Backoff_ms": totals["backoff_ms"],
+            "Retries": totals["retries"],
+            "Fallback_Steps": totals["fallback_steps"],
+            "Circuit_Steps": totals["circuit_steps"],
+            "Propensity": unit.get("propensity"),
+            "Allocation_Batch": unit.get("batch"),
+            # Forks replay their recorded session's recall (counterfactual_replay)
+            "Memory_Recall": RECALLED.pop(s_id, unit.get("memory_recall")),
+        },
+        trace_rows(s_id, trace_data),
+        on_durable,
+    )
 
 # ==========================================
 # RUN LOGIC
 # ==========================================
-def run_experiment():
-    setup_logging()
-    print(f"--- 🔧 STARTING MULTI-PROVIDER EXPERIMENT (N={N_SESSIONS}) ---")
+def open_task(unit):
+    """
+    The unit's task (goal, hint, kernel rules, checker) and its VM, both drawn from the unit's seed.
+    """
+    task = get_scenario(SCENARIO).task(unit["variant"], seed=unit["seed"])
+    return task, acquire_vm(unit["variant"], scenario=SCENARIO, params=task.params)
+
+_MEMORY_INDEXES = {}
+# session_uuid -> recall text of its first prompt, until the session is logged
+RECALLED = {}
+
+def memory_hook(unit):
+    """
+    Recall of past fixes for the unit's first prompt, limited to its scenario and variant
+    (the other arm's fixes would leak its naming into the prompt). None when the run has no memory.
+    """
+    if not MEMORY:
+        return None
+    if MEMORY["path"] not in _MEMORY_INDEXES:
+        _MEMORY_INDEXES[MEMORY["path"]] = MetaMemory(MEMORY["path"])
+    hook = MemoryHook(_MEMORY_INDEXES[MEMORY["path"]], MEMORY["k"], SCENARIO, unit["variant"])
+
+    def recall(goal):
+        RECALLED[unit["session_uuid"]] = text = hook(goal)
+        return text
+    return recall
+
+def remember_run(run_id):
+    with MetaMemory(MEMORY["path"]) as memory:
+        added = memory.ingest_run(METRICS_FILE, TRACE_FILE, run_id, LOG_DIR)
+        print(f"   🧠 Meta-memory: +{added} steps ({memory.rows} in {MEMORY['path']})")
+
+def run_session(unit, cache=None):
+    task, conn = open_task(unit)
     
-    for i in range(1, N_SESSIONS + 1):
-        s_id = str(uuid.uuid4())[:8]
-        variant = random.choice(VARIANTS)
-        persona = random.choice(PERSONAS)
-        model = random.choice(MODELS)
-        
-        print(f"[{i}/{N_SESSIONS}] {persona} ({model}) on {variant} System...", end="", flush=True)
-        
-        conn = setup_virtual_machine(variant)
-        
-        def vm_executor(sql):
-            return execute_os_command(conn, sql, variant)
-        
-        if variant == "Treatment":
-            hint = """
-            Tables: 
-            1. System_Services (service_name, status, port_required)
-            2. Network_Ports (port, protocol, process_name, status)
-            """
-            goal = "Start the 'Apache_Web_Server'. It uses Port 80. If it fails, find what is blocking it."
-        else:
-            hint = """
-            Tables: 
-            1. sys_config (svc_name, state [0=STOP/1=RUN], port)
-            2. net_active (local_port, pid, status)
-            3. proc_list (pid, image)
-            """
-            goal = "Start service 'apache_svc'. It uses Port 80. Ensure state=1."
-
-        # Agent handles the provider logic internally
-        agent = OSAgent(model, persona)
-        
+    def vm_executor(sql):
+        return execute_os_command(conn, sql, task.variant, task.rules, RESULTS)
+
+    # Agent handles the provider logic internally
+    agent = OSAgent(unit["model"], unit["persona"], cache=cache, session_id=unit["session_uuid"],
+                    history_policy=HISTORY_POLICY, memory=memory_hook(unit), failover=FAILOVER)
+    
+    try:
         outcome, steps, latency, trace_log = agent.repair_system(
-            goal, 
-            hint, 
+            task.goal, 
+            task.hint, 
             vm_executor, 
             max_steps=MAX_STEPS
         )
+        is_fixed = task.check(conn)
+    finally:
+        release(conn)
+    return outcome, steps, latency, trace_log, is_fixed
+
+def record_session(unit, result, journal, monitor=None):
+    outcome, steps, latency, trace_log, is_fixed = result
+    # Commit point: the writer journals the unit only after its batch is durable,
+    # so a resume never treats a session with missing rows as done
+    log_session(unit, outcome, steps, is_fixed, latency, trace_log,
+                on_durable=lambda: journal.record(unit, outcome))
+    if monitor is not None:
+        observe_session(monitor, unit, session_values(outcome, steps, is_fixed))
+
+def observe_session(monitor, unit, values):
+    was_stopped = monitor.stopped
+    monitor.observe(unit, values)
+    if monitor.stopped and not was_stopped:
+        decision = monitor.decision
+        icon = "🛑" if decision["halt"] else "⏹️"
+        print(f"\n{icon} Sequential {decision['reason']} after {decision['sessions']} sessions: {decision['detail']}")
+
+def run_experiment(units, journal, cache=None, monitor=None):
+    print(f"--- 🔧 STARTING MULTI-PROVIDER EXPERIMENT (N={len(units)}) ---")
+    
+    for unit in units:
+        if monitor is not None and monitor.stopped:
+            break
+        print(f"[{unit['index']}/{N_SESSIONS}] {unit['persona']} ({unit['model']}) on {unit['variant']} System...", end="", flush=True)
         
-        cursor = conn.cursor()
-        try:
-            if variant == "Treatment":
-                cursor.execute("SELECT status FROM System_Services WHERE service_name='Apache_Web_Server'")
-                row = cursor.fetchone()
-                is_fixed = (row and row[0] == 'RUNNING')
-            else:
-                cursor.execute("SELECT state FROM sys_config WHERE svc_name='apache_svc'")
-                row = cursor.fetchone()
-                is_fixed = (row and row[0] == 1)
-        except Exception as e:
-            is_fixed = False
-            print(f"Validation Error: {e}")
-            
-        conn.close() 
+        result = run_session(unit, cache)
+        outcome, steps, _, _, is_fixed = result
         
         print(f" -> {outcome} | Fixed? {is_fixed} | Steps: {steps}")
         
-        log_metric([s_id, variant, persona, model, outcome, steps, is_fixed, latency])
-        log_trace_batch(s_id, trace_log)
+        record_session(unit, result, journal, monitor)
+
+    print("\n✅ Experiment Complete.")
+
+# ==========================================
+# ASYNC RUN LOGIC
+# ==========================================
+async def run_session_async(unit, semaphores, journal, cache=None, monitor=None):
+    variant = unit["variant"]
+
+    # The semaphore caps how many sessions of this provider are in flight
+    async with semaphores[provider_for_model(unit["model"])]:
+        # Sessions still queued when the monitor stops are never started
+        if monitor is not None and monitor.stopped:
+            return
+        # Every session owns its VM; the connection never leaves this coroutine
+        task, conn = open_task(unit)
+        
+        def vm_executor(sql):
+            return execute_os_command(conn, sql, variant, task.rules, RESULTS)
         
-        # Slightly longer sleep to be kind to both APIs
-        time.sleep(2) 
+        agent = OSAgent(unit["model"], unit["persona"], cache=cache, session_id=unit["session_uuid"],
+                    history_policy=HISTORY_POLICY, memory=memory_hook(unit), failover=FAILOVER)
+        
+        try:
+            outcome, steps, latency, trace_log = await agent.repair_system_async(
+                task.goal, 
+                task.hint, 
+                vm_executor, 
+                max_steps=MAX_STEPS
+            )
+            is_fixed = task.check(conn)
+        except Exception:
+            # A crashed session is missing data: the monitor must not wait for it
+            if monitor is not None:
+                observe_session(monitor, unit, None)
+            raise
+        finally:
+            release(conn)
+
+    record_session(unit, (outcome, steps, latency, trace_log, is_fixed), journal, monitor)
+    print(f"[{unit['index']}/{N_SESSIONS}] {unit['persona']} ({unit['model']}) on {variant} System -> {outcome} | Fixed? {is_fixed} | Steps: {steps}")
+
+async def _run_experiment_async(units, concurrency, journal, cache=None, monitor=None):
+    semaphores = {provider: asyncio.Semaphore(limit) for provider, limit in concurrency.items()}
+    
+    # Assignments come from the plan, so randomization does not depend on completion order
+    tasks = [
+        asyncio.create_task(run_session_async(unit, semaphores, journal, cache, monitor))
+        for unit in units
+    ]
+    
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for unit, result in zip(units, results):
+        if isinstance(result, Exception):
+            print(f"   ❌ Session {unit['session_uuid']} crashed: {result}")
+
+def run_experiment_async(units, journal, concurrency=None, cache=None, monitor=None):
+    concurrency = {**CONCURRENCY, **(concurrency or {})}
+    print(f"--- 🔧 STARTING MULTI-PROVIDER EXPERIMENT (N={len(units)}, async, concurrency={concurrency}) ---")
+    
+    asyncio.run(_run_experiment_async(units, concurrency, journal, cache, monitor))
+
+    for stats in scheduler_stats():
+        print(f"   🚦 {stats['model']}: final concurrency {stats['limit']}, throttled {stats['throttled']}x")
+    print("\n✅ Experiment Complete.")
+
+# ==========================================
+# LOCKSTEP BATCH RUN LOGIC
+# ==========================================
+class LockstepSession:
+    """
+    A session driven by the batch runner: its VM, its agent (stepping API) and the request
+    waiting for the next batch round.
+    """
+    def __init__(self, unit, cache=None):
+        self.unit = unit
+        task, conn = self.task, self.conn = open_task(unit)
+        self.execute = lambda sql: execute_os_command(conn, sql, task.variant, task.rules, RESULTS)
+        self.agent = OSAgent(unit["model"], unit["persona"], cache=cache, session_id=unit["session_uuid"],
+                             history_policy=HISTORY_POLICY, memory=memory_hook(unit), failover=FAILOVER)
+        self.agent.start(task.goal, task.hint, MAX_STEPS)
+        self.pending = None
+
+    def advance(self):
+        """
+        Moves on to the next step that needs the model (cache hits are applied on the spot).
+        Returns False once the session is over.
+        """
+        while self.pending is None:
+            history = self.agent.next_request()
+            if history is None:
+                return False
+            key, call, action = self.agent.lookup(history)
+            if action is not None:
+                self.agent.apply_response(action, call, self.execute)
+                continue
+            route = self.agent.route()
+            self.pending = {"key": key, "call": call, "history": history, "route": route, "attempt": 0,
+                            "model": self.next_model(route)}
+        return True
+
+    def next_model(self, route):
+        # A round cannot wait for a probe slot; with every candidate open the assigned model goes
+        return route.next_model()[0] or self.unit["model"]
+
+    @property
+    def custom_id(self):
+        return f"{self.unit['session_uuid']}-{self.agent.steps}-{self.pending['attempt']}"
+
+    def resolve(self, parsed, usage, error, start, retries=3):
+        """
+        Applies one batch answer. A failed request is resubmitted in the next round (same retry
+        classes, breakers and failover policy as the interactive path), until `retries` attempts
+        have failed. Batch turnaround is not request latency, so it stays out of the p95 window.
+        """
+        pending, call, route = self.pending, self.pending["call"], self.pending["route"]
+        if error is None:
+            route.succeeded(pending["model"])
+            call.request_done(start, pending["model"], usage)
+            call.routed(route)
+            self.agent.store(pending["key"], parsed, pending["model"], usage)
+            self.pending = None
+            self.agent.apply_response(parsed, call, self.execute)
+            return
+        kind = classify_error(error)
+        call.request_done(start, pending["model"], status=THROTTLE_STATUS.get(kind), error=type(error).__name__)
+        route.failed(pending["model"], kind)
+        pending["attempt"] += 1
+        if pending["attempt"] >= retries or not RETRY_CLASSES[kind]["retry"]:
+            call.routed(route)
+            self.pending = None
+            self.agent.apply_response(None, call, self.execute)
+        else:
+            pending["model"] = self.next_model(route)
+
+    def finish(self):
+        try:
+            is_fixed = self.task.check(self.conn)
+        finally:
+            release(self.conn)
+        outcome, steps, latency, trace_log = self.agent.result()
+        return outcome, steps, latency, trace_log, is_fixed
+
+def _submit_round(sessions, mode):
+    """
+    One batch job per model (a batch file targets a single model). Returns {job_id: (backend, model, {custom_id: session})}.
+    """
+    by_model = defaultdict(list)
+    for session in sessions:
+        by_model[session.pending["model"]].append(session)
+    jobs = {}
+    for model, group in by_model.items():
+        backend = get_batch_backend(provider_for_model(model), mode, root=os.path.join(LOG_DIR, "batches"))
+        owners = {session.custom_id: session for session in group}
+        job_id = backend.submit(model, [(cid, s.pending["history"]) for cid, s in owners.items()], OSAction, TEMPERATURE)
+        jobs[job_id] = (backend, model, owners)
+    return jobs
+
+def _collect_round(jobs, start, poll_seconds):
+    states = {}
+    while len(states) < len(jobs):
+        for job_id, (backend, _, _) in jobs.items():
+            if job_id not in states:
+                state = backend.poll(job_id)
+                if state != "pending":
+                    states[job_id] = state
+        if len(states) < len(jobs):
+            time.sleep(poll_seconds)
+
+    for job_id, (backend, model, owners) in jobs.items():
+        try:
+            answers = backend.results(job_id)
+        except Exception as e:
+            print(f"   ⚠️ Batch {job_id} ({model}) returned no results: {e}")
+            answers = {}
+        emit_span("llm.batch", start, provider=provider_for_model(model), model=model, job=job_id,
+                  state=states[job_id], requests=len(owners), answered=len(answers))
+        for custom_id, session in owners.items():
+            parsed, usage, error = answers.get(custom_id) or (None, None, BatchError(f"No result in batch {job_id} ({states[job_id]})"))
+            session.resolve(parsed, usage, error, start)
+
+def run_experiment_batch(units, journal, cache=None, mode="local", window=BATCH_WINDOW, poll_seconds=BATCH_POLL_SECONDS,
+                         monitor=None):
+    """
+    Lockstep mode: the next request of every open session is submitted as one batch job per
+    model, the runner waits for the jobs, applies every answer to its session's VM, and
+    submits the next round. Sessions that finish free their slot for queued units.
+    """
+    print(f"--- 🔧 STARTING MULTI-PROVIDER EXPERIMENT (N={len(units)}, lockstep batches via {mode} endpoint, window={window}) ---")
+    queue = list(reversed(units))
+    active = []
+    rounds = 0
+    while queue or active:
+        # Queued units join at their first step (not after a stop decision)
+        while queue and len(active) < window and not (monitor is not None and monitor.stopped):
+            active.append(LockstepSession(queue.pop(), cache))
+
+        still_open = []
+        for session in active:
+            if session.advance():
+                still_open.append(session)
+                continue
+            result = session.finish()
+            record_session(session.unit, result, journal, monitor)
+            unit, (outcome, steps, _, _, is_fixed) = session.unit, result
+            print(f"[{unit['index']}/{N_SESSIONS}] {unit['persona']} ({unit['model']}) on {unit['variant']} System -> {outcome} | Fixed? {is_fixed} | Steps: {steps}")
+        active = still_open
+        if not active:
+            if monitor is not None and monitor.stopped:
+                break
+            continue
+
+        start = time.perf_counter()
+        jobs = _submit_round(active, mode)
+        _collect_round(jobs, start, poll_seconds)
+        rounds += 1
+        print(f"   📦 Round {rounds}: {len(active)} requests in {len(jobs)} batch jobs ({time.perf_counter() - start:.1f}s), {len(queue)} units queued")
 
     print("\n✅ Experiment Complete.")
 
+# ==========================================
+# CHECKPOINT / RESUME / SHARDS
+# ==========================================
+def apply_plan(plan):
+    """
+    Restores the run settings from the plan (authoritative for resumes, shards and the merge);
+    plans written before a setting existed get its legacy default.
+    """
+    global N_SESSIONS, MAX_STEPS, HISTORY_POLICY, SCENARIO, RESULTS, MEMORY, FAILOVER
+    N_SESSIONS = plan.get("budget", len(plan["units"]))
+    MAX_STEPS = plan["max_steps"]
+    HISTORY_POLICY = plan.get("history_policy", "full")
+    SCENARIO = plan.get("scenario", "port_conflict")
+    RESULTS = plan.get("result_limits", LEGACY_RESULT_LIMITS)
+    MEMORY = plan.get("memory")
+    FAILOVER = plan.get("failover", DEFAULT_FAILOVER)
+
+def prepare_plan(run_id, seed=None, resume=False):
+    path = plan_path(LOG_DIR, run_id)
+    if resume:
+        plan = load_plan(path)
+    else:
+        if ALLOCATION:
+            Allocator({"variants": VARIANTS, "personas": PERSONAS, "models": MODELS}, ALLOCATION)  # rejects a bad estimand early
+            plan = build_adaptive_plan(run_id, N_SESSIONS, VARIANTS, PERSONAS, MODELS, MAX_STEPS, ALLOCATION, seed=seed)
+        else:
+            plan = build_plan(run_id, N_SESSIONS, VARIANTS, PERSONAS, MODELS, MAX_STEPS, seed=seed)
+        # Resumes, shards and the merge must all write the run's files in one format
+        plan["log_format"] = LOG_FORMAT
+        plan["history_policy"] = HISTORY_POLICY
+        plan["sequential"] = SEQUENTIAL
+        plan["scenario"] = SCENARIO
+        plan["result_limits"] = RESULTS
+        plan["memory"] = MEMORY
+        plan["failover"] = FAILOVER
+        write_plan(path, plan)
+        print(f"🗺️  Session plan written: {path}")
+    apply_plan(plan)
+    return plan
+
+# ==========================================
+# SEQUENTIAL MONITORING
+# ==========================================
+def sequential_path(run_id):
+    return os.path.join(LOG_DIR, f"os_sequential_{run_id}.json")
+
+def logged_results():
+    """
+    session_uuid -> (outcome, steps, is_fixed) of every session in this run's metrics log.
+    """
+    if not os.path.exists(METRICS_FILE):
+        return {}
+    logged = read_log(METRICS_FILE, columns=["Session_UUID", "Outcome", "Steps_Taken", "Is_Actually_Fixed"])
+    return {s_id: (outcome, steps, str(fixed) == "True") for s_id, outcome, steps, fixed in logged.itertuples(index=False)}
+
+def build_monitor(plan, done):
+    """
+    Monitor for the plan's stopping rule, caught up with the sessions already logged (resume).
+    """
+    monitor = SequentialMonitor(plan["units"], variants=tuple(VARIANTS), **plan["sequential"])
+    if done:
+        rows = logged_results()
+        for unit in plan["units"]:
+            if unit["session_uuid"] in rows:
+                monitor.observe(unit, session_values(*rows[unit["session_uuid"]]))
+    if monitor.stopped:
+        print(f"⏹️ Stopping rule already met: {monitor.decision['reason']} ({monitor.decision['detail']})")
+    return monitor
+
+# ==========================================
+# ADAPTIVE ALLOCATION
+# ==========================================
+def allocate_next_batch(plan):
+    """
+    Updates the cell posteriors with everything logged so far and appends the next batch to
+    the plan (written before any of it runs). Returns the new units, or [] once the budget is
+    spent or the allocation target is reached.
+    """
+    LOG_WRITER.flush()
+    allocator = Allocator(plan["factors"], plan["allocation"])
+    posteriors = allocator.posteriors(plan["units"], logged_results())
+    batch = max(u.get("batch", 0) for u in plan["units"]) + 1
+    rng = batch_rng(plan["seed"], batch)
+
+    status = allocator.status(posteriors, rng)
+    plan.setdefault("allocation_status", []).append({"after_batch": batch - 1, **status})
+    print(f"   🎯 Allocation after batch {batch - 1}: {status}")
+    remaining = plan["budget"] - len(plan["units"])
+    units = []
+    if not status["done"] and remaining > 0:
+        units = append_batch(plan, allocator.next_batch(posteriors, min(allocator.config["batch_size"], remaining), rng), rng)
+    write_plan(plan_path(LOG_DIR, plan["run_id"]), plan)
+    return units
+
+def run_units(plan, shard=None, n_shards=1, use_async=False, concurrency=None, cache_mode="off", cache_path=DEFAULT_CACHE_PATH,
+              spans=False, batch=None, batch_window=BATCH_WINDOW, batch_poll=BATCH_POLL_SECONDS):
+    """
+    Runs every not-yet-journaled unit of `plan` (or of one shard of it).
+    With `spans`, agent telemetry spans are exported to os_spans_<run_id>[_shardJ].jsonl.
+    With `batch` ("local" or "provider"), sessions advance in lockstep through batch jobs.
+    """
+    run_id = plan["run_id"]
+    apply_plan(plan)
+    configure_logging(LOG_DIR, run_id, shard, plan.get("log_format", "csv"))
+
+    units = plan["units"] if shard is None else shard_units(plan["units"], shard, n_shards)
+    journal = SessionJournal(journal_path(LOG_DIR, run_id, shard))
+    # A shard also honours the main journal (units finished before the run was sharded)
+    done = journal.completed | (read_journal(journal_path(LOG_DIR, run_id)) if shard is not None else set())
+
+    # Drop rows of sessions that were written but never journaled (crash between the two)
+    for path in (METRICS_FILE, TRACE_FILE):
+        if os.path.exists(path):
+            filter_log([path], path, journal.completed)
+    setup_logging()
+
+    pending = [u for u in units if u["session_uuid"] not in done]
+    label = f"shard {shard}/{n_shards}" if shard is not None else "run"
+    print(f"▶️  {label} {run_id}: {len(units) - len(pending)} done, {len(pending)} pending")
+
+    monitor = None
+    if plan.get("sequential"):
+        if shard is None:
+            monitor = build_monitor(plan, done)
+        else:
+            # A shard only sees part of the data; peeking per shard would not be valid
+            print("   ℹ️ Sequential stopping is evaluated on unsharded runs only.")
+
+    cache = ResponseCache(cache_path, cache_mode) if cache_mode != "off" else None
+    exporter = None
+    if spans:
+        suffix = f"_shard{shard}" if shard is not None else ""
+        exporter = add_span_hook(JsonlSpanExporter(os.path.join(LOG_DIR, f"os_spans_{run_id}{suffix}.jsonl")))
+    try:
+        if not pending and plan.get("allocation"):
+            # Resumed between two batches
+            pending = allocate_next_batch(plan)
+        while pending:
+            if batch:
+                run_experiment_batch(pending, journal, cache, batch, batch_window, batch_poll, monitor)
+            elif use_async:
+                run_experiment_async(pending, journal, concurrency, cache, monitor)
+            else:
+                run_experiment(pending, journal, cache, monitor)
+            # Adaptive plans grow one batch at a time; a uniform plan is done here
+            pending = allocate_next_batch(plan) if plan.get("allocation") else []
+    finally:
+        # Drains the writer, which journals the last batch, before the journal closes
+        close_logging()
+        journal.close()
+        if exporter is not None:
+            remove_span_hook(exporter)
+            exporter.close()
+        if cache is not None:
+            print(f"   💾 LLM cache: {cache.stats()}")
+            cache.close()
+        for health in health_stats():
+            if health["trips"]:
+                print(f"   🔌 {health['model']}: circuit opened {health['trips']}x, {health['refused']} requests refused, "
+                      f"now {health['state']} (error rate {health['error_rate']:.0%}, p95 {health['p95_ms']:.0f} ms)")
+        if monitor is not None:
+            monitor.write_report(sequential_path(run_id))
+            print(f"   📈 Sequential: {monitor.summary()}")
+            if monitor.stopped:
+                print(f"   Stopped early ({monitor.decision['reason']}); remaining units stay pending in the plan.")
+    # Shards are indexed once merged
+    if MEMORY and shard is None:
+        remember_run(run_id)
+
+def merge_shards(run_id, n_shards):
+    """
+    Folds shard journals and logs into the run's main files (plan order), then removes them.
+    """
+    plan = load_plan(plan_path(LOG_DIR, run_id))
+    apply_plan(plan)
+    configure_logging(LOG_DIR, run_id, fmt=plan.get("log_format", "csv"))
+    main_journal = journal_path(LOG_DIR, run_id)
+    shard_journals = [journal_path(LOG_DIR, run_id, j) for j in range(n_shards)]
+
+    completed = read_journal(main_journal)
+    for path in shard_journals:
+        completed |= read_journal(path)
+
+    shard_logs = [log_paths(LOG_DIR, run_id, plan.get("log_format", "csv"), j) for j in range(n_shards)]
+    # Safe to re-run after a crash anywhere below: a session's rows are taken from the first
+    # source that has it, so shard rows already folded into the main log are not added again
+    filter_log([METRICS_FILE] + [m for m, _ in shard_logs], METRICS_FILE, completed)
+    filter_log([TRACE_FILE] + [t for _, t in shard_logs], TRACE_FILE, completed)
+
+    # Journal last: if we crash before this, the shard journals still describe the shard rows
+    with open(main_journal, "a", encoding="utf-8") as out:
+        for path in shard_journals:
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    out.write(f.read())
+        out.flush()
+        os.fsync(out.fileno())
+    for path in shard_journals + [p for pair in shard_logs for p in pair]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+    print(f"🧩 Merged {n_shards} shards into {METRICS_FILE} ({len(completed)} sessions)")
+    if MEMORY:
+        remember_run(run_id)
+
+def run_sharded(plan, n_shards, **options):
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=run_units, args=(plan, j, n_shards), kwargs=options, name=f"shard-{j}")
+        for j in range(n_shards)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    failed = [w.name for w in workers if w.exitcode != 0]
+    if failed:
+        print(f"⚠️ Workers failed: {failed}. Re-run with --resume {plan['run_id']} --shards {n_shards} to finish.")
+    merge_shards(plan["run_id"], n_shards)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the OS repair experiment.")
+    parser.add_argument("--sessions", type=int, default=N_SESSIONS)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Run sessions concurrently with the async provider clients.")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Sessions in flight per provider (overrides CONCURRENCY).")
+    parser.add_argument("--models", nargs="+", default=None,
+                        help="Override MODELS, e.g. 'policy-scripted policy-random' for an offline run.")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed the factor assignments and VMs (required for a meaningful replay).")
+    parser.add_argument("--cache-mode", choices=CACHE_MODES, default="off",
+                        help="LLM response cache: record, replay (fail on miss) or read_through.")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--resume", metavar="RUN_ID", default=None,
+                        help="Continue an existing run (its plan and journal in os_logs/).")
+    parser.add_argument("--plan-only", action="store_true",
+                        help="Write the session plan and exit.")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the plan across K worker processes and merge at the end.")
+    parser.add_argument("--shard-index", type=int, default=None,
+                        help="Run only this shard (e.g. on another machine); requires --resume.")
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default=LOG_FORMAT,
+                        help="Format of new runs' logs (a resumed run keeps the format in its plan).")
+    parser.add_argument("--scenario", choices=list(SCENARIOS), default=SCENARIO,
+                        help="Task family of a new run (a resumed run keeps the scenario in its plan).")
+    parser.add_argument("--result-format", choices=RESULT_FORMATS, default=RESULTS["format"],
+                        help="Read results as compact text within row/byte budgets, or the legacy unbounded list of rows.")
+    parser.add_argument("--max-rows", type=int, default=RESULTS["max_rows"],
+                        help="Rows of a read result shown to the agent (table format).")
+    parser.add_argument("--history", choices=list(HISTORY_POLICIES), default=HISTORY_POLICY,
+                        help="Agent context management: full history, truncated tool output, sliding window or summary.")
+    parser.add_argument("--failover", choices=FAILOVER_POLICIES, default=FAILOVER,
+                        help="Where a step goes while its model's circuit breaker is open: nowhere else, the provider's fallback model, or a cross-provider chain.")
+    parser.add_argument("--memory", type=int, metavar="K", default=None,
+                        help="Add the K most relevant distinct past fixes (meta_memory index) to each first prompt.")
+    parser.add_argument("--memory-path", default=MEMORY_DIR, help="Meta-memory index used with --memory.")
+    parser.add_argument("--spans", action="store_true",
+                        help="Export per-request/step telemetry spans to os_logs/os_spans_<run_id>.jsonl.")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Monitor always-valid tests after every session and stop early (fixed in the plan).")
+    parser.add_argument("--alpha", type=float, default=SEQUENTIAL_DEFAULTS["alpha"],
+                        help="Significance level of the sequential primary test.")
+    parser.add_argument("--allocate", metavar="ESTIMAND", default=None,
+                        help="Adaptive assignment: best_arm (Thompson sampling), effect or interaction:<model>.")
+    parser.add_argument("--allocation-metric", choices=["success", "steps", "hallucination"],
+                        default=DEFAULT_ALLOCATION["metric"])
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_ALLOCATION["batch_size"],
+                        help="Sessions assigned per allocation batch.")
+    parser.add_argument("--target-se", type=float, default=None,
+                        help="Stop allocating once the contrast's standard error is below this.")
+    parser.add_argument("--batch", choices=["local", "provider"], default=None,
+                        help="Lockstep mode through batch endpoints: the provider's Batch API, or a local file-based stand-in.")
+    parser.add_argument("--batch-window", type=int, default=BATCH_WINDOW,
+                        help="Sessions kept open at once in --batch mode.")
+    parser.add_argument("--batch-poll", type=float, default=BATCH_POLL_SECONDS,
+                        help="Seconds between batch job status polls.")
+    parser.add_argument("--merge", action="store_true",
+                        help="Only merge shard outputs of --resume RUN_ID.")
+    args = parser.parse_args()
+    # Shards of one run must share its plan: a fresh plan per machine could never be merged
+    if args.shard_index is not None:
+        if args.resume is None:
+            parser.error("--shard-index requires --resume RUN_ID (write the plan first with --plan-only).")
+        if not 0 <= args.shard_index < args.shards:
+            parser.error(f"--shard-index must be in [0, {args.shards}) for --shards {args.shards}.")
+    if args.merge and args.resume is None:
+        parser.error("--merge requires --resume RUN_ID.")
+    return args
+
 if __name__ == "__main__":
-    run_experiment()
\ No newline at end of file
+    args = parse_args()
+    if args.models:
+        MODELS = args.models
+    N_SESSIONS = args.sessions
+    LOG_FORMAT = args.log_format
+    HISTORY_POLICY = args.history
+    SCENARIO = args.scenario
+    RESULTS = {**RESULTS, "format": args.result_format, "max_rows": args.max_rows}
+    FAILOVER = args.failover
+    if args.memory:
+        MEMORY = {"k": args.memory, "path": args.memory_path}
+    if args.sequential:
+        SEQUENTIAL = {**SEQUENTIAL_DEFAULTS, "alpha": args.alpha}
+    if args.allocate:
+        ALLOCATION = {**DEFAULT_ALLOCATION, "estimand": args.allocate, "metric": args.allocation_metric,
+                      "batch_size": args.batch_size, "target_se": args.target_se}
+    run_id = args.resume or TIMESTAMP
+
+    if args.merge:
+        merge_shards(run_id, args.shards)
+        raise SystemExit
+
+    def check_allocation(adaptive, sequential):
+        # Allocation needs the whole run's results in one place; the always-valid tests assume a fixed split
+        if adaptive and (sequential or args.shards > 1 or args.shard_index is not None):
+            raise SystemExit("❌ Adaptive allocation runs unsharded and without --sequential.")
+
+    check_allocation(ALLOCATION, SEQUENTIAL)
+    plan = prepare_plan(run_id, seed=args.seed, resume=args.resume is not None)
+    check_allocation(plan.get("allocation"), plan.get("sequential"))
+    if args.plan_only:
+        print(f"Run id: {run_id}")
+        raise SystemExit
+
+    options = dict(
+        use_async=args.use_async,
+        concurrency={p: args.concurrency for p in CONCURRENCY} if args.concurrency else None,
+        cache_mode=args.cache_mode,
+        cache_path=args.cache_path,
+        spans=args.spans,
+        batch=args.batch,
+        batch_window=args.batch_window,
+        batch_poll=args.batch_poll,
+    )
+    if args.shard_index is not None:
+        run_units(plan, args.shard_index, args.shards, **options)
+    elif args.shards > 1:
+        run_sharded(plan, args.shards, **options)
+    else:
+        run_units(plan, **options)
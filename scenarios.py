@@ -0,0 +1,506 @@
+import re
+import random
+from os_kernel import KernelRule, KernelRuleSet, KILL_RESPONSE
+
+ROGUE_NAMES = ['skype.exe', 'game.exe', 'backup.exe']
+
+# ==========================================
+# SCENARIO INTERFACE
+# ==========================================
+# A scenario declares everything a session needs, per variant:
+#   build(conn, variant)          - the static template (built once per process, then cloned)
+#   draw(rng)                     - the per-session parameters, from the session's seed
+#   apply(conn, variant, params)  - patches those parameters into a fresh clone
+#   describe(variant, params)     - (goal, schema hint) given to the agent
+#   rules(variant, params)        - the KernelRuleSet enforcing the scenario's logic
+#   check(conn, variant, params)  - ground truth: is the system actually fixed?
+#   script(variant, context)      - (steps, explore) for the offline policy provider
+class Task:
+    """
+    One session's instance of a scenario: its parameters, prompt and kernel rules.
+    """
+    def __init__(self, scenario, variant, params):
+        self.scenario = scenario
+        self.variant = variant
+        self.params = params
+        self.goal, self.hint = scenario.describe(variant, params)
+        self.rules = scenario.rules(variant, params)
+
+    def check(self, conn):
+        try:
+            return bool(self.scenario.check(conn, self.variant, self.params))
+        except Exception as e:
+            print(f"Validation Error: {e}")
+            return False
+
+class Scenario:
+    name = None
+    # variant -> text that only appears in that variant's prompt (policy provider lookup)
+    MARKERS = {}
+
+    def task(self, variant, seed=None):
+        # Same seed -> same parameters, so the VM and the prompt can be rebuilt for replay
+        rng = random.Random(seed) if seed is not None else random
+        return Task(self, variant, self.draw(rng))
+
+    def policy_script(self, context):
+        variant = next((v for v, marker in self.MARKERS.items() if marker in context), None)
+        return self.script(variant, context) if variant else None
+
+# ==========================================
+# SCENARIO: PORT CONFLICT (the POC)
+# ==========================================
+class PortConflict(Scenario):
+    """
+    Apache cannot start because a rogue process holds port 80. Two or three tiny tables.
+    """
+    name = "port_conflict"
+    MARKERS = {"Treatment": "'Apache_Web_Server'", "Control": "'apache_svc'"}
+
+    # Placeholders baked into the template; every clone overwrites them with its own values
+    TEMPLATE_PID = 0
+    TEMPLATE_NAME = '__rogue__'
+
+    RULEBOOKS = {
+        # SCENARIO B: TREATMENT (Friendly / Denormalized)
+        "Treatment": KernelRuleSet([
+            KernelRule(
+                "start_apache_port_busy", "UPDATE", "System_Services",
+                sets={"status": "RUNNING"},
+                targets=("service_name", "Apache_Web_Server"),
+                blocked_if="SELECT count(*) FROM Network_Ports WHERE port=80",
+                error="ERROR 0x800: Port 80 is already in use by another process. Bind failed.",
+            ),
+            KernelRule("kill_process", "DELETE", "Network_Ports", response=KILL_RESPONSE),
+        ]),
+        # SCENARIO A: CONTROL (Technical / Normalized)
+        "Control": KernelRuleSet([
+            KernelRule(
+                "start_apache_port_busy", "UPDATE", "sys_config",
+                sets={"state": 1},
+                targets=("svc_name", "apache_svc"),
+                blocked_if="SELECT count(*) FROM net_active WHERE local_port=80",
+                error="ERR_SERVICE_START_FAIL: Port 80 is currently in use by another process.",
+            ),
+            KernelRule("kill_process", "DELETE", "*", response=KILL_RESPONSE),
+        ]),
+    }
+
+    # Scripted solutions; each step is (reasoning, sql, is_fixed)
+    SCRIPTS = {
+        "Treatment": [
+            ("Check the service table first.", "SELECT * FROM System_Services", False),
+            ("Try to start Apache.", "UPDATE System_Services SET status='RUNNING' WHERE service_name='Apache_Web_Server'", False),
+            ("Something holds port 80. Look at the network table.", "SELECT * FROM Network_Ports WHERE port=80", False),
+            ("Kill the process on port 80.", "DELETE FROM Network_Ports WHERE port=80", False),
+            ("Port is free, start Apache again.", "UPDATE System_Services SET status='RUNNING' WHERE service_name='Apache_Web_Server'", False),
+            ("Verify the service status.", "SELECT status FROM System_Services WHERE service_name='Apache_Web_Server'", False),
+            ("Apache is RUNNING.", "SELECT 1", True),
+        ],
+        "Control": [
+            ("Check the service config first.", "SELECT * FROM sys_config", False),
+            ("Try to start apache_svc.", "UPDATE sys_config SET state=1 WHERE svc_name='apache_svc'", False),
+            ("Find the PID listening on port 80.", "SELECT * FROM net_active WHERE local_port=80", False),
+            ("Resolve the PID to an image name.", "SELECT * FROM proc_list", False),
+            ("Kill the listener on port 80.", "DELETE FROM net_active WHERE local_port=80", False),
+            ("Port is free, start apache_svc again.", "UPDATE sys_config SET state=1 WHERE svc_name='apache_svc'", False),
+            ("Verify the service state.", "SELECT state FROM sys_config WHERE svc_name='apache_svc'", False),
+            ("apache_svc is running.", "SELECT 1", True),
+        ],
+    }
+
+    def build(self, conn, variant):
+        cursor = conn.cursor()
+
+        # ----------------------------------------------------
+        # SCENARIO B: TREATMENT (Friendly / Denormalized)
+        # ----------------------------------------------------
+        if variant == "Treatment":
+            # Table 1: Services (The Goal)
+            cursor.execute("CREATE TABLE System_Services (service_name TEXT, status TEXT, port_required INTEGER)")
+            cursor.execute("INSERT INTO System_Services VALUES ('Apache_Web_Server', 'STOPPED', 80)")
+            cursor.execute("INSERT INTO System_Services VALUES ('SQL_Database', 'RUNNING', 3306)")
+
+            # Table 2: Network (The Telemetry) - HAS NAMES
+            cursor.execute("CREATE TABLE Network_Ports (port INTEGER, protocol TEXT, process_name TEXT, status TEXT)")
+            cursor.execute("INSERT INTO Network_Ports VALUES (80, 'TCP', ?, 'LISTENING')", (self.TEMPLATE_NAME,))
+            cursor.execute("INSERT INTO Network_Ports VALUES (3306, 'TCP', 'mysqld.exe', 'LISTENING')")
+
+        # ----------------------------------------------------
+        # SCENARIO A: CONTROL (Technical / Normalized)
+        # ----------------------------------------------------
+        else:
+            # Table 1: Services (The Goal)
+            cursor.execute("CREATE TABLE sys_config (svc_name TEXT, state INT, port INT)")
+            cursor.execute("INSERT INTO sys_config VALUES ('apache_svc', 0, 80)") # 0=Stop
+
+            # Table 2: Netstat (The Conflict - PIDs only)
+            cursor.execute("CREATE TABLE net_active (local_port INT, pid INT, status TEXT)")
+            cursor.execute("INSERT INTO net_active VALUES (80, ?, 'LISTEN')", (self.TEMPLATE_PID,))
+
+            # Table 3: Process Table (The Name resolution)
+            cursor.execute("CREATE TABLE proc_list (pid INT, image TEXT)")
+            cursor.execute("INSERT INTO proc_list VALUES (?, ?)", (self.TEMPLATE_PID, self.TEMPLATE_NAME))
+
+    def draw(self, rng):
+        return {"rogue_pid": rng.randint(1000, 9999), "rogue_name": rng.choice(ROGUE_NAMES)}
+
+    def apply(self, conn, variant, params):
+        cursor = conn.cursor()
+        if variant == "Treatment":
+            cursor.execute("UPDATE Network_Ports SET process_name=? WHERE process_name=?",
+                           (params["rogue_name"], self.TEMPLATE_NAME))
+        else:
+            cursor.execute("UPDATE net_active SET pid=? WHERE pid=?", (params["rogue_pid"], self.TEMPLATE_PID))
+            cursor.execute("UPDATE proc_list SET pid=?, image=? WHERE pid=?",
+                           (params["rogue_pid"], params["rogue_name"], self.TEMPLATE_PID))
+
+    def describe(self, variant, params):
+        if variant == "Treatment":
+            hint = """
+        Tables: 
+        1. System_Services (service_name, status, port_required)
+        2. Network_Ports (port, protocol, process_name, status)
+        """
+            goal = "Start the 'Apache_Web_Server'. It uses Port 80. If it fails, find what is blocking it."
+        else:
+            hint = """
+        Tables: 
+        1. sys_config (svc_name, state [0=STOP/1=RUN], port)
+        2. net_active (local_port, pid, status)
+        3. proc_list (pid, image)
+        """
+            goal = "Start service 'apache_svc'. It uses Port 80. Ensure state=1."
+        return goal, hint
+
+    def rules(self, variant, params):
+        return self.RULEBOOKS[variant]
+
+    def check(self, conn, variant, params):
+        cursor = conn.cursor()
+        if variant == "Treatment":
+            cursor.execute("SELECT status FROM System_Services WHERE service_name='Apache_Web_Server'")
+            row = cursor.fetchone()
+            return row and row[0] == 'RUNNING'
+        cursor.execute("SELECT state FROM sys_config WHERE svc_name='apache_svc'")
+        row = cursor.fetchone()
+        return row and row[0] == 1
+
+    def script(self, variant, context):
+        steps = self.SCRIPTS[variant]
+        return steps, [sql for _, sql, _ in steps if sql.startswith("SELECT")]
+
+# ==========================================
+# SCENARIO: DATACENTER (procedurally generated)
+# ==========================================
+TEAMS = ["billing", "auth", "search", "catalog", "payments", "inventory", "notify", "analytics",
+         "gateway", "ledger", "media", "profile"]
+# Service role -> the image its process runs
+ROLES = {"api": "java.exe", "worker": "python.exe", "db": "postgres.exe", "cache": "redis-server.exe",
+         "queue": "rabbitmq.exe", "scheduler": "cron.exe", "proxy": "nginx.exe"}
+BACKGROUND_IMAGES = ["svchost.exe", "sshd.exe", "node.exe", "python.exe", "java.exe", "conhost.exe",
+                     "dllhost.exe", "telegraf.exe", "fluentd.exe", "consul.exe"]
+USERS = ["root", "svc", "www-data", "postgres", "admin"]
+
+class Datacenter(Scenario):
+    """
+    A generated datacenter: thousands of services with dependency edges, processes and
+    listening ports, indexed like a real inventory. Each session stops one dependency of a
+    target service and puts a rogue listener on the target's port, so starting the target
+    fails for two different reasons in turn, and an unfiltered SELECT * returns thousands of rows.
+    """
+    name = "datacenter"
+    MARKERS = {"Treatment": "Service_Dependencies", "Control": "svc_deps"}
+    # The template is the same in every process (and every run); only the session draw varies
+    TEMPLATE_SEED = 2024
+    FIRST_PID = 10000
+
+    SCHEMA = {
+        "Treatment": [
+            "CREATE TABLE System_Services (service_name TEXT, status TEXT, port_required INTEGER, owner_team TEXT)",
+            "CREATE TABLE Service_Dependencies (service_name TEXT, depends_on TEXT)",
+            "CREATE TABLE Network_Ports (port INTEGER, protocol TEXT, process_name TEXT, pid INTEGER, status TEXT)",
+            "CREATE TABLE Processes (pid INTEGER PRIMARY KEY, process_name TEXT, user TEXT, cpu_pct REAL, mem_mb INTEGER)",
+        ],
+        "Control": [
+            "CREATE TABLE sys_config (svc_id INTEGER PRIMARY KEY, svc_name TEXT, state INT, port INT)",
+            "CREATE TABLE svc_deps (svc_id INT, dep_id INT)",
+            "CREATE TABLE net_active (local_port INT, pid INT, status TEXT)",
+            "CREATE TABLE proc_list (pid INTEGER PRIMARY KEY, image TEXT, uid INT)",
+        ],
+    }
+    # Created after the bulk insert (cheaper than maintaining them row by row)
+    INDEXES = {
+        "Treatment": [
+            "CREATE INDEX idx_services_name ON System_Services (service_name)",
+            "CREATE INDEX idx_services_port ON System_Services (port_required)",
+            "CREATE INDEX idx_deps_service ON Service_Dependencies (service_name)",
+            "CREATE INDEX idx_deps_depends_on ON Service_Dependencies (depends_on)",
+            "CREATE INDEX idx_ports_port ON Network_Ports (port)",
+            "CREATE INDEX idx_ports_pid ON Network_Ports (pid)",
+            "CREATE INDEX idx_processes_name ON Processes (process_name)",
+        ],
+        "Control": [
+            "CREATE INDEX idx_config_name ON sys_config (svc_name)",
+            "CREATE INDEX idx_config_port ON sys_config (port)",
+            "CREATE INDEX idx_deps_svc ON svc_deps (svc_id)",
+            "CREATE INDEX idx_deps_dep ON svc_deps (dep_id)",
+            "CREATE INDEX idx_net_port ON net_active (local_port)",
+            "CREATE INDEX idx_net_pid ON net_active (pid)",
+            "CREATE INDEX idx_proc_image ON proc_list (image)",
+        ],
+    }
+
+    GOAL_RE = re.compile(r"service '([^']+)'\. It uses Port (\d+)\.")
+
+    def __init__(self, n_services=2000, n_background=3000, n_listeners=1000, max_deps=5, name=None):
+        self.n_services = n_services
+        self.n_background = n_background
+        self.n_listeners = min(n_listeners, n_background)
+        self.max_deps = max_deps
+        if name:
+            self.name = name
+        self._state = None
+
+    def generate(self):
+        """
+        The template's rows: services, dependency edges (a DAG, ~max_deps/2 per service),
+        processes and listening ports. Deterministic and computed once.
+        """
+        if self._state is not None:
+            return self._state
+        rng = random.Random(self.TEMPLATE_SEED)
+        n = self.n_services
+        ports = rng.sample(range(1024, 65536), n + self.n_listeners)
+
+        services, processes, listeners = [], [], []
+        for i in range(n):
+            team, role = rng.choice(TEAMS), rng.choice(list(ROLES))
+            pid = self.FIRST_PID + i
+            services.append({"id": i + 1, "name": f"{team}_{role}_{i:04d}", "team": team, "port": ports[i], "pid": pid})
+            processes.append((pid, ROLES[role], rng.choice(USERS), round(rng.uniform(0, 40), 1), rng.randint(32, 4096)))
+            listeners.append((ports[i], pid, ROLES[role]))
+        # Every service depends on a few older ones only, so the graph has no cycles
+        deps = [rng.sample(range(i), rng.randint(1, min(self.max_deps, i))) if i else [] for i in range(n)]
+        for j in range(self.n_background):
+            pid = self.FIRST_PID + n + j
+            image = rng.choice(BACKGROUND_IMAGES)
+            processes.append((pid, image, rng.choice(USERS), round(rng.uniform(0, 5), 1), rng.randint(8, 512)))
+            if j < self.n_listeners:
+                listeners.append((ports[n + j], pid, image))
+
+        self._state = {"services": services, "deps": deps, "processes": processes, "listeners": listeners}
+        return self._state
+
+    def build(self, conn, variant):
+        state = self.generate()
+        services, deps = state["services"], state["deps"]
+        cursor = conn.cursor()
+        for ddl in self.SCHEMA[variant]:
+            cursor.execute(ddl)
+
+        if variant == "Treatment":
+            cursor.executemany("INSERT INTO System_Services VALUES (?, 'RUNNING', ?, ?)",
+                               [(s["name"], s["port"], s["team"]) for s in services])
+            cursor.executemany("INSERT INTO Service_Dependencies VALUES (?, ?)",
+                               [(services[i]["name"], services[d]["name"]) for i, ds in enumerate(deps) for d in ds])
+            cursor.executemany("INSERT INTO Network_Ports VALUES (?, 'TCP', ?, ?, 'LISTENING')",
+                               [(port, image, pid) for port, pid, image in state["listeners"]])
+            cursor.executemany("INSERT INTO Processes VALUES (?, ?, ?, ?, ?)", state["processes"])
+        else:
+            cursor.executemany("INSERT INTO sys_config VALUES (?, ?, 1, ?)",
+                               [(s["id"], s["name"], s["port"]) for s in services])
+            cursor.executemany("INSERT INTO svc_deps VALUES (?, ?)",
+                               [(i + 1, d + 1) for i, ds in enumerate(deps) for d in ds])
+            cursor.executemany("INSERT INTO net_active VALUES (?, ?, 'LISTEN')",
+                               [(port, pid) for port, pid, _ in state["listeners"]])
+            cursor.executemany("INSERT INTO proc_list VALUES (?, ?, ?)",
+                               [(pid, image, USERS.index(user)) for pid, image, user, _, _ in state["processes"]])
+
+        for ddl in self.INDEXES[variant]:
+            cursor.execute(ddl)
+
+    def draw(self, rng):
+        state = self.generate()
+        target = state["services"][rng.randrange(1, self.n_services)]
+        dependency = state["services"][rng.choice(state["deps"][target["id"] - 1])]
+        return {
+            "target": target["name"], "target_id": target["id"], "target_pid": target["pid"], "port": target["port"],
+            "dependency": dependency["name"], "dependency_id": dependency["id"], "dependency_pid": dependency["pid"],
+            "rogue_pid": rng.randint(1000, 9999), "rogue_name": rng.choice(ROGUE_NAMES),
+        }
+
+    def apply(self, conn, variant, params):
+        cursor = conn.cursor()
+        stopped = (params["target_pid"], params["dependency_pid"])
+        if variant == "Treatment":
+            cursor.execute("UPDATE System_Services SET status='STOPPED' WHERE service_name IN (?, ?)",
+                           (params["target"], params["dependency"]))
+            cursor.execute("DELETE FROM Network_Ports WHERE pid IN (?, ?)", stopped)
+            cursor.execute("DELETE FROM Processes WHERE pid IN (?, ?)", stopped)
+            cursor.execute("INSERT INTO Processes VALUES (?, ?, 'admin', 12.5, 256)", (params["rogue_pid"], params["rogue_name"]))
+            cursor.execute("INSERT INTO Network_Ports VALUES (?, 'TCP', ?, ?, 'LISTENING')",
+                           (params["port"], params["rogue_name"], params["rogue_pid"]))
+        else:
+            cursor.execute("UPDATE sys_config SET state=0 WHERE svc_id IN (?, ?)", (params["target_id"], params["dependency_id"]))
+            cursor.execute("DELETE FROM net_active WHERE pid IN (?, ?)", stopped)
+            cursor.execute("DELETE FROM proc_list WHERE pid IN (?, ?)", stopped)
+            cursor.execute("INSERT INTO proc_list VALUES (?, ?, ?)", (params["rogue_pid"], params["rogue_name"], USERS.index("admin")))
+            cursor.execute("INSERT INTO net_active VALUES (?, ?, 'LISTEN')", (params["port"], params["rogue_pid"]))
+
+    def describe(self, variant, params):
+        if variant == "Treatment":
+            hint = """
+        Tables:
+        1. System_Services (service_name, status, port_required, owner_team)
+        2. Service_Dependencies (service_name, depends_on)
+        3. Network_Ports (port, protocol, process_name, pid, status)
+        4. Processes (pid, process_name, user, cpu_pct, mem_mb)
+        """
+            goal = f"Start the service '{params['target']}'. It uses Port {params['port']}. If it fails, find what is blocking it."
+        else:
+            hint = """
+        Tables:
+        1. sys_config (svc_id, svc_name, state [0=STOP/1=RUN], port)
+        2. svc_deps (svc_id, dep_id) -- dep_id must run before svc_id
+        3. net_active (local_port, pid, status)
+        4. proc_list (pid, image, uid)
+        """
+            goal = f"Start service '{params['target']}'. It uses Port {params['port']}. Ensure state=1."
+        return goal, hint
+
+    def rules(self, variant, params):
+        target, port = params["target"], params["port"]
+        if variant == "Treatment":
+            return KernelRuleSet([
+                KernelRule(
+                    "start_target_port_busy", "UPDATE", "System_Services",
+                    sets={"status": "RUNNING"},
+                    targets=("service_name", target),
+                    blocked_if=f"SELECT count(*) FROM Network_Ports WHERE port={port}",
+                    error=f"ERROR 0x800: Port {port} is already in use by another process. Bind failed.",
+                ),
+                KernelRule(
+                    "start_target_dependency_down", "UPDATE", "System_Services",
+                    sets={"status": "RUNNING"},
+                    targets=("service_name", target),
+                    blocked_if="SELECT count(*) FROM Service_Dependencies d JOIN System_Services s "
+                               f"ON s.service_name = d.depends_on WHERE d.service_name = '{target}' AND s.status != 'RUNNING'",
+                    error="ERROR 1068: The dependency service or group failed to start.",
+                ),
+                KernelRule("kill_process", "DELETE", "Network_Ports", response=KILL_RESPONSE),
+                KernelRule("kill_process", "DELETE", "Processes", response=KILL_RESPONSE),
+            ])
+        return KernelRuleSet([
+            KernelRule(
+                "start_target_port_busy", "UPDATE", "sys_config",
+                sets={"state": 1},
+                targets=("svc_name", target),
+                blocked_if=f"SELECT count(*) FROM net_active WHERE local_port={port}",
+                error=f"ERR_SERVICE_START_FAIL: Port {port} is currently in use by another process.",
+            ),
+            KernelRule(
+                "start_target_dependency_down", "UPDATE", "sys_config",
+                sets={"state": 1},
+                targets=("svc_name", target),
+                blocked_if="SELECT count(*) FROM svc_deps d JOIN sys_config c ON c.svc_id = d.dep_id "
+                           f"WHERE d.svc_id = {params['target_id']} AND c.state != 1",
+                error="ERR_SERVICE_DEPENDENCY_FAIL: A required service (svc_deps) is not running.",
+            ),
+            KernelRule("kill_process", "DELETE", "*", response=KILL_RESPONSE),
+        ])
+
+    def check(self, conn, variant, params):
+        cursor = conn.cursor()
+        if variant == "Treatment":
+            status = cursor.execute("SELECT status FROM System_Services WHERE service_name=?", (params["target"],)).fetchone()
+            deps_down = cursor.execute(
+                "SELECT count(*) FROM Service_Dependencies d JOIN System_Services s ON s.service_name = d.depends_on "
+                "WHERE d.service_name = ? AND s.status != 'RUNNING'", (params["target"],)).fetchone()[0]
+            rogue = cursor.execute("SELECT count(*) FROM Network_Ports WHERE port=? AND pid=?",
+                                   (params["port"], params["rogue_pid"])).fetchone()[0]
+            return status is not None and status[0] == 'RUNNING' and deps_down == 0 and rogue == 0
+        state = cursor.execute("SELECT state FROM sys_config WHERE svc_id=?", (params["target_id"],)).fetchone()
+        deps_down = cursor.execute(
+            "SELECT count(*) FROM svc_deps d JOIN sys_config c ON c.svc_id = d.dep_id WHERE d.svc_id = ? AND c.state != 1",
+            (params["target_id"],)).fetchone()[0]
+        rogue = cursor.execute("SELECT count(*) FROM net_active WHERE local_port=? AND pid=?",
+                               (params["port"], params["rogue_pid"])).fetchone()[0]
+        return state is not None and state[0] == 1 and deps_down == 0 and rogue == 0
+
+    def script(self, variant, context):
+        match = self.GOAL_RE.search(context)
+        if match is None:
+            return None
+        target, port = match.group(1), match.group(2)
+        if variant == "Treatment":
+            start = f"UPDATE System_Services SET status='RUNNING' WHERE service_name='{target}'"
+            steps = [
+                ("Check the target service.", f"SELECT * FROM System_Services WHERE service_name='{target}'", False),
+                ("Try to start it.", start, False),
+                (f"Something holds port {port}. Look at the network table.", f"SELECT * FROM Network_Ports WHERE port={port}", False),
+                (f"Kill the process on port {port}.", f"DELETE FROM Network_Ports WHERE port={port}", False),
+                ("Port is free, start it again.", start, False),
+                ("A dependency is down. List the dependencies.",
+                 "SELECT s.service_name, s.status FROM Service_Dependencies d JOIN System_Services s "
+                 f"ON s.service_name = d.depends_on WHERE d.service_name='{target}'", False),
+                ("Start the stopped dependencies.",
+                 "UPDATE System_Services SET status='RUNNING' WHERE service_name IN "
+                 f"(SELECT depends_on FROM Service_Dependencies WHERE service_name='{target}')", False),
+                ("Dependencies are up, start the target.", start, False),
+                ("Verify the service status.", f"SELECT status FROM System_Services WHERE service_name='{target}'", False),
+                (f"{target} is RUNNING.", "SELECT 1", True),
+            ]
+            careless = ["SELECT * FROM Processes", "SELECT * FROM Network_Ports", "SELECT * FROM Service_Dependencies"]
+        else:
+            svc_id = f"(SELECT svc_id FROM sys_config WHERE svc_name='{target}')"
+            start = f"UPDATE sys_config SET state=1 WHERE svc_name='{target}'"
+            steps = [
+                ("Check the service config first.", f"SELECT * FROM sys_config WHERE svc_name='{target}'", False),
+                ("Try to start it.", start, False),
+                (f"Find the PID listening on port {port}.", f"SELECT * FROM net_active WHERE local_port={port}", False),
+                ("Resolve the PID to an image name.",
+                 f"SELECT p.pid, p.image FROM net_active n JOIN proc_list p ON p.pid = n.pid WHERE n.local_port={port}", False),
+                (f"Kill the listener on port {port}.", f"DELETE FROM net_active WHERE local_port={port}", False),
+                ("Port is free, start it again.", start, False),
+                ("A dependency is down. List the dependencies.",
+                 f"SELECT c.svc_id, c.svc_name, c.state FROM svc_deps d JOIN sys_config c ON c.svc_id = d.dep_id WHERE d.svc_id={svc_id}", False),
+                ("Start the stopped dependencies.",
+                 f"UPDATE sys_config SET state=1 WHERE svc_id IN (SELECT dep_id FROM svc_deps WHERE svc_id={svc_id})", False),
+                ("Dependencies are up, start the target.", start, False),
+                ("Verify the service state.", f"SELECT state FROM sys_config WHERE svc_name='{target}'", False),
+                (f"{target} is running.", "SELECT 1", True),
+            ]
+            careless = ["SELECT * FROM proc_list", "SELECT * FROM net_active", "SELECT * FROM svc_deps"]
+        # Exploration includes the unfiltered scans a careless agent would run
+        return steps, [sql for _, sql, _ in steps if sql.startswith("SELECT")] + careless
+
+# ==========================================
+# REGISTRY
+# ==========================================
+SCENARIOS = {}
+
+def register_scenario(scenario):
+    """
+    Installs (or replaces) a scenario under its `name`.
+    """
+    SCENARIOS[scenario.name] = scenario
+    return scenario
+
+def get_scenario(name):
+    if name not in SCENARIOS:
+        raise ValueError(f"Unknown scenario '{name}' ({', '.join(SCENARIOS)}).")
+    return SCENARIOS[name]
+
+def policy_script(context):
+    """
+    (steps, explore) of whichever registered scenario the prompt belongs to, or None.
+    """
+    for scenario in SCENARIOS.values():
+        script = scenario.policy_script(context)
+        if script is not None:
+            return script
+    return None
+
+register_scenario(PortConflict())
+register_scenario(Datacenter())
@@ -0,0 +1,272 @@
+import json
+import math
+from scipy.special import gammaln
+
+# ==========================================
+# CONFIGURATION
+# ==========================================
+# Per metric: how to read it off a session, which direction is good, and the test scales.
+#   tau - scale of the normal mixture over effect sizes (the test is most sensitive around it)
+#   mde - smallest effect that matters; a confidence sequence inside (-mde, +mde) is futility
+#   role - "primary" decides success/futility, "guardrail" halts the run on a harmful effect
+METRICS = {
+    "steps": {"role": "primary", "higher_is_better": False, "binary": False, "tau": 2.0, "mde": 1.0},
+    "success": {"role": "guardrail", "higher_is_better": True, "binary": True, "tau": 0.1, "mde": 0.05},
+    "hallucination": {"role": "guardrail", "higher_is_better": False, "binary": True, "tau": 0.1, "mde": 0.05},
+}
+
+DEFAULT_CONFIG = {
+    "alpha": 0.05,            # primary metric (efficacy and futility)
+    "guardrail_alpha": 0.05,  # each guardrail, one-sided for harm
+    "srm_alpha": 0.001,
+    "min_per_arm": 20,        # no decision before every arm has this many sessions
+}
+
+def session_values(outcome, steps, is_fixed):
+    """
+    Metric values of one finished session, keyed like METRICS.
+    """
+    return {
+        "steps": float(steps),
+        "success": 1.0 if is_fixed else 0.0,
+        "hallucination": 1.0 if (outcome == "CLAIMED_FIX" and not is_fixed) else 0.0,
+    }
+
+# ==========================================
+# ALWAYS-VALID TESTS
+# ==========================================
+class RunningMean:
+    """
+    Welford accumulator: O(1) per observation.
+    """
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+class MixtureSPRT:
+    """
+    Two-sample mixture SPRT (normal mixture, Johari et al.) for the difference in means
+    Treatment - Control, with plug-in variances.
+
+    With V = Var(mean_T - mean_C), the mixture likelihood ratio against H0: effect = theta is
+        sqrt(V / (V + tau^2)) * exp(tau^2 (estimate - theta)^2 / (2 V (V + tau^2)))
+    and the always-valid p-value is the running minimum of its inverse. Inverting it gives a
+    confidence sequence that holds at every sample size simultaneously, so the test can be
+    checked after every session without inflating the error rate.
+    """
+    def __init__(self, tau, binary=False, arms=("Control", "Treatment"), min_n=20):
+        self.tau2 = tau ** 2
+        self.binary = binary
+        # Plug-in variances of a handful of sessions are too noisy to start the test on
+        self.min_n = max(min_n, 2)
+        self.control, self.treatment = arms
+        self.arms = {arm: RunningMean() for arm in arms}
+        self.p_value = 1.0
+
+    def _arm_variance(self, arm):
+        stats = self.arms[arm]
+        if self.binary:
+            # Smoothed rate so an arm with all 0s (or 1s) does not claim zero variance
+            rate = (stats.mean * stats.n + 1) / (stats.n + 2)
+            return rate * (1 - rate)
+        return max(stats.variance, 1e-6)
+
+    @property
+    def ready(self):
+        return all(stats.n >= self.min_n for stats in self.arms.values())
+
+    @property
+    def estimate(self):
+        return self.arms[self.treatment].mean - self.arms[self.control].mean
+
+    @property
+    def variance(self):
+        return sum(self._arm_variance(arm) / stats.n for arm, stats in self.arms.items())
+
+    def likelihood_ratio(self, theta=0.0):
+        v = self.variance
+        z2 = (self.estimate - theta) ** 2
+        log_lr = 0.5 * math.log(v / (v + self.tau2)) + self.tau2 * z2 / (2 * v * (v + self.tau2))
+        return math.exp(min(log_lr, 700.0))
+
+    def add(self, arm, x):
+        self.arms[arm].add(x)
+        if self.ready:
+            self.p_value = min(self.p_value, 1.0 / self.likelihood_ratio())
+
+    def confidence_sequence(self, alpha):
+        if not self.ready:
+            return (-math.inf, math.inf)
+        v = self.variance
+        half = math.sqrt(2 * v * (v + self.tau2) / self.tau2 * math.log(math.sqrt((v + self.tau2) / v) / alpha))
+        return (self.estimate - half, self.estimate + half)
+
+class SequentialSRM:
+    """
+    Sequential sample ratio mismatch test (Dirichlet-multinomial Bayes factor, Lindon & Malek).
+    The always-valid p-value is the running minimum of 1 / BF.
+    """
+    def __init__(self, expected, concentration=1.0):
+        total = sum(expected.values())
+        self.expected = {arm: share / total for arm, share in expected.items()}
+        self.prior = {arm: share * concentration * len(expected) for arm, share in self.expected.items()}
+        self.counts = {arm: 0 for arm in expected}
+        self.p_value = 1.0
+
+    def log_bayes_factor(self):
+        n = sum(self.counts.values())
+        a0 = sum(self.prior.values())
+        log_marginal = gammaln(a0) - gammaln(a0 + n) + sum(
+            gammaln(self.prior[arm] + x) - gammaln(self.prior[arm]) for arm, x in self.counts.items()
+        )
+        log_null = sum(x * math.log(self.expected[arm]) for arm, x in self.counts.items() if x)
+        return log_marginal - log_null
+
+    def add(self, arm):
+        self.counts[arm] += 1
+        self.p_value = min(self.p_value, math.exp(-min(self.log_bayes_factor(), 700.0)))
+
+# ==========================================
+# MONITOR
+# ==========================================
+class SequentialMonitor:
+    """
+    Updates the always-valid tests after every finished session and decides when to stop:
+
+    * SRM             - halt: the logged sessions no longer match the planned split
+    * guardrail harm  - halt: a guardrail's confidence sequence is entirely on the harmful side
+    * efficacy        - stop: the primary metric's always-valid p-value < alpha
+    * futility        - stop: the primary metric's confidence sequence lies within (-mde, +mde)
+
+    Sessions are consumed in plan order (finished sessions wait in a small reorder buffer), so
+    the analysed data is always a prefix of the randomized plan, even when async sessions finish
+    out of order. A crashed session is consumed as missing, which is what SRM is there to catch.
+    """
+    def __init__(self, plan_units, variants=("Control", "Treatment"), metrics=METRICS, **config):
+        self.config = {**DEFAULT_CONFIG, **config}
+        self.metrics = metrics
+        self.order = [u["index"] for u in sorted(plan_units, key=lambda u: u["index"])]
+        self.variant_of = {u["index"]: u["variant"] for u in plan_units}
+        self.tests = {name: MixtureSPRT(spec["tau"], spec["binary"], variants, self.config["min_per_arm"]) for name, spec in metrics.items()}
+        shares = {v: sum(1 for u in plan_units if u["variant"] == v) for v in variants}
+        # The plan draws variants uniformly; the expected split is the design, not the realized draw
+        self.srm = SequentialSRM({v: 1.0 for v in variants} if all(shares.values()) else shares)
+        self.decision = None
+        self.path = []
+        self._next = 0
+        self._buffer = {}
+
+    @property
+    def stopped(self):
+        return self.decision is not None
+
+    @property
+    def consumed(self):
+        return self._next
+
+    def observe(self, unit, values):
+        """
+        `values` from session_values(), or None if the session crashed / produced no metrics.
+        """
+        self._buffer[unit["index"]] = values
+        while self._next < len(self.order) and self.order[self._next] in self._buffer:
+            index = self.order[self._next]
+            self._next += 1
+            self._consume(index, self._buffer.pop(index))
+
+    def _consume(self, index, values):
+        if self.stopped:
+            return
+        if values is not None:
+            variant = self.variant_of[index]
+            self.srm.add(variant)
+            for name, test in self.tests.items():
+                test.add(variant, values[name])
+        self.path.append({"n": self._next, "p_primary": self._primary_test().p_value, "p_srm": self.srm.p_value})
+        self.decision = self._evaluate()
+
+    def _primary_test(self):
+        name = next(name for name, spec in self.metrics.items() if spec["role"] == "primary")
+        return self.tests[name]
+
+    def _evaluate(self):
+        cfg = self.config
+        if min(self.srm.counts.values()) < cfg["min_per_arm"]:
+            return None
+        if self.srm.p_value < cfg["srm_alpha"]:
+            return self._stop("SRM", f"sample ratio mismatch (p={self.srm.p_value:.2g}, counts={self.srm.counts})")
+
+        for name, spec in self.metrics.items():
+            if spec["role"] != "guardrail":
+                continue
+            # One-sided harm: the two-sided sequence at 2*alpha has alpha in each tail
+            low, high = self.tests[name].confidence_sequence(2 * cfg["guardrail_alpha"])
+            harmful = high < 0 if spec["higher_is_better"] else low > 0
+            if harmful:
+                return self._stop("GUARDRAIL", f"{name} degraded in Treatment (CS [{low:+.3f}, {high:+.3f}])")
+
+        name, spec = next((n, s) for n, s in self.metrics.items() if s["role"] == "primary")
+        test = self.tests[name]
+        if test.p_value < cfg["alpha"]:
+            return self._stop("EFFICACY", f"{name} effect {test.estimate:+.3f} (always-valid p={test.p_value:.3g})")
+        low, high = test.confidence_sequence(cfg["alpha"])
+        if -spec["mde"] < low and high < spec["mde"]:
+            return self._stop("FUTILITY", f"{name} effect within ±{spec['mde']} (CS [{low:+.3f}, {high:+.3f}])")
+        return None
+
+    def _stop(self, reason, detail):
+        return {"reason": reason, "detail": detail, "sessions": self._next,
+                "halt": reason in ("SRM", "GUARDRAIL")}
+
+    def snapshot(self):
+        alpha = self.config["alpha"]
+        metrics = {}
+        for name, test in self.tests.items():
+            low, high = test.confidence_sequence(alpha)
+            metrics[name] = {
+                "n": {arm: stats.n for arm, stats in test.arms.items()},
+                "mean": {arm: round(stats.mean, 4) for arm, stats in test.arms.items()},
+                "effect": round(test.estimate, 4) if test.ready else None,
+                "cs": [round(low, 4), round(high, 4)] if test.ready else None,
+                "p_value": test.p_value,
+            }
+        return {"config": self.config, "consumed": self._next, "planned": len(self.order),
+                "decision": self.decision, "srm": {"counts": self.srm.counts, "p_value": self.srm.p_value},
+                "metrics": metrics, "path": self.path}
+
+    def write_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2, default=float)
+
+    def summary(self):
+        srm = f"SRM p={self.srm.p_value:.3g}"
+        parts = []
+        for name, test in self.tests.items():
+            if test.ready:
+                low, high = test.confidence_sequence(self.config["alpha"])
+                parts.append(f"{name} {test.estimate:+.3f} [{low:+.3f}, {high:+.3f}]")
+        return f"n={self._next}/{len(self.order)} | {srm} | " + " | ".join(parts)
+
+def replay(metrics_df, plan_units, **config):
+    """
+    Runs the monitor over a finished (or partial) metrics table, e.g. from a notebook.
+    """
+    monitor = SequentialMonitor(plan_units, **config)
+    rows = {s_id: (outcome, steps, fixed) for s_id, outcome, steps, fixed in zip(
+        metrics_df["Session_UUID"], metrics_df["Outcome"], metrics_df["Steps_Taken"],
+        metrics_df["Is_Actually_Fixed"].astype(str).eq("True"))}
+    for unit in plan_units:
+        if unit["session_uuid"] in rows:
+            monitor.observe(unit, session_values(*rows[unit["session_uuid"]]))
+    return monitor
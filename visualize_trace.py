@@ -1,120 +1,373 @@
-import pandas as pd
 import os
+import json
+import glob
+import shutil
+import argparse
+import numpy as np
+from exp_logging import iter_log_batches, log_columns
 
 # CONFIGURATION
-# Pointing directly to your specific trace file
-TRACE_FILE_PATH = "os_logs/os_trace_20251201_012410.csv"
-OUTPUT_HTML = "trace_viewer.html"
-
-def generate_html():
-    # 1. Load Data
-    if not os.path.exists(TRACE_FILE_PATH):
-        print(f"❌ Error: File not found at {TRACE_FILE_PATH}")
-        return
-
-    print(f"Reading log: {TRACE_FILE_PATH}")
-    df = pd.read_csv(TRACE_FILE_PATH)
-
-    # 2. Start HTML Construction
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Agentic-ExP Trace Viewer</title>
-        <style>
-            body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background-color: #e5ddd5; margin: 0; padding: 20px; }
-            .container { max-width: 800px; margin: 0 auto; background-color: #efe7dd; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); overflow: hidden; }
-            .header { background-color: #075e54; color: white; padding: 15px; text-align: center; font-size: 1.2em; font-weight: bold; }
-            
-            .session-block { border-bottom: 4px solid #ccc; padding-bottom: 20px; margin-bottom: 20px; background-color: #fff; }
-            .session-header { background-color: #128c7e; color: white; padding: 10px 15px; font-size: 0.95em; position: sticky; top: 0; z-index: 10; display: flex; justify-content: space-between; }
-            
-            .chat-box { padding: 15px; display: flex; flex-direction: column; gap: 15px; }
-            
-            .message { max-width: 85%; padding: 12px; border-radius: 8px; position: relative; font-size: 0.95em; line-height: 1.5; box-shadow: 0 1px 2px rgba(0,0,0,0.15); }
-            
-            /* Reasoning (Internal Monologue) - White/Gray */
-            .msg-reasoning { align-self: flex-start; background-color: #ffffff; border-top-left-radius: 0; border: 1px solid #ddd; }
-            .msg-reasoning::before { content: "🧠 THOUGHT"; display: block; font-size: 0.75em; color: #666; margin-bottom: 6px; font-weight: bold; letter-spacing: 0.5px; }
-            
-            /* SQL Action - Light Green */
-            .msg-action { align-self: flex-end; background-color: #dcf8c6; border-top-right-radius: 0; font-family: "Consolas", monospace; font-size: 0.9em; }
-            .msg-action::before { content: "⚡ SQL COMMAND"; display: block; font-size: 0.75em; color: #075e54; margin-bottom: 6px; font-weight: bold; letter-spacing: 0.5px; }
-            
-            /* System Output - Dark Terminal Style */
-            .msg-system { align-self: center; background-color: #2b2b2b; color: #efefef; font-family: "Consolas", monospace; font-size: 0.85em; width: 95%; border-radius: 6px; border-left: 5px solid #ff9800; }
-            .msg-system::before { content: "> TERMINAL OUTPUT"; display: block; font-size: 0.75em; color: #888; margin-bottom: 6px; border-bottom: 1px solid #444; padding-bottom: 4px; }
-
-            .latency-tag { position: absolute; bottom: -20px; right: 5px; font-size: 0.7em; color: #888; font-style: italic; }
-            .step-num { font-weight: bold; background: rgba(255,255,255,0.2); padding: 2px 6px; border-radius: 4px; }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">Experiment Trace Logs</div>
+# Defaults to the newest trace in LOG_DIR; pass a path to view another run
+LOG_DIR = "os_logs"
+OUTPUT_DIR = "trace_viewer"
+SESSIONS_PER_SHARD = 100
+BATCH_ROWS = 65536
+
+# Layout of one step inside a shard, and of one session row in the index
+STEP_COLUMNS = ["Step_Num", "Reasoning", "SQL_Command", "Tool_Output", "Tool_Output_Kind", "Latency_ms"]
+META_COLUMNS = ["Variant", "Persona", "Model", "Outcome", "Is_Actually_Fixed", "Total_Latency_ms"]
+INDEX_COLUMNS = ["Session_UUID"] + META_COLUMNS + ["Steps", "Shard"]
+
+# ==========================================
+# INPUTS
+# ==========================================
+def latest_trace(log_dir=LOG_DIR):
+    paths = glob.glob(os.path.join(log_dir, "os_trace_*"))
+    return max(paths, key=os.path.getmtime) if paths else None
+
+def metrics_path_for(trace_path):
+    base = os.path.basename(trace_path.rstrip("/"))
+    return os.path.join(os.path.dirname(trace_path.rstrip("/")), base.replace("os_trace_", "os_metrics_", 1))
+
+def load_session_metadata(metrics_path):
+    """
+    Session UUID -> META_COLUMNS values. One small record per session, never per step.
     """
+    meta = {}
+    if not metrics_path or not os.path.exists(metrics_path):
+        return meta
+    for batch in iter_log_batches(metrics_path, columns=["Session_UUID"] + META_COLUMNS):
+        # CSV logs hold the booleans as text
+        batch["Is_Actually_Fixed"] = batch["Is_Actually_Fixed"].astype(str).eq("True")
+        batch = batch.astype(object).where(batch.notna(), None)
+        for s_id, *values in zip(*(batch[c].tolist() for c in ["Session_UUID"] + META_COLUMNS)):
+            meta[s_id] = values
+    return meta
 
-    # 3. Group by Session for readable flows
-    # We define a custom order if needed, or just iterate groups
-    grouped = df.groupby('Session_UUID')
-    
-    for session_id, group in grouped:
-        # Extract Session Metadata (Variant/Model) from the first row of trace if available, 
-        # otherwise we just show UUID. (Trace file usually doesn't have Variant col, metrics file does).
-        # We will just show UUID and Row Count.
-        step_count = len(group)
-        
-        html_content += f"""
-        <div class="session-block">
-            <div class="session-header">
-                <span>Session: {session_id}</span>
-                <span class="step-num">{step_count} Steps</span>
-            </div>
-            <div class="chat-box">
-        """
-        
-        for _, row in group.iterrows():
-            # Clean up Tool Output which might have pipes | from CSV formatting
-            tool_out = str(row['Tool_Output']).replace('|', '<br>')
-            
-            # Step 1: Reasoning Bubble
-            html_content += f"""
-            <div class="message msg-reasoning">
-                {row['Reasoning']}
-                <span class="latency-tag">{row['Latency_ms']}ms</span>
-            </div>
-            """
-            
-            # Step 2: Action Bubble
-            html_content += f"""
-            <div class="message msg-action">
-                {row['SQL_Command']}
-            </div>
-            """
-            
-            # Step 3: System Output Bubble
-            html_content += f"""
-            <div class="message msg-system">
-                {tool_out}
-            </div>
-            """
-            
-        html_content += "</div></div>"
-
-    # 4. Close HTML
-    html_content += """
-        </div>
-    </body>
-    </html>
+def _normalize_steps(batch, legacy):
+    batch = batch.fillna({"Reasoning": "", "SQL_Command": "", "Tool_Output": "", "Latency_ms": 0})
+    if legacy:
+        # v1 CSV logs flattened newlines in the tool output to " | "
+        batch["Tool_Output"] = batch["Tool_Output"].astype(str).str.replace(" | ", "\n", regex=False)
+        batch["Tool_Output_Kind"] = "text"
+    return batch
+
+# ==========================================
+# SHARD WRITER
+# ==========================================
+class ShardWriter:
+    """
+    Streams transcripts into sessions/shard-NNNNN.js, SESSIONS_PER_SHARD sessions per file.
+
+    Shards are JSON payloads wrapped in a `traceShard(id, steps)` call so the page can load
+    them with a <script> tag, which (unlike fetch) also works when opened from file://.
+    A session's steps may arrive in several chunks; each chunk is appended as its own call.
     """
+    def __init__(self, out_dir, sessions_per_shard=SESSIONS_PER_SHARD):
+        self.dir = os.path.join(out_dir, "sessions")
+        shutil.rmtree(self.dir, ignore_errors=True)
+        os.makedirs(self.dir)
+        self.sessions_per_shard = sessions_per_shard
+        # Session UUID -> [steps, shard], in order of first appearance
+        self.sessions = {}
+        self._shard = None
+        self._f = None
+
+    def _open(self, shard):
+        if shard != self._shard:
+            if self._f is not None:
+                self._f.close()
+            self._f = open(os.path.join(self.dir, f"shard-{shard:05d}.js"), "a", encoding="utf-8")
+            self._shard = shard
+        return self._f
+
+    def write(self, s_id, steps):
+        entry = self.sessions.get(s_id)
+        if entry is None:
+            entry = self.sessions[s_id] = [0, len(self.sessions) // self.sessions_per_shard]
+        entry[0] += len(steps)
+        self._open(entry[1]).write(f"traceShard({json.dumps(s_id)},{json.dumps(steps, default=str)});\n")
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+
+def write_trace_shards(trace_path, writer, batch_rows=BATCH_ROWS):
+    """
+    One pass over the trace in batches: runs of consecutive rows of one session are found
+    with a vectorized comparison and written as one chunk each.
+    """
+    legacy = "Tool_Output_Kind" not in log_columns(trace_path)
+    columns = ["Session_UUID"] + [c for c in STEP_COLUMNS if not (legacy and c == "Tool_Output_Kind")]
+    n_rows = 0
+    for batch in iter_log_batches(trace_path, columns=columns, batch_rows=batch_rows):
+        if batch.empty:
+            continue
+        batch = _normalize_steps(batch, legacy)
+        s_ids = batch["Session_UUID"].to_numpy()
+        starts = np.flatnonzero(np.r_[True, s_ids[1:] != s_ids[:-1]])
+        ends = np.r_[starts[1:], len(s_ids)]
+        steps = list(zip(*(batch[c].tolist() for c in STEP_COLUMNS)))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            writer.write(s_ids[start], steps[start:end])
+        n_rows += len(batch)
+    return n_rows
+
+def write_index(out_dir, sessions, meta):
+    """
+    index.js: one row per session (INDEX_COLUMNS), streamed to disk.
+    """
+    empty = [None] * len(META_COLUMNS)
+    with open(os.path.join(out_dir, "index.js"), "w", encoding="utf-8") as f:
+        f.write(f"traceIndex({json.dumps(INDEX_COLUMNS)}, [\n")
+        first = True
+        for s_id, (steps, shard) in sessions.items():
+            f.write(("" if first else ",") + json.dumps([s_id] + meta.get(s_id, empty) + [steps, shard]) + "\n")
+            first = False
+        # Sessions with metrics but no trace rows still belong in the list
+        for s_id, values in meta.items():
+            if s_id not in sessions:
+                f.write(("" if first else ",") + json.dumps([s_id] + values + [0, None]) + "\n")
+                first = False
+        f.write("]);\n")
+
+def generate_viewer(trace_path, metrics_path=None, out_dir=OUTPUT_DIR, sessions_per_shard=SESSIONS_PER_SHARD):
+    # 1. Session metadata from the metrics file
+    metrics_path = metrics_path or metrics_path_for(trace_path)
+    meta = load_session_metadata(metrics_path)
+    if not meta:
+        print(f"⚠️ No metrics found at {metrics_path}; sessions will be listed without metadata.")
+
+    # 2. Transcripts, streamed into shards
+    os.makedirs(out_dir, exist_ok=True)
+    print(f"Reading log: {trace_path}")
+    writer = ShardWriter(out_dir, sessions_per_shard)
+    try:
+        n_rows = write_trace_shards(trace_path, writer)
+    finally:
+        writer.close()
+
+    # 3. Index data and the static page
+    write_index(out_dir, writer.sessions, meta)
+    with open(os.path.join(out_dir, "index.html"), "w", encoding="utf-8") as f:
+        f.write(INDEX_HTML)
+
+    n_shards = len(os.listdir(writer.dir))
+    print(f"✅ Generated '{out_dir}/index.html' ({len(writer.sessions)} sessions, {n_rows} steps, {n_shards} shards). "
+          f"Open it in your browser to view the chat replay!")
+
+# ==========================================
+# PAGE TEMPLATE
+# ==========================================
+INDEX_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Agentic-ExP Trace Viewer</title>
+    <style>
+        body { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif; background-color: #e5ddd5; margin: 0; padding: 20px; }
+        .container { max-width: 900px; margin: 0 auto; background-color: #efe7dd; border-radius: 8px; box-shadow: 0 2px 5px rgba(0,0,0,0.1); overflow: hidden; }
+        .header { background-color: #075e54; color: white; padding: 15px; text-align: center; font-size: 1.2em; font-weight: bold; }
+        .toolbar { display: flex; flex-wrap: wrap; gap: 8px; padding: 10px 15px; background: #fff; border-bottom: 1px solid #ddd; align-items: center; font-size: 0.9em; }
+        .toolbar input[type=text] { flex: 1; min-width: 180px; padding: 4px 6px; }
+        .pager { display: flex; justify-content: center; gap: 12px; padding: 10px; align-items: center; }
+
+        .session-block { border-bottom: 4px solid #ccc; background-color: #fff; }
+        .session-header { background-color: #128c7e; color: white; padding: 10px 15px; font-size: 0.95em; cursor: pointer; display: flex; justify-content: space-between; gap: 10px; }
+        .session-header.fixed-false { background-color: #8c5a12; }
+
+        .chat-box { padding: 15px 15px 30px; display: flex; flex-direction: column; gap: 15px; }
+
+        .message { max-width: 85%; padding: 12px; border-radius: 8px; position: relative; font-size: 0.95em; line-height: 1.5; box-shadow: 0 1px 2px rgba(0,0,0,0.15); white-space: pre-wrap; overflow-x: auto; }
+
+        /* Reasoning (Internal Monologue) - White/Gray */
+        .msg-reasoning { align-self: flex-start; background-color: #ffffff; border-top-left-radius: 0; border: 1px solid #ddd; }
+        .msg-reasoning::before { content: "🧠 THOUGHT"; display: block; font-size: 0.75em; color: #666; margin-bottom: 6px; font-weight: bold; letter-spacing: 0.5px; }
+
+        /* SQL Action - Light Green */
+        .msg-action { align-self: flex-end; background-color: #dcf8c6; border-top-right-radius: 0; font-family: "Consolas", monospace; font-size: 0.9em; }
+        .msg-action::before { content: "⚡ SQL COMMAND"; display: block; font-size: 0.75em; color: #075e54; margin-bottom: 6px; font-weight: bold; letter-spacing: 0.5px; }
+
+        /* System Output - Dark Terminal Style */
+        .msg-system { align-self: center; background-color: #2b2b2b; color: #efefef; font-family: "Consolas", monospace; font-size: 0.85em; width: 95%; border-radius: 6px; border-left: 5px solid #ff9800; }
+        .msg-system::before { content: "> TERMINAL OUTPUT"; display: block; font-size: 0.75em; color: #888; margin-bottom: 6px; border-bottom: 1px solid #444; padding-bottom: 4px; }
+        .msg-system table { border-collapse: collapse; white-space: normal; }
+        .msg-system th, .msg-system td { border: 1px solid #555; padding: 2px 6px; text-align: left; }
+
+        .latency-tag { position: absolute; bottom: -20px; right: 5px; font-size: 0.7em; color: #888; font-style: italic; }
+        .step-num { font-weight: bold; background: rgba(255,255,255,0.2); padding: 2px 6px; border-radius: 4px; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">Experiment Trace Logs</div>
+        <div class="toolbar" id="toolbar">
+            <input type="text" id="search" placeholder="Search session id, model, outcome...">
+            <label><input type="checkbox" id="deep"> search transcripts</label>
+            <span id="count"></span>
+        </div>
+        <div id="sessions"></div>
+        <div class="pager">
+            <button id="prev">&lsaquo; Prev</button><span id="page"></span><button id="next">Next &rsaquo;</button>
+        </div>
+    </div>
+    <script>
+        let COLS = [], ROWS = [];
+        const transcripts = {}, shards = {};
+        function traceIndex(cols, rows) { COLS = cols; ROWS = rows; }
+        function traceShard(id, steps) { (transcripts[id] = transcripts[id] || []).push(...steps); }
+    </script>
+    <script src="index.js"></script>
+    <script>
+        const PAGE_SIZE = 50;
+        const FILTERS = ["Variant", "Persona", "Model", "Outcome", "Is_Actually_Fixed"];
+        const col = Object.fromEntries(COLS.map((c, i) => [c, i]));
+        const $ = id => document.getElementById(id);
+        const selects = {};
+        let view = ROWS, page = 0, generation = 0;
+
+        function el(tag, cls, text) {
+            const e = document.createElement(tag);
+            if (cls) e.className = cls;
+            if (text !== undefined) e.textContent = text;
+            return e;
+        }
+
+        // Transcripts are only fetched when a session is opened (or searched)
+        function loadShard(n) {
+            if (!shards[n]) shards[n] = new Promise((resolve, reject) => {
+                const s = document.createElement("script");
+                s.src = "sessions/shard-" + String(n).padStart(5, "0") + ".js";
+                s.onload = resolve;
+                s.onerror = () => reject(new Error("Missing shard " + s.src));
+                document.head.appendChild(s);
+            });
+            return shards[n];
+        }
+
+        function renderOutput(step) {
+            const box = el("div", "message msg-system");
+            if (step[4] === "rows") {
+                try {
+                    const rows = JSON.parse(step[3]);
+                    if (Array.isArray(rows) && rows.length && typeof rows[0] === "object") {
+                        const table = el("table"), keys = Object.keys(rows[0]);
+                        const head = table.insertRow();
+                        keys.forEach(k => head.appendChild(el("th", null, k)));
+                        rows.forEach(r => { const tr = table.insertRow(); keys.forEach(k => { tr.insertCell().textContent = r[k]; }); });
+                        box.appendChild(table);
+                        return box;
+                    }
+                } catch (e) { /* fall back to the raw text */ }
+            }
+            box.appendChild(document.createTextNode(step[3]));
+            return box;
+        }
+
+        function renderTranscript(id, target) {
+            const steps = (transcripts[id] || []).slice().sort((a, b) => a[0] - b[0]);
+            target.replaceChildren();
+            steps.forEach(step => {
+                const thought = el("div", "message msg-reasoning", step[1]);
+                thought.appendChild(el("span", "latency-tag", step[5] + "ms"));
+                target.append(thought, el("div", "message msg-action", step[2]), renderOutput(step));
+            });
+        }
+
+        async function toggle(row, block) {
+            const open = block.querySelector(".chat-box");
+            if (open) { open.remove(); return; }
+            const chat = el("div", "chat-box", "Loading...");
+            block.appendChild(chat);
+            if (row[col.Shard] === null) { chat.textContent = "No trace rows for this session."; return; }
+            try {
+                await loadShard(row[col.Shard]);
+                renderTranscript(row[col.Session_UUID], chat);
+            } catch (e) {
+                chat.textContent = e.message;
+            }
+        }
+
+        function sessionBlock(row) {
+            const block = el("div", "session-block");
+            const header = el("div", "session-header fixed-" + row[col.Is_Actually_Fixed]);
+            header.append(
+                el("span", null, "Session: " + row[col.Session_UUID]),
+                el("span", null, [row[col.Variant], row[col.Persona], row[col.Model]].filter(v => v !== null).join(" · ")),
+                el("span", null, (row[col.Outcome] || "") + (row[col.Is_Actually_Fixed] ? " ✔" : "")),
+                el("span", "step-num", row[col.Steps] + " Steps")
+            );
+            header.onclick = () => toggle(row, block);
+            block.appendChild(header);
+            return block;
+        }
+
+        function render() {
+            const pages = Math.max(1, Math.ceil(view.length / PAGE_SIZE));
+            page = Math.min(page, pages - 1);
+            $("sessions").replaceChildren(...view.slice(page * PAGE_SIZE, (page + 1) * PAGE_SIZE).map(sessionBlock));
+            $("page").textContent = `Page ${page + 1} / ${pages}`;
+            $("count").textContent = `${view.length} of ${ROWS.length} sessions`;
+        }
+
+        const metaText = row => [row[col.Session_UUID], ...FILTERS.map(f => row[col[f]])].join(" ").toLowerCase();
+        const transcriptHas = (row, query) => (transcripts[row[col.Session_UUID]] || [])
+            .some(step => step.slice(1, 4).join(" ").toLowerCase().includes(query));
+
+        async function applyFilters() {
+            const current = ++generation;
+            const query = $("search").value.trim().toLowerCase();
+            let rows = ROWS.filter(r => FILTERS.every(f => !selects[f].value || String(r[col[f]]) === selects[f].value));
+            if (query && $("deep").checked) {
+                // Only the shards of sessions that survived the filters are loaded
+                const needed = [...new Set(rows.map(r => r[col.Shard]).filter(s => s !== null))];
+                for (let i = 0; i < needed.length; i++) {
+                    $("count").textContent = `Searching transcripts... ${i}/${needed.length} shards`;
+                    await loadShard(needed[i]).catch(() => {});
+                    if (current !== generation) return;
+                }
+                rows = rows.filter(r => metaText(r).includes(query) || transcriptHas(r, query));
+            } else if (query) {
+                rows = rows.filter(r => metaText(r).includes(query));
+            }
+            view = rows;
+            page = 0;
+            render();
+        }
+
+        FILTERS.forEach(f => {
+            const select = el("select");
+            select.appendChild(new Option("All " + f.replace(/_/g, " "), ""));
+            [...new Set(ROWS.map(r => String(r[col[f]])))].sort().forEach(v => select.appendChild(new Option(v, v)));
+            select.onchange = applyFilters;
+            selects[f] = select;
+            $("toolbar").insertBefore(select, $("search"));
+        });
+        $("search").oninput = applyFilters;
+        $("deep").onchange = applyFilters;
+        $("prev").onclick = () => { page = Math.max(0, page - 1); render(); };
+        $("next").onclick = () => { page += 1; render(); };
+        render();
+    </script>
+</body>
+</html>
+"""
 
-    # 5. Write to file
-    with open(OUTPUT_HTML, "w", encoding="utf-8") as f:
-        f.write(html_content)
-    
-    print(f"✅ Generated '{OUTPUT_HTML}'. Open it in your browser to view the chat replay!")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the paginated, lazily loaded trace viewer.")
+    parser.add_argument("trace", nargs="?", default=None,
+                        help="Trace log (.csv, .parquet or .arrows). Defaults to the newest in os_logs/.")
+    parser.add_argument("--metrics", default=None,
+                        help="Metrics log to join session metadata from (default: the trace's sibling).")
+    parser.add_argument("--out", default=OUTPUT_DIR)
+    parser.add_argument("--sessions-per-shard", type=int, default=SESSIONS_PER_SHARD)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    generate_html()
\ No newline at end of file
+    args = parse_args()
+    trace_path = args.trace or latest_trace()
+    if not trace_path or not os.path.exists(trace_path):
+        print(f"❌ Error: File not found at {trace_path or LOG_DIR + '/os_trace_*'}")
+    else:
+        generate_viewer(trace_path, args.metrics, args.out, args.sessions_per_shard)